@@ -2,26 +2,271 @@
 
 Endpoints here will be the external HTTP surface for interacting with the agent.
 Keep actual business logic in services/ to make the router minimal.
+
+Besides the JSON endpoint, turns can be streamed: POST /message/stream
+answers with Server-Sent Events and /ws keeps a WebSocket open for a whole
+conversation. Both relay the turn's progress events (session, filters,
+question, one property per row, reply) and end with `done` (the same body
+as POST /message) or `error`.
 """
 
-from fastapi import APIRouter, HTTPException
-from app.models.schemas import AgentMessage
-from app.services import agent_service, session_manager
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from app.models.schemas import AgentMessage, BatchExtractionRequest
+from app.config import get_settings
+from app.services import admission, agent_service, batch_extraction, pagination, session_manager
+from app.services import db as db_service
+from app.utils import json_codec
+
+settings = get_settings()
 
 router = APIRouter()
 
+_CONFLICT_DETAIL = "La sesión cambió en otra pestaña o dispositivo; vuelve a enviar el mensaje."
+
+
+async def _relay_turn(
+    session_id: str | None,
+    message: str,
+    bound: dict[str, Any] | None = None,
+) -> AsyncIterator[tuple[str, Any]]:
+    """Run one turn and yield its (event, data) pairs as they happen.
+
+    `bound` holds the conversation state of a long-lived connection; it is
+    passed to the turn and updated with the state the turn leaves behind.
+    A bound state idle for longer than the session TTL is dropped, so the
+    turn goes back to the store like any other request would.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    if bound is not None and time.monotonic() - bound.get("at", 0.0) > settings.session_ttl_seconds:
+        bound["state"] = None
+
+    async def run() -> Any:
+        async with admission.admit(session_id):
+            response, state = await agent_service.run_turn(
+                session_id,
+                message,
+                emit=lambda event, data: queue.put_nowait((event, data)),
+                bound_state=bound.get("state") if bound is not None else None,
+            )
+            try:
+                await session_manager.commit(response["session_id"])
+            except session_manager.SessionConflict:
+                if bound is not None:
+                    # The bound state lost to a newer one; reload it next turn
+                    bound["state"] = None
+                raise
+        if bound is not None:
+            bound["state"] = state
+            bound["at"] = time.monotonic()
+        return response
+
+    task = asyncio.ensure_future(run())
+    # Sentinel after the last event
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+    try:
+        while (item := await queue.get()) is not None:
+            yield item
+        try:
+            response = task.result()
+        except admission.Overloaded as exc:
+            yield "error", {"status": 429, "detail": "Servidor ocupado", "retry_after": exc.retry_after}
+            return
+        except session_manager.SessionConflict:
+            yield "error", {"status": 409, "detail": _CONFLICT_DETAIL}
+            return
+        except Exception:
+            yield "error", {"status": 500, "detail": "Error al procesar el mensaje"}
+            return
+        yield "done", response
+    finally:
+        # Client went away mid-turn
+        if not task.done():
+            task.cancel()
+
+
+def _sse(event: str, data: Any) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + json_codec.dumps(data) + b"\n\n"
+
 
 @router.post("/message")
 async def post_message(payload: AgentMessage):
-    """Receive a message and forward to the agent service."""
-    result = await agent_service.handle_message(payload.session_id, payload.message)
-    return result
+    """Receive a message and forward to the agent service.
 
+    Turns of one session run one at a time; under overload the turn is
+    rejected with 429 and a Retry-After hint instead of queueing forever.
+    A turn that raced one on another worker is rejected with 409.
+    """
+    try:
+        async with admission.admit(payload.session_id):
+            result = await agent_service.handle_message(payload.session_id, payload.message)
+            # Commit the turn before replying so the next message may hit any worker
+            await session_manager.commit(result["session_id"])
+    except session_manager.SessionConflict:
+        raise HTTPException(status_code=409, detail=_CONFLICT_DETAIL)
+    except admission.Overloaded as exc:
+        raise HTTPException(
+            status_code=429,
+            detail="Servidor ocupado, intenta de nuevo en unos segundos.",
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+    return json_codec.JSONBody(result)
 
-@router.get("/properties/{session_id}")
-async def get_properties(session_id: str):
-    """Return last query results for a session (if any)."""
-    sql, results = session_manager.load_query_result(session_id)
-    if sql is None and results is None:
+
+def _session_filters(session_id: str) -> dict:
+    """Filters of the session's last search (400 when it has none)."""
+    sql, _ = session_manager.load_query_result(session_id)
+    state = session_manager.load_conversation_state(session_id)
+    if sql is None or state is None:
         raise HTTPException(status_code=400, detail="No search executed for this session")
-    return {"session_id": session_id, "count": len(results) if results else 0, "properties": results or [], "sql_query": sql}
+    return state.collected_filters
+
+
+@router.get("/properties/{session_id}")
+async def get_properties(
+    session_id: str,
+    cursor: str | None = None,
+    page_size: int | None = Query(None, ge=1),
+):
+    """Return last query results for a session (if any).
+
+    Without `cursor`/`page_size` the saved results of the last turn are
+    replayed. Otherwise the page after `cursor` is fetched by keyset
+    (`next_cursor` is null on the last page).
+    """
+    if cursor is None and page_size is None:
+        sql, results = session_manager.load_query_result(session_id)
+        if sql is None and results is None:
+            raise HTTPException(status_code=400, detail="No search executed for this session")
+        state = session_manager.load_conversation_state(session_id)
+        next_cursor = None
+        if state is not None and results:
+            next_cursor = pagination.next_cursor(state.collected_filters, results, settings.properties_limit)
+        return json_codec.JSONBody({
+            "session_id": session_id,
+            "count": len(results) if results else 0,
+            "properties": results or [],
+            "sql_query": sql,
+            "next_cursor": next_cursor,
+        })
+
+    filters = _session_filters(session_id)
+    size = min(page_size or settings.properties_limit, settings.properties_page_max_size)
+    try:
+        sql, results, next_cursor = await pagination.fetch_page(filters, cursor, size)
+    except pagination.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    except admission.Overloaded as exc:
+        raise HTTPException(
+            status_code=429,
+            detail="Servidor ocupado, intenta de nuevo en unos segundos.",
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+    return json_codec.JSONBody({
+        "session_id": session_id,
+        "count": len(results),
+        "properties": results,
+        "sql_query": sql,
+        "next_cursor": next_cursor,
+    })
+
+
+@router.get("/properties/{session_id}/export")
+async def export_properties(session_id: str, cursor: str | None = None):
+    """Every result of the session's filters as NDJSON, one property per line.
+
+    Rows are read from a server-side cursor and written as they arrive. An
+    export cut short by its limits ends with an error line whose
+    `next_cursor` continues after the last property written.
+    """
+    filters = _session_filters(session_id)
+    try:
+        rows = pagination.export(filters, cursor)
+    except pagination.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    async def lines():
+        last = None
+        try:
+            async for last in rows:
+                yield json_codec.dumps(last) + b"\n"
+        except db_service.StreamAborted:
+            resume = pagination.encode_cursor(filters, last) if last is not None else cursor
+            yield json_codec.dumps({"error": "Exportación interrumpida", "next_cursor": resume}) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.post("/extract:batch")
+async def extract_batch(payload: BatchExtractionRequest):
+    """Filters of many independent texts as NDJSON, one line per text in order.
+
+    Texts are packed several per LLM call (see services.batch_extraction);
+    lines are written as soon as every earlier one is ready.
+    """
+    if len(payload.texts) > settings.llm_batch_max_texts:
+        raise HTTPException(status_code=413, detail=f"Máximo {settings.llm_batch_max_texts} textos por solicitud")
+
+    async def lines():
+        async for item in batch_extraction.extract_many(payload.texts):
+            yield json_codec.dumps(item) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.post("/message/stream")
+async def post_message_stream(payload: AgentMessage):
+    """Same as /message, streamed as Server-Sent Events."""
+
+    async def events():
+        async for event, data in _relay_turn(payload.session_id, payload.message):
+            yield _sse(event, data)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws")
+async def agent_socket(websocket: WebSocket, session_id: str | None = None):
+    """Conversation over one WebSocket: send {"message": ...}, receive events.
+
+    The session stays bound to the connection: its state is kept here
+    between turns instead of being loaded from the store each time, and
+    turns run one after another in arrival order. Saving it is checked
+    against the store like any other write, so if the session was reset or
+    saved elsewhere meanwhile the turn fails with 409 and the next one
+    reloads it. Binary frames and frames that are not valid JSON get an
+    error event and the connection stays open.
+    """
+    await websocket.accept()
+    bound: dict[str, Any] = {"state": None, "at": 0.0}
+    try:
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            if frame.get("text") is None:
+                await websocket.send_json({"event": "error", "data": {"status": 400, "detail": "Se esperaba un mensaje de texto"}})
+                continue
+            try:
+                payload = json.loads(frame["text"])
+            except ValueError:
+                await websocket.send_json({"event": "error", "data": {"status": 400, "detail": "JSON inválido"}})
+                continue
+            message = str(payload.get("message") or "").strip() if isinstance(payload, dict) else ""
+            if not message:
+                await websocket.send_json({"event": "error", "data": {"status": 400, "detail": "Mensaje vacío"}})
+                continue
+            async for event, data in _relay_turn(session_id, message, bound):
+                if event == "session":
+                    session_id = data["session_id"]
+                await websocket.send_text(json_codec.dumps({"event": event, "data": data}).decode())
+    except WebSocketDisconnect:
+        pass
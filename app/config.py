@@ -16,15 +16,143 @@ class Settings(BaseSettings):
     # LLM Config
     llm_model: str = "gpt-4o-mini"
     llm_temperature: float = 0.0
+    llm_request_timeout_seconds: float = 15.0
+    llm_max_retries: int = 2
+    llm_retry_base_delay_seconds: float = 0.25
+    llm_retry_max_delay_seconds: float = 2.0
+    llm_max_concurrency: int = 32
+    llm_pool_max_connections: int = 64
+    llm_pool_max_keepalive: int = 32
+    llm_keepalive_expiry_seconds: float = 30.0
+    llm_hedge_enabled: bool = False
+    llm_hedge_percentile: float = 0.95
+    llm_hedge_min_samples: int = 20
+    llm_latency_window: int = 200
+    llm_cache_enabled: bool = True
+    llm_cache_max_entries: int = 2048
+    llm_cache_ttl_seconds: float = 3600.0
+    # JSON-schema constrained answers (app.prompts.extraction); off for models without support
+    llm_structured_output: bool = True
+    llm_extraction_max_tokens: int = 120
+    # Bulk extraction (POST /extract:batch): several messages per LLM call
+    llm_batch_max_items: int = 20
+    llm_batch_max_prompt_tokens: int = 2000
+    llm_batch_output_tokens_per_item: int = 80
+    llm_batch_concurrency: int = 4
+    llm_batch_max_texts: int = 10000
+
+    # Rule-based fast path (skips the LLM for confident local extractions)
+    fast_path_enabled: bool = True
+    fast_path_min_confidence: float = 0.8
     
     # App Config
     app_name: str = "SQL Agent"
     debug: bool = False
     database_url: str | None = None
+    # Read replicas, as a JSON list: DATABASE_REPLICA_URLS='["postgresql://...", ...]'
+    database_replica_urls: list[str] = []
+    db_health_check_interval_seconds: float = 5.0
+    db_health_check_timeout_seconds: float = 2.0
+    db_eject_after_failures: int = 3
+    db_readmit_after_successes: int = 2
+    db_pool_min_size: int = 10
+    db_pool_max_size: int = 20
+    db_max_inactive_connection_lifetime: float = 300.0
+    db_statement_cache_size: int = 32
+    db_command_timeout: float = 10.0
+    # LISTEN/NOTIFY row-change feed (triggers: python -m app.services.change_feed)
+    db_change_listener_enabled: bool = True
+    db_change_channel: str = "property_changes"
+    db_change_debounce_seconds: float = 0.05
+    db_change_reconnect_max_seconds: float = 30.0
+    # Coalesce identical concurrent searches and keep results briefly
+    db_result_cache_enabled: bool = True
+    db_result_cache_max_entries: int = 1024
+    db_result_cache_ttl_seconds: float = 2.0
+
+    # In-memory columnar property index (requires numpy)
+    property_index_enabled: bool = False
+    property_index_refresh_seconds: float = 300.0
+    property_index_version_column: str | None = None
+    property_index_full_reload_every: int = 12
+
+    # Speculative prefetch while the last essential filter is asked for
+    prefetch_enabled: bool = True
+    prefetch_max_rows: int = 200
+    prefetch_max_bytes: int = 512 * 1024
+    prefetch_max_sessions: int = 1000
+
+    # Top-k cube: result-ordered rows per (distrito, estado, dormitorios).
+    # Only answers while the change listener is connected; install the triggers first
+    topk_cube_enabled: bool = False
+    topk_cube_bucket_max_rows: int = 500
+    topk_cube_max_bytes: int = 32 * 1024 * 1024
+    topk_cube_refresh_seconds: float = 60.0
+    topk_cube_ttl_seconds: float = 600.0
+
+    # Session-local candidate set answering follow-up refinements
+    refine_enabled: bool = True
+    refine_max_rows: int = 100
+    refine_max_bytes: int = 256 * 1024
+    refine_ttl_seconds: float = 300.0
+    # Load candidates for known filters while a follow-up is being extracted
+    speculative_search_enabled: bool = True
     properties_limit: int = 5
+    # Keyset pages of GET /properties/{session_id} and streamed exports
+    properties_page_max_size: int = 100
+    properties_export_prefetch: int = 500
+    # An export is cut short past these, or when its client stops reading
+    properties_export_max_rows: int = 100_000
+    properties_export_max_seconds: float = 300.0
+    properties_export_stall_seconds: float = 30.0
+
+    # Admission control: per-session serialization and load shedding
+    admission_enabled: bool = True
+    admission_max_concurrency: int = 64
+    admission_max_queue: int = 256
+    admission_deadline_seconds: float = 15.0
+    admission_session_max_pending: int = 4
+    llm_max_queue: int = 256
+    db_max_concurrency: int | None = None  # defaults to db_pool_max_size per pool (primary + replicas)
+    db_max_queue: int = 512
+
+    # Results kept as shared tuples and responses encoded with orjson (if installed)
+    fast_json_enabled: bool = True
+
+    # Index advisor: search shapes, sampled EXPLAIN ANALYZE of slow ones (opt-in)
+    index_advisor_enabled: bool = False
+    index_advisor_slow_ms: float = 100.0
+    index_advisor_sample_rate: float = 0.05
+    index_advisor_plans_per_shape: int = 5
+
+    # Write-behind turn log: gzip JSONL segments for analytics and replay
+    turn_log_enabled: bool = False
+    turn_log_dir: str = "turn_logs"
+    turn_log_buffer_size: int = 10000
+    turn_log_flush_seconds: float = 1.0
+    turn_log_flush_rows: int = 1000
+    turn_log_segment_max_bytes: int = 64 * 1024 * 1024
+    turn_log_segment_max_seconds: float = 3600.0
+    turn_log_retain_segments: int = 168
+    turn_log_compress_level: int = 6
+
+    # Metrics (/metrics in Prometheus text format) and, independently, Server-Timing headers
+    metrics_enabled: bool = True
+    metrics_server_timing: bool = False
+
+    # Sessions ("memory" per process, or "sqlite" shared by all workers)
+    session_backend: str = "memory"
+    session_sqlite_path: str = "sessions.sqlite3"
+    session_ttl_seconds: float = 3600.0
+    session_max_count: int = 10000
+    session_max_bytes: int = 64 * 1024 * 1024
+    session_max_messages: int = 20
+    session_sweep_interval_seconds: float = 60.0
     api_host: str = "127.0.0.1"
     api_port: int = 8000
     api_reload: bool = False
+    # /admin/* answers 404 unless set; clients send it as a Bearer token
+    admin_token: str | None = None
 
 @lru_cache
 def get_settings() -> Settings:
@@ -0,0 +1,167 @@
+"""Small async dataflow executor.
+
+A `Workflow` is a set of `Node`s. Each node names the values it consumes
+(`inputs`) and the values it produces (`outputs`); edges are implied by
+those names. `run(**initial)` starts every node as soon as all its inputs
+exist, so independent nodes run concurrently. Each node gets its own
+timeout and a timing span (`graph.<name>`, see utils.metrics); `run_timed`
+also returns each node's wall time. When a node
+fails, the other running nodes are cancelled and the error propagates
+unchanged.
+
+Adding a stage means declaring a node with its inputs; its position in the
+schedule follows from the data it needs.
+"""
+
+import asyncio
+import inspect
+import time
+from collections.abc import Iterable
+from typing import Any, Callable
+from app.utils import metrics
+
+
+class WorkflowError(Exception):
+    """Invalid graph (unknown input, duplicate output, cycle) or stuck run."""
+
+
+class NodeTimeoutError(WorkflowError):
+    def __init__(self, name: str, timeout: float) -> None:
+        super().__init__(f"Node {name!r} timed out after {timeout}s")
+        self.name = name
+        self.timeout = timeout
+
+
+class Node:
+    """One stage: `func(**inputs)` returning its outputs.
+
+    With one output the return value is that output; with several, a tuple
+    in `outputs` order; with none, the return value is ignored. `func` may
+    be sync (for cheap stages) or async.
+    """
+
+    __slots__ = ("name", "func", "inputs", "outputs", "timeout", "is_async")
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[..., Any],
+        inputs: Iterable[str] = (),
+        outputs: Iterable[str] = (),
+        timeout: float | None = None,
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.timeout = timeout
+        self.is_async = inspect.iscoroutinefunction(func)
+
+    def publish(self, result: Any) -> dict[str, Any]:
+        if not self.outputs:
+            return {}
+        if len(self.outputs) == 1:
+            return {self.outputs[0]: result}
+        if not isinstance(result, tuple) or len(result) != len(self.outputs):
+            raise WorkflowError(f"Node {self.name!r} must return {len(self.outputs)} values")
+        return dict(zip(self.outputs, result))
+
+
+def node(
+    inputs: Iterable[str] = (),
+    outputs: Iterable[str] = (),
+    timeout: float | None = None,
+    name: str | None = None,
+) -> Callable[[Callable[..., Any]], Node]:
+    """Decorator turning a function into a `Node`."""
+
+    def decorate(func: Callable[..., Any]) -> Node:
+        return Node(name or func.__name__, func, inputs, outputs, timeout)
+
+    return decorate
+
+
+class Workflow:
+    """Validated graph of nodes; `run` executes it."""
+
+    def __init__(self, nodes: Iterable[Node], inputs: Iterable[str] = ()) -> None:
+        self.nodes = list(nodes)
+        self.inputs = tuple(inputs)
+        producers: dict[str, str] = {name: "<input>" for name in self.inputs}
+        for n in self.nodes:
+            for output in n.outputs:
+                if output in producers:
+                    raise WorkflowError(f"{output!r} produced by both {producers[output]!r} and {n.name!r}")
+                producers[output] = n.name
+        for n in self.nodes:
+            for name in n.inputs:
+                if name not in producers:
+                    raise WorkflowError(f"Node {n.name!r} needs {name!r}, which nothing produces")
+        self._check_acyclic(producers)
+
+    def _check_acyclic(self, producers: dict[str, str]) -> None:
+        available = set(self.inputs)
+        remaining = list(self.nodes)
+        while remaining:
+            ready = [n for n in remaining if all(i in available for i in n.inputs)]
+            if not ready:
+                raise WorkflowError(f"Cycle between {sorted(n.name for n in remaining)}")
+            for n in ready:
+                available.update(n.outputs)
+                remaining.remove(n)
+
+    async def _run_node(self, n: Node, kwargs: dict[str, Any], timings: dict[str, float]) -> dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            with metrics.span(f"graph.{n.name}"):
+                if not n.is_async:
+                    return n.publish(n.func(**kwargs))
+                try:
+                    result = await asyncio.wait_for(n.func(**kwargs), n.timeout)
+                except asyncio.TimeoutError:
+                    if n.timeout is None:
+                        raise
+                    raise NodeTimeoutError(n.name, n.timeout) from None
+                return n.publish(result)
+        finally:
+            timings[n.name] = time.perf_counter() - started
+
+    async def run(self, **initial: Any) -> dict[str, Any]:
+        """Execute the graph; returns every input and output value by name."""
+        values, _ = await self.run_timed(**initial)
+        return values
+
+    async def run_timed(self, **initial: Any) -> tuple[dict[str, Any], dict[str, float]]:
+        """`run`, also returning the wall time of every node in seconds."""
+        missing = [name for name in self.inputs if name not in initial]
+        if missing:
+            raise WorkflowError(f"Missing workflow inputs: {missing}")
+        values = dict(initial)
+        timings: dict[str, float] = {}
+        pending = list(self.nodes)
+        running: dict[asyncio.Task, Node] = {}
+
+        def start_ready() -> None:
+            for n in list(pending):
+                if all(i in values for i in n.inputs):
+                    pending.remove(n)
+                    kwargs = {i: values[i] for i in n.inputs}
+                    running[asyncio.ensure_future(self._run_node(n, kwargs, timings))] = n
+
+        try:
+            start_ready()
+            while running:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    running.pop(task)
+                    values.update(task.result())
+                start_ready()
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+        if pending:
+            raise WorkflowError(f"Nodes never became ready: {[n.name for n in pending]}")
+        return values, timings
@@ -1,8 +1,24 @@
-from fastapi import FastAPI
+import secrets
+import time
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from contextlib import asynccontextmanager
 from app.config import get_settings
+from app.services import admission
+from app.services import batch_extraction
+from app.services import change_feed
 from app.services import db as db_service
+from app.services import index_advisor
+from app.services import llm_client
+from app.services import parser
+from app.services import prefetch
+from app.services import search_service
+from app.services import session_manager
+from app.services import property_index
+from app.services import topk_cube
+from app.services import turn_log
+from app.utils import metrics
 
 # Attempt to import the agent router if the package is present. This file
 # remains runnable even if the skeleton packages are not yet populated.
@@ -22,18 +38,155 @@ async def lifespan(app: FastAPI):
     except Exception:
         # If DB not configured, skip initialization (tests/dev)
         pass
+    try:
+        await db_service.start_change_listener()
+    except Exception:
+        # Caches fall back to their TTLs and periodic refreshes
+        pass
+    try:
+        await llm_client.init_llm_client()
+    except Exception:
+        # Missing API key: the client is created lazily on first use instead
+        pass
+    session_manager.start_session_sweeper()
+    await turn_log.start()
+    try:
+        await property_index.start()
+    except Exception:
+        # Searches fall back to Postgres until the next refresh succeeds
+        pass
+    try:
+        await topk_cube.start()
+    except Exception:
+        # Buckets are still built on demand; the version baseline is retried
+        pass
     
     yield
     
     # Shutdown
+    await session_manager.stop_session_sweeper()
+    await turn_log.stop()
+    await property_index.stop()
+    await topk_cube.stop()
+    await db_service.stop_change_listener()
     try:
         await db_service.close_db_pool()
     except Exception:
         pass
+    try:
+        await llm_client.close_llm_client()
+    except Exception:
+        pass
+
+
+class RequestTimingMiddleware:
+    """Time each HTTP request: the duration histogram and/or a Server-Timing header."""
+
+    def __init__(self, app, histogram: bool = True, server_timing: bool = False):
+        self.app = app
+        self.histogram = histogram
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        token = None
+        if self.server_timing:
+            token, spans = metrics.start_request_trace()
 
+            async def send_with_timing(message):
+                if message["type"] == "http.response.start":
+                    header = metrics.server_timing_header(spans, time.perf_counter() - started)
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode())]
+                await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing if token is not None else send)
+        finally:
+            if token is not None:
+                metrics.finish_request_trace(token)
+            if self.histogram:
+                # Route template, not the raw path, to keep label cardinality fixed
+                route = getattr(scope.get("route"), "path", "unmatched")
+                metrics.observe("http_request_duration_seconds", time.perf_counter() - started, route=route)
+
+
+def _service_metrics():
+    """Scrape-time view of the stats each service already keeps."""
+    yield "active_sessions", "gauge", "Sessions held by the session store", (), session_manager.get_active_sessions_count()
+    cache = llm_client.get_extraction_cache_stats()
+    for event in ("hits", "misses", "coalesced"):
+        yield "llm_cache_events_total", "counter", "LLM extraction cache lookups", (("event", event),), cache[event]
+    for purpose, tokens in llm_client.get_token_stats().items():
+        if tokens["prompt"]:
+            ratio = tokens["cached"] / tokens["prompt"]
+            yield "llm_prompt_cached_ratio", "gauge", "Share of prompt tokens served from the provider cache", (("purpose", purpose),), ratio
+    for path, count in parser.get_extraction_path_stats().items():
+        yield "extraction_path_total", "counter", "Filter extractions per path", (("path", path),), count
+    batch = batch_extraction.get_batch_extraction_stats()
+    for source in ("empty", "rules", "cache", "batch_items", "retried", "failed"):
+        yield "batch_extraction_items_total", "counter", "Bulk extraction items per outcome", (("outcome", source),), batch[source]
+    yield "batch_extraction_calls_total", "counter", "Multi-item LLM calls", (), batch["batch_calls"]
+    yield "batch_extraction_call_failures_total", "counter", "Multi-item LLM calls retried item by item", (), batch["batch_failures"]
+    for engine, count in search_service.get_search_stats().items():
+        yield "search_engine_total", "counter", "Searches per answering engine", (("engine", engine),), count
+    prefetched = prefetch.get_prefetch_stats()
+    for outcome in ("hits", "misses", "stale", "overflow"):
+        yield "prefetch_total", "counter", "Prefetch outcomes", (("outcome", outcome),), prefetched[outcome]
+    admitted = admission.get_admission_stats()
+    for gate, stats in admitted["gates"].items():
+        yield "admission_in_flight", "gauge", "Slots held per admission gate", (("gate", gate),), stats["active"]
+        yield "admission_queue_depth", "gauge", "Waiters per admission gate", (("gate", gate),), stats["waiting"]
+        for reason in ("full", "deadline"):
+            yield ("admission_rejected_total", "counter", "Shed requests per gate and reason",
+                   (("gate", gate), ("reason", reason)), stats[f"rejected_{reason}"])
+    yield "admission_session_serialized_total", "counter", "Turns that waited for their session", (), admitted["sessions"]["serialized"]
+    yield ("admission_rejected_total", "counter", "Shed requests per gate and reason",
+           (("gate", "session"), ("reason", "any")), admitted["sessions"]["rejected"])
+    cube = topk_cube.get_cube_stats(top=0)
+    for outcome in ("hits", "misses", "truncated", "unfed"):
+        yield "topk_cube_lookups_total", "counter", "Top-k cube lookups", (("outcome", outcome),), cube[outcome]
+    yield "topk_cube_buckets", "gauge", "Loaded top-k cube buckets", (), cube["buckets"]
+    yield "topk_cube_bytes", "gauge", "Estimated size of the top-k cube", (), cube["bytes"]
+    yield "topk_cube_evictions_total", "counter", "Cold buckets evicted", (), cube["evictions"]
+    results = db_service.get_result_cache_stats()
+    for event in ("hits", "misses", "coalesced"):
+        yield "db_result_cache_events_total", "counter", "Search result cache lookups", (("event", event),), results[event]
+    for node, stats in db_service.get_node_stats().items():
+        labels = (("node", node),)
+        yield "db_pool_connections", "gauge", "Pooled DB connections", labels + (("state", "idle"),), stats["idle"]
+        yield ("db_pool_connections", "gauge", "Pooled DB connections",
+               labels + (("state", "busy"),), stats["size"] - stats["idle"])
+        yield "db_node_healthy", "gauge", "1 while the node receives reads", labels, int(stats["healthy"])
+        yield "db_node_outstanding", "gauge", "Requests in flight per node", labels, stats["outstanding"]
+        for event in ("ejections", "readmissions"):
+            yield "db_node_events_total", "counter", "Node ejections and re-admissions", labels + (("event", event),), stats[event]
+    logged = turn_log.get_turn_log_stats()
+    yield "turn_log_pending", "gauge", "Turn records buffered for the writer", (), logged["pending"]
+    for event in ("recorded", "written", "dropped", "backpressure"):
+        yield "turn_log_records_total", "counter", "Turn log records by outcome", (("event", event),), logged[event]
+    yield "turn_log_write_errors_total", "counter", "Failed turn log writes", (), logged["write_errors"]
+    feed = change_feed.get_change_feed_stats()
+    yield "db_change_listener_connected", "gauge", "1 while the LISTEN connection is up", (), feed["listener"]["connected"]
+    yield "db_change_notifications_total", "counter", "Row-change notifications received", (), feed["listener"]["notifications"]
+    yield "db_change_resyncs_total", "counter", "Cache resyncs after (re)connecting", (), feed["resyncs"]
+    for outcome in ("rows_patched", "rows_deleted", "apply_errors"):
+        yield "db_change_rows_total", "counter", "Changed rows applied to the caches", (("outcome", outcome),), feed[outcome]
+
+
+metrics.register_collector(_service_metrics)
 
 app = FastAPI(title=settings.app_name, debug=settings.debug, lifespan=lifespan)
 
+if settings.metrics_enabled or settings.metrics_server_timing:
+    app.add_middleware(
+        RequestTimingMiddleware,
+        histogram=settings.metrics_enabled,
+        server_timing=settings.metrics_server_timing,
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -48,6 +201,40 @@ async def health_check():
     return {"status": "ok", "app_name": settings.app_name, "version": "1.0.0"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+def _require_admin(authorization: str | None = Header(default=None)) -> None:
+    """Admin routes are off without ADMIN_TOKEN and need it as a Bearer token."""
+    if not settings.admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(token.encode(), settings.admin_token.encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized", headers={"WWW-Authenticate": "Bearer"})
+
+
+admin = APIRouter(prefix="/admin", dependencies=[Depends(_require_admin)])
+
+
+@admin.get("/index-advisor")
+async def index_advice(limit: int = 10, format: str = "json"):
+    """Index suggestions for the recorded search workload (`format=sql` for DDL)."""
+    if format == "sql":
+        return PlainTextResponse(index_advisor.render_ddl(limit), media_type="text/plain; charset=utf-8")
+    return index_advisor.report(limit)
+
+
+@admin.get("/topk-cube")
+async def topk_cube_stats(top: int = 10):
+    """Top-k cube hit rate and the sizes of its hottest buckets."""
+    return topk_cube.get_cube_stats(top)
+
+
+app.include_router(admin)
+
+
 # Mount the agent router if available. The router will be created under
 # `app/api/v1/agent_router.py` as part of the skeleton.
 if agent_router is not None and hasattr(agent_router, "router"):
@@ -8,19 +8,19 @@ from typing import Optional
 
 
 class FilterEssential(BaseModel):
-    distrito: str
-    area_min: Optional[float]
-    estado: Optional[str]
-    presupuesto_max: Optional[float]
-    dormitorios: Optional[int]
+    distrito: Optional[str] = None
+    area_min: Optional[float] = None
+    estado: Optional[str] = None
+    presupuesto_max: Optional[float] = None
+    dormitorios: Optional[int] = None
 
 
 class FilterOptional(BaseModel):
-    pet_friendly: Optional[bool]
-    balcon: Optional[bool]
-    terraza: Optional[bool]
-    amoblado: Optional[bool]
-    banios: Optional[int]
+    pet_friendly: Optional[bool] = None
+    balcon: Optional[bool] = None
+    terraza: Optional[bool] = None
+    amoblado: Optional[bool] = None
+    banios: Optional[int] = None
 
 
 class AgentMessage(BaseModel):
@@ -28,7 +28,13 @@ class AgentMessage(BaseModel):
     message: str
 
 
+class BatchExtractionRequest(BaseModel):
+    texts: list[str]
+
+
 class AgentResponse(BaseModel):
     session_id: Optional[str]
     reply: str
     data: Optional[list] = None
+    # Filter relaxations that would return results, when data is empty
+    suggestions: Optional[list] = None
@@ -1,6 +1,6 @@
 """Internal state models for conversation flow."""
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from typing import Dict, Any, List
 
 
@@ -10,3 +10,5 @@ class ConversationState(BaseModel):
     collected_filters: Dict[str, Any] = {}
     required_remaining: List[str] = []
     optional_allowed: int = 3
+    # Store version this state was read or last written at (SQLite backend)
+    _version: int | None = PrivateAttr(default=None)
@@ -0,0 +1,3 @@
+"""Prompt templates and response schemas for the LLM calls."""
+
+__all__ = ["extraction"]
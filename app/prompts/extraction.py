@@ -0,0 +1,116 @@
+"""Filter-extraction prompts, built from the conversation state.
+
+Every request starts with the same system message (and, with structured
+output, the same response schema), so the provider can reuse its cached
+prefix across turns and sessions. Only the last user message changes: the
+field the agent just asked for and the user's text. With that context a
+bare "80" or "sí" resolves to the pending field instead of needing another
+question. The filters already collected are not sent: the answer depends
+only on (text, pending), so it can be cached across sessions, and the
+parser merges it into the session's filters.
+
+The answer is constrained by a JSON schema derived from FilterEssential and
+FilterOptional: every filter is present, null when not mentioned. It is a
+few dozen tokens, so the output caps are tight (`llm_extraction_max_tokens`,
+`llm_batch_output_tokens_per_item`).
+
+Bump PROMPT_VERSION whenever a prompt or schema changes: it is part of the
+extraction cache key.
+"""
+
+import json
+import typing
+from typing import Any
+from app.models.schemas import FilterEssential, FilterOptional
+from app.services.rule_extractor import ESTADOS
+
+
+PROMPT_VERSION = "3"
+
+SYSTEM_PROMPT = """Extraes filtros de búsqueda de propiedades (Lima, Perú) del mensaje de un usuario.
+Responde solo con el objeto JSON pedido; usa null en cada filtro que el mensaje no indique.
+- distrito: nombre del distrito.
+- area_min: m² mínimos. presupuesto_max: monto máximo como número ("300 mil" = 300000).
+- estado: DISPONIBLE, OCUPADA, MANTENIMIENTO o VENDIDA.
+- dormitorios, banios: enteros ("3 ambientes" = 2 dormitorios).
+- pet_friendly, balcon, terraza, amoblado: true/false solo si se mencionan.
+Si se indica el dato pendiente (el que se acaba de preguntar), un mensaje breve ("80", "sí", "el primero") responde ese dato.
+No inventes valores."""
+
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + """
+Recibirás {"mensajes": [{"id": 0, "texto": "..."}, ...]}: mensajes independientes, sin contexto.
+Devuelve {"resultados": [{"id": 0, "filtros": {...}}, ...]} con un resultado por mensaje y el mismo id."""
+
+_JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean"}
+
+
+def _field_schema(name: str, annotation: Any) -> dict[str, Any]:
+    # Optional[X] -> X
+    base = next(arg for arg in typing.get_args(annotation) or (annotation,) if arg is not type(None))
+    schema: dict[str, Any] = {"type": [_JSON_TYPES[base], "null"]}
+    if name == "estado":
+        schema["enum"] = sorted(set(ESTADOS.values())) + [None]
+    return schema
+
+
+def _filters_schema() -> dict[str, Any]:
+    fields = {**FilterEssential.model_fields, **FilterOptional.model_fields}
+    return {
+        "type": "object",
+        "properties": {name: _field_schema(name, field.annotation) for name, field in fields.items()},
+        "required": list(fields),
+        "additionalProperties": False,
+    }
+
+
+FILTERS_SCHEMA = _filters_schema()
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "filtros", "strict": True, "schema": FILTERS_SCHEMA},
+}
+
+BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "filtros_lote",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "resultados": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"id": {"type": "integer"}, "filtros": FILTERS_SCHEMA},
+                        "required": ["id", "filtros"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["resultados"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def _compact(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+
+def build_messages(text: str, pending: str | None = None) -> list[dict[str, str]]:
+    user = f"Pendiente: {pending}\nMensaje: {text}" if pending else f"Mensaje: {text}"
+    return [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": user}]
+
+
+def build_batch_messages(texts: list[str]) -> list[dict[str, str]]:
+    payload = _compact({"mensajes": [{"id": i, "texto": text} for i, text in enumerate(texts)]})
+    return [{"role": "system", "content": BATCH_SYSTEM_PROMPT}, {"role": "user", "content": payload}]
+
+
+def drop_nulls(raw: Any) -> dict[str, Any]:
+    """Filters the answer actually set (schema answers list every key)."""
+    if not isinstance(raw, dict):
+        return {}
+    return {key: value for key, value in raw.items() if value is not None}
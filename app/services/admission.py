@@ -0,0 +1,212 @@
+"""Admission control and load shedding for agent turns.
+
+Every POST /message runs inside `admit(session_id)`:
+
+- turns of the same session are serialized by a per-session lock, so two
+  in-flight messages cannot both load, mutate and save the same
+  ConversationState (at most `admission_session_max_pending` may wait);
+- at most `admission_max_concurrency` turns run at once, with a bounded
+  wait queue in front of them.
+
+The LLM and DB stages have their own gates (`llm_gate`, `db_gate`). Each
+turn carries a deadline (`admission_deadline_seconds` from arrival). A gate
+rejects a waiter when its queue is full, when the expected wait already
+exceeds the remaining time, or when the deadline passes while queued. The
+rejection is `Overloaded`, which the router turns into 429 with
+Retry-After. Under overload, latency stays bounded by the deadline and the
+excess is shed early, instead of every request timing out in the queues.
+
+With `admission_enabled` off nothing is shed and there is no deadline,
+but turns of a session are still serialized and the gates still bound
+concurrency.
+
+Gates and locks are per process. Across workers (SESSION_BACKEND=sqlite),
+the session store's compare-and-swap catches the race instead: the turn
+that saves second is rejected with 409 rather than overwriting the other.
+"""
+
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator
+from app.config import get_settings
+
+
+settings = get_settings()
+
+# Monotonic deadline of the current turn (None outside a request)
+_DEADLINE: ContextVar[float | None] = ContextVar("admission_deadline", default=None)
+
+
+class Overloaded(Exception):
+    """A turn was shed; `retry_after` is a hint in whole seconds."""
+
+    def __init__(self, gate: str, reason: str, retry_after: int) -> None:
+        super().__init__(f"{gate} overloaded ({reason})")
+        self.gate = gate
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _remaining() -> float:
+    deadline = _DEADLINE.get()
+    if deadline is None:
+        return settings.admission_deadline_seconds
+    return deadline - time.monotonic()
+
+
+class Gate:
+    """Bounded concurrency with a bounded, deadline-aware wait queue."""
+
+    def __init__(self, name: str, limit: int, max_queue: int) -> None:
+        self.name = name
+        self.limit = max(limit, 1)
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(self.limit)
+        self.active = 0
+        self.waiting = 0
+        # EWMA of the time a slot is held, for wait estimates and Retry-After
+        self._service_seconds = 0.0
+        self.stats = {"admitted": 0, "queued": 0, "rejected_full": 0, "rejected_deadline": 0}
+
+    def expected_wait(self) -> float:
+        return (self.waiting + 1) * self._service_seconds / self.limit
+
+    def _reject(self, reason: str) -> Overloaded:
+        self.stats[f"rejected_{reason}"] += 1
+        return Overloaded(self.name, reason, max(1, math.ceil(self.expected_wait())))
+
+    @asynccontextmanager
+    async def slot(self, shed: bool = True) -> AsyncIterator[None]:
+        """Hold one slot; with `shed` off, wait without queue or deadline limits."""
+        if shed and self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                raise self._reject("full")
+            remaining = _remaining()
+            if remaining <= 0 or self.expected_wait() > remaining:
+                raise self._reject("deadline")
+            self.waiting += 1
+            self.stats["queued"] += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), remaining)
+            except asyncio.TimeoutError:
+                raise self._reject("deadline") from None
+            finally:
+                self.waiting -= 1
+        else:
+            self.waiting += 1
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self.waiting -= 1
+
+        self.stats["admitted"] += 1
+        self.active += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+            elapsed = time.perf_counter() - started
+            self._service_seconds += 0.2 * (elapsed - self._service_seconds)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_queue": self.max_queue,
+            **self.stats,
+        }
+
+
+class _SessionLock:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+request_gate = Gate("request", settings.admission_max_concurrency, settings.admission_max_queue)
+llm_gate = Gate("llm", settings.llm_max_concurrency, settings.llm_max_queue)
+# One pool per DSN (primary + replicas), so the default scales with them
+db_gate = Gate(
+    "db",
+    settings.db_max_concurrency or settings.db_pool_max_size * (1 + len(settings.database_replica_urls)),
+    settings.db_max_queue,
+)
+
+_SESSION_LOCKS: dict[str, _SessionLock] = {}
+_SESSION_STATS = {"serialized": 0, "rejected": 0}
+
+
+@asynccontextmanager
+async def _session_turn(session_id: str, shed: bool = True) -> AsyncIterator[None]:
+    entry = _SESSION_LOCKS.get(session_id)
+    if entry is None:
+        entry = _SESSION_LOCKS[session_id] = _SessionLock()
+    if shed and entry.pending >= settings.admission_session_max_pending:
+        _SESSION_STATS["rejected"] += 1
+        raise Overloaded("session", "full", 1)
+    if entry.pending:
+        # Another turn of this session is running or waiting
+        _SESSION_STATS["serialized"] += 1
+    entry.pending += 1
+    try:
+        if shed:
+            try:
+                await asyncio.wait_for(entry.lock.acquire(), max(_remaining(), 0))
+            except asyncio.TimeoutError:
+                _SESSION_STATS["rejected"] += 1
+                raise Overloaded("session", "deadline", 1) from None
+        else:
+            await entry.lock.acquire()
+        try:
+            yield
+        finally:
+            entry.lock.release()
+    finally:
+        entry.pending -= 1
+        if entry.pending == 0:
+            _SESSION_LOCKS.pop(session_id, None)
+
+
+@asynccontextmanager
+async def admit(session_id: str | None) -> AsyncIterator[None]:
+    """Run one agent turn under the session lock and the request gate.
+
+    The session lock is always taken; shedding and the deadline only apply
+    with admission control on.
+    """
+    shed = settings.admission_enabled
+    token = _DEADLINE.set(time.monotonic() + settings.admission_deadline_seconds) if shed else None
+    try:
+        if session_id:
+            # Lock first: a turn waiting for its session holds no global slot
+            async with _session_turn(session_id, shed):
+                async with request_gate.slot(shed):
+                    yield
+        else:
+            async with request_gate.slot(shed):
+                yield
+    finally:
+        if token is not None:
+            _DEADLINE.reset(token)
+
+
+@asynccontextmanager
+async def stage(gate: Gate) -> AsyncIterator[None]:
+    """Hold a slot of a stage gate; only sheds when admission control is on."""
+    async with gate.slot(shed=settings.admission_enabled):
+        yield
+
+
+def get_admission_stats() -> dict[str, Any]:
+    return {
+        "gates": {gate.name: gate.snapshot() for gate in (request_gate, llm_gate, db_gate)},
+        "sessions": {"locked": len(_SESSION_LOCKS), **_SESSION_STATS},
+    }
@@ -1,4 +1,4 @@
-"""Agent orchestrator service (skeleton).
+"""Agent orchestrator service.
 
 Responsibilities:
 - Orchestrate session state and dialog flow
@@ -6,91 +6,390 @@ Responsibilities:
 - Use query_builder to build parametric SQL
 - Use db to execute queries with retries
 
-All functions are placeholders. Implementation will come later.
+Each turn runs as a dataflow graph (app.graph.workflow), so independent
+stages overlap instead of running one after another.
 """
 
-from typing import Any
+import asyncio
+import time
+from typing import Any, Callable
+from app.config import get_settings
+from app.graph.workflow import Node, Workflow
+from app.models.state import ConversationState
+from app.services import admission
+from app.services import filter_algebra
 from app.services import parser
 from app.services import session_manager
 from app.services import query_builder
-from app.services import db as db_service
+from app.services import search_service
+from app.services import turn_log
+from app.services.result_set import ResultSet
 from app.models.schemas import AgentResponse
+from app.utils import json_codec
+from app.utils import metrics
 
 
-async def handle_message(session_id: str | None, message: str) -> dict[str, Any]:
-    """Handle an incoming user message and return agent response.
-
-    Flow:
-    - create or load session
-    - parse filters from message
-    - update conversation state
-    - if essentials incomplete -> ask next missing
-    - if ready -> build SQL and save to session (do not execute DB here)
+settings = get_settings()
+
+# Progress callback of streaming endpoints: emit(event, data), non-blocking
+Emit = Callable[[str, Any], None]
+
+ESSENTIALS = ["distrito", "area_min", "estado", "presupuesto_max", "dormitorios"]
+
+
+# Relaxations users give up most easily come first: optional extras, then
+# numeric essentials, then estado, and distrito last
+_RELAXATION_COST = {
+    "pet_friendly": 0,
+    "balcon": 0,
+    "terraza": 0,
+    "amoblado": 0,
+    "banios": 0,
+    "dormitorios": 1,
+    "presupuesto_max": 2,
+    "area_min": 2,
+    "estado": 3,
+    "distrito": 4,
+}
+
+_FILTER_LABELS = {
+    "pet_friendly": "mascotas",
+    "balcon": "balcón",
+    "terraza": "terraza",
+    "amoblado": "amoblado",
+    "banios": "baños",
+    "presupuesto_max": "presupuesto máximo",
+    "area_min": "área mínima",
+    "estado": "estado",
+    "distrito": "distrito",
+    "dormitorios": "dormitorios",
+}
+
+
+def _missing_essentials(filters: dict) -> list[str]:
+    return [f for f in ESSENTIALS if filters.get(f) is None]
+
+
+def _suggest_relaxations(filters: dict, facets: dict) -> list[dict[str, Any]]:
+    """Single-filter changes that would return results, cheapest first.
+
+    distrito and dormitorios are replaced by the closest value with matches;
+    every other filter is dropped (`value` None).
     """
-    # Create session if needed
-    if not session_id:
-        session_id = session_manager.create_session()
+    suggestions = []
+    for key, count in facets["without"].items():
+        if not count:
+            continue
+        value = None
+        if key == "distrito" and facets["distrito"]:
+            value, count = max(facets["distrito"].items(), key=lambda item: item[1])
+        elif key == "dormitorios" and facets["dormitorios"]:
+            wanted = filters["dormitorios"]
+            value = min(facets["dormitorios"], key=lambda n: (abs(n - wanted), -facets["dormitorios"][n]))
+            count = facets["dormitorios"][value]
+        suggestions.append({"field": key, "value": value, "matches": count})
+    suggestions.sort(key=lambda s: (_RELAXATION_COST.get(s["field"], 5), -s["matches"]))
+    return suggestions
+
+
+def _relaxation_reply(suggestion: dict[str, Any]) -> str:
+    field, value, count = suggestion["field"], suggestion["value"], suggestion["matches"]
+    if field == "distrito" and value is not None:
+        change = f"buscando en {value}"
+    elif field == "dormitorios" and value is not None:
+        change = f"con {value} dormitorios"
+    else:
+        change = f"sin el filtro de {_FILTER_LABELS.get(field, field)}"
+    return f"Lo siento, no encontré propiedades con esos criterios. {change[:1].upper()}{change[1:]} encontraría {count}. ¿Quieres que ajuste la búsqueda?"
 
-    state = session_manager.load_conversation_state(session_id)
-    if not state:
-        # create fresh
-        state = state = session_manager.load_conversation_state(session_id)
 
-    # Append user message
+def _no_emit(event: str, data: Any) -> None:
+    pass
+
+
+def _question_for(next_missing: str) -> str:
+    # Build context-aware question
+    if next_missing == "distrito":
+        return "¡Perfecto! ¿En qué distrito te gustaría buscar? (ej: La Molina, San Isidro, Miraflores)"
+    elif next_missing == "area_min":
+        return "Excelente. ¿Cuál es el área mínima que necesitas en m²? (ej: 80, 100, 150)"
+    elif next_missing == "estado":
+        return "¿Qué estado de propiedad prefieres? Puede ser: DISPONIBLE, OCUPADA, MANTENIMIENTO o VENDIDA"
+    elif next_missing == "presupuesto_max":
+        return "¿Cuál es tu presupuesto máximo? (en la moneda que prefieras)"
+    elif next_missing == "dormitorios":
+        return "¿Cuántos dormitorios necesitas? (1, 2, 3, etc.)"
+    return "¿Puedes darme más detalles?"
+
+
+# --- Turn stages (nodes of _TURN) ---
+
+def _open_session(
+    session_hint: str | None,
+    message: str,
+    bound_state: ConversationState | None,
+    emit: Emit,
+) -> tuple[str, ConversationState, dict]:
+    # Create session if needed
+    session_id = session_hint or session_manager.create_session()
+    if bound_state is not None and bound_state.session_id == session_id:
+        # Connection-bound session (WebSocket): no store lookup
+        state = bound_state
+    else:
+        state = session_manager.load_conversation_state(session_id)
+    if not state:
+        # Unknown or expired session: start a fresh one under the same id
+        session_manager.create_session(session_id)
+        state = session_manager.load_conversation_state(session_id)
     state.messages.append({"role": "user", "content": message})
+    emit("session", {"session_id": session_id})
+    # Filters as they were before this message (the merge stage mutates state)
+    return session_id, state, dict(state.collected_filters)
+
+
+def _speculate(session_id: str, known_filters: dict, background: list[asyncio.Task]) -> asyncio.Task | None:
+    """Start loading candidates for the filters the session already has.
+
+    Only once every essential is known: a follow-up message usually refines
+    them, and the DB query then overlaps with the extraction. The task is
+    added to `background` so a failed turn can cancel it.
+    """
+    if not settings.speculative_search_enabled or _missing_essentials(known_filters):
+        return None
+    task = asyncio.ensure_future(search_service.warm_candidates(session_id, known_filters))
+    # Speculative: a failure only means the search goes to the DB as usual
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    background.append(task)
+    return task
+
+
+async def _extract(message: str, known_filters: dict) -> dict[str, Any]:
+    # The essential we asked for last turn, used by the rule-based fast path
+    pending = _missing_essentials(known_filters)
+    pending_field = pending[0] if pending else None
+    return await parser.parse_filters(message, known_filters, pending=pending_field)
+
 
-    # Extract filters from message
-    extracted = await parser.parse_filters(message, state.collected_filters)
+def _merge(state: ConversationState, extracted: dict, emit: Emit) -> tuple[dict, list[str]]:
     if extracted:
         # Merge into collected_filters
         for k, v in extracted.items():
             state.collected_filters[k] = v
+    missing = _missing_essentials(state.collected_filters)
+    emit("filters", {"extracted": extracted or {}, "filters": dict(state.collected_filters), "missing": missing})
+    return state.collected_filters, missing
 
-    # Determine missing essentials
-    essentials = ["distrito", "area_min", "estado", "presupuesto_max", "dormitorios"]
-    missing = [f for f in essentials if state.collected_filters.get(f) is None]
 
-    if missing:
-        # Ask for the next missing with more conversational responses
-        next_missing = missing[0]
-        
-        # Build context-aware question
-        if next_missing == "distrito":
-            reply = "¡Perfecto! ¿En qué distrito te gustaría buscar? (ej: La Molina, San Isidro, Miraflores)"
-        elif next_missing == "area_min":
-            reply = "Excelente. ¿Cuál es el área mínima que necesitas en m²? (ej: 80, 100, 150)"
-        elif next_missing == "estado":
-            reply = "¿Qué estado de propiedad prefieres? Puede ser: DISPONIBLE, OCUPADA, MANTENIMIENTO o VENDIDA"
-        elif next_missing == "presupuesto_max":
-            reply = "¿Cuál es tu presupuesto máximo? (en la moneda que prefieras)"
-        elif next_missing == "dormitorios":
-            reply = "¿Cuántos dormitorios necesitas? (1, 2, 3, etc.)"
+def _prefetch(session_id: str, filters: dict, missing: list[str]) -> None:
+    if len(missing) == 1:
+        # Fetch candidates while the user answers the last question
+        search_service.start_prefetch(session_id, filters, missing[0])
+
+
+async def _search(
+    session_id: str,
+    filters: dict,
+    missing: list[str],
+    known_filters: dict,
+    speculation: asyncio.Task | None,
+    emit: Emit,
+) -> tuple[str | None, list[dict] | None, bool]:
+    """(sql, results, failed); no search while essentials are missing."""
+    if speculation is not None:
+        if not missing and filter_algebra.is_refinement(known_filters, filters):
+            # The speculative candidates answer this search: wait for them
+            await asyncio.gather(speculation, return_exceptions=True)
         else:
-            reply = "¿Puedes darme más detalles?"
-        
+            speculation.cancel()
+    if missing:
+        return None, None, False
+    try:
+        sql, results = await search_service.search(filters, session_id=session_id)
+    except admission.Overloaded:
+        # Shed: the router answers 429 and the client retries the turn
+        raise
+    except Exception:
+        sql, _ = query_builder.build_property_search_query(filters)
+        return sql, None, True
+    # Stream rows before suggestions and persistence are done
+    for row in results:
+        emit("property", row)
+    return sql, results, False
+
+
+async def _suggest(filters: dict, results: list[dict] | None) -> list[dict] | None:
+    if results is None or results:
+        return None
+    # One facet query tells which single change would return results
+    try:
+        facets = await search_service.facets(filters)
+    except Exception:
+        return None
+    return _suggest_relaxations(filters, facets)
+
+
+def _respond(
+    session_id: str,
+    state: ConversationState,
+    missing: list[str],
+    sql: str | None,
+    results: list[dict] | None,
+    failed: bool,
+    suggestions: list[dict] | None,
+    emit: Emit,
+) -> dict[str, Any]:
+    if missing:
+        reply = _question_for(missing[0])
+        emit("question", {"reply": reply, "field": missing[0]})
         state.messages.append({"role": "assistant", "content": reply})
         session_manager.save_conversation_state(session_id, state)
         return AgentResponse(session_id=session_id, reply=reply).model_dump()
 
-    # If no missing essentials, proceed to build SQL
-    sql, params = query_builder.build_property_search_query(state.collected_filters)
-
-    # Execute query and save results
-    try:
-        results = await db_service.fetch(sql, *params)
-    except Exception as e:
+    if failed:
         # Save generated SQL for debugging and return friendly error
         session_manager.save_query_result(session_id, sql, None)
         reply = "Lo siento, hubo un error al ejecutar la búsqueda. Intenta más tarde."
+        emit("reply", {"reply": reply})
         state.messages.append({"role": "assistant", "content": reply})
         session_manager.save_conversation_state(session_id, state)
         return AgentResponse(session_id=session_id, reply=reply).model_dump()
 
+    if json_codec.is_fast() and not isinstance(results, ResultSet):
+        # One compact copy, shared by the session and the response
+        results = ResultSet.from_dicts(results)
+
     # Save results in session
     session_manager.save_query_result(session_id, sql, results)
 
     reply = f"Encontré {len(results)} propiedades que cumplen con tus criterios. Te las muestro." if results else "Lo siento, no encontré propiedades con esos criterios."
+    if suggestions:
+        reply = _relaxation_reply(suggestions[0])
+    emit("reply", {"reply": reply, "suggestions": suggestions})
     state.messages.append({"role": "assistant", "content": reply})
     session_manager.save_conversation_state(session_id, state)
 
-    return AgentResponse(session_id=session_id, reply=reply, data=results).model_dump()
+    if json_codec.is_fast():
+        # Already valid; model_dump would copy every row again
+        return dict(AgentResponse.model_construct(
+            session_id=session_id, reply=reply, data=results, suggestions=suggestions,
+        ))
+    return AgentResponse(session_id=session_id, reply=reply, data=results, suggestions=suggestions).model_dump()
+
+
+def _log_turn(
+    started: float,
+    session_id: str | None,
+    message: str,
+    values: dict[str, Any] | None,
+    timings: dict[str, float],
+    error: BaseException | None = None,
+) -> None:
+    """Queue the turn's record for the write-behind turn log."""
+    if not turn_log.is_enabled():
+        return
+    entry: dict[str, Any] = {
+        "ts": started,
+        "session_id": session_id,
+        "message": message,
+        "total_ms": (time.time() - started) * 1000,
+    }
+    if values is not None:
+        results = values.get("results")
+        # Copies: the session's filters keep changing after the turn
+        entry.update(
+            session_id=values["session_id"],
+            extracted=dict(values.get("extracted") or {}),
+            filters=dict(values["filters"]),
+            missing=list(values["missing"]),
+            sql=values.get("sql"),
+            rows=len(results) if results is not None else None,
+            failed=values.get("failed", False),
+            reply=values["response"]["reply"],
+            stages_ms={name: seconds * 1000 for name, seconds in timings.items()},
+        )
+    if error is not None:
+        entry["error"] = type(error).__name__
+    turn_log.record(entry)
+
+
+# Stage timeouts; the LLM and DB clients have tighter deadlines of their own
+_STAGE_TIMEOUT = settings.admission_deadline_seconds
+
+_TURN = Workflow(
+    [
+        Node(
+            "session", _open_session,
+            ["session_hint", "message", "bound_state", "emit"],
+            ["session_id", "state", "known_filters"],
+        ),
+        Node("speculate", _speculate, ["session_id", "known_filters", "background"], ["speculation"]),
+        Node("extract", _extract, ["message", "known_filters"], ["extracted"], timeout=_STAGE_TIMEOUT),
+        Node("merge", _merge, ["state", "extracted", "emit"], ["filters", "missing"]),
+        Node("prefetch", _prefetch, ["session_id", "filters", "missing"]),
+        Node(
+            "search", _search,
+            ["session_id", "filters", "missing", "known_filters", "speculation", "emit"],
+            ["sql", "results", "failed"],
+            timeout=_STAGE_TIMEOUT,
+        ),
+        Node("suggest", _suggest, ["filters", "results"], ["suggestions"], timeout=_STAGE_TIMEOUT),
+        Node(
+            "respond", _respond,
+            ["session_id", "state", "missing", "sql", "results", "failed", "suggestions", "emit"],
+            ["response"],
+        ),
+    ],
+    inputs=["session_hint", "message", "bound_state", "emit", "background"],
+)
+
+
+@metrics.timed("agent.handle_message")
+async def run_turn(
+    session_id: str | None,
+    message: str,
+    emit: Emit | None = None,
+    bound_state: ConversationState | None = None,
+) -> tuple[dict[str, Any], ConversationState]:
+    """Run one turn; returns the response and the session's state.
+
+    The turn is the `_TURN` dataflow graph:
+    - session: create or load the session and record the message
+    - speculate: with every essential already known, start loading the
+      session's candidates while the message is extracted
+    - extract: rules fast path or LLM (overlaps with speculate)
+    - merge: update collected filters and find missing essentials
+    - prefetch: with one essential missing, fetch candidates for it
+    - search: run the search once every essential is known
+    - suggest: facet counts and relaxations when nothing matched
+    - respond: next question or results; persist the conversation
+
+    `emit(event, data)` receives progress events as stages finish (session,
+    filters, question, property per row, reply); streaming endpoints relay
+    them. `bound_state` is the state a connection already holds for
+    `session_id`, which skips loading it from the session store. Every
+    turn is queued for the turn log (app.services.turn_log).
+    """
+    started = time.time()
+    background: list[asyncio.Task] = []
+    try:
+        values, timings = await _TURN.run_timed(
+            session_hint=session_id,
+            message=message,
+            bound_state=bound_state,
+            emit=emit or _no_emit,
+            background=background,
+        )
+    except (Exception, asyncio.CancelledError) as exc:
+        # A failed turn never reaches the search that would consume these
+        for task in background:
+            task.cancel()
+        _log_turn(started, session_id, message, None, {}, exc)
+        raise
+    _log_turn(started, session_id, message, values, timings)
+    return values["response"], values["state"]
+
+
+async def handle_message(session_id: str | None, message: str) -> dict[str, Any]:
+    """Handle an incoming user message and return agent response."""
+    response, _ = await run_turn(session_id, message)
+    return response
@@ -0,0 +1,184 @@
+"""Bulk filter extraction: many messages per LLM call.
+
+`extract_many(texts)` yields one result per text, in input order, as soon
+as it and every earlier one are ready:
+
+    {"index": 3, "filters": {...}, "source": "batch", "error": None}
+
+Each text first takes the local paths of a turn: the rule extractor (above
+`fast_path_min_confidence`), then the extraction cache. Repeated texts are
+extracted once. The rest are packed, in order, into groups of at most
+`llm_batch_max_items` texts and `llm_batch_max_prompt_tokens` estimated
+tokens; each group is one LLM call (llm_client.request_batch_extraction)
+and at most `llm_batch_concurrency` groups run at once, on top of the llm
+gate shared with interactive turns. Texts the group answer does not cover,
+and every text of a failed group call, are retried one by one through
+llm_client.extract_filters_from_text, sequentially within the group's
+slot, so a failing batch never fans out into more concurrent LLM calls. Raw answers are normalized by
+parser.normalize_extraction, as in a turn, and cached.
+
+`source` is one of empty, rules, cache, batch or llm (single retries);
+`error` names the exception when even the single retry failed.
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Callable, Iterator, Sequence
+from app.config import get_settings
+from app.services import llm_client
+from app.services import parser
+from app.services import rule_extractor
+from app.utils.nlp_helpers import normalize_text
+
+
+settings = get_settings()
+
+# Rough size of Spanish text in tokens, plus the JSON around each item
+_CHARS_PER_TOKEN = 4
+_ITEM_OVERHEAD_TOKENS = 12
+
+_STATS: dict[str, int] = {
+    "texts": 0,
+    "duplicates": 0,
+    "empty": 0,
+    "rules": 0,
+    "cache": 0,
+    "batch_calls": 0,
+    "batch_items": 0,
+    "batch_failures": 0,
+    "retried": 0,
+    "failed": 0,
+}
+
+Resolve = Callable[[str, dict[str, Any] | None, str, str | None], None]
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // _CHARS_PER_TOKEN + _ITEM_OVERHEAD_TOKENS
+
+
+def _groups(items: list[tuple[str, str]]) -> Iterator[list[tuple[str, str]]]:
+    """Consecutive (key, text) groups within the item and token budgets."""
+    group: list[tuple[str, str]] = []
+    tokens = 0
+    for item in items:
+        cost = estimate_tokens(item[1])
+        if group and (len(group) >= settings.llm_batch_max_items or tokens + cost > settings.llm_batch_max_prompt_tokens):
+            yield group
+            group, tokens = [], 0
+        group.append(item)
+        tokens += cost
+    if group:
+        yield group
+
+
+def _local(text: str) -> tuple[dict[str, Any], str] | None:
+    """(raw filters, source) without calling the LLM, if possible."""
+    if not text.strip():
+        return {}, "empty"
+    if settings.fast_path_enabled:
+        raw, confidence = rule_extractor.extract(text)
+        if raw and confidence >= settings.fast_path_min_confidence:
+            return raw, "rules"
+    cached = llm_client.cached_extraction(text)
+    if cached is not None:
+        return cached, "cache"
+    return None
+
+
+async def _single(key: str, text: str, resolve: Resolve) -> None:
+    try:
+        raw = await llm_client.extract_filters_from_text(text)
+    except Exception as exc:
+        _STATS["failed"] += 1
+        resolve(key, None, "llm", type(exc).__name__)
+        return
+    resolve(key, raw, "llm", None)
+
+
+async def _run_group(group: list[tuple[str, str]], semaphore: asyncio.Semaphore, resolve: Resolve) -> None:
+    async with semaphore:
+        if len(group) == 1:
+            await _single(*group[0], resolve)
+            return
+        _STATS["batch_calls"] += 1
+        try:
+            answers = await llm_client.request_batch_extraction([text for _, text in group])
+        except Exception:
+            # Rate limits, timeouts, a cut-off answer: every item goes alone
+            _STATS["batch_failures"] += 1
+            answers = [None] * len(group)
+        retry = []
+        for (key, text), raw in zip(group, answers):
+            if raw is None:
+                retry.append((key, text))
+                continue
+            _STATS["batch_items"] += 1
+            llm_client.store_extraction(text, raw)
+            resolve(key, raw, "batch", None)
+        _STATS["retried"] += len(retry)
+        # One at a time: failures are often overload or rate limits
+        for key, text in retry:
+            await _single(key, text, resolve)
+
+
+async def extract_many(texts: Sequence[str]) -> AsyncIterator[dict[str, Any]]:
+    """Results for `texts` in input order; see the module docstring."""
+    loop = asyncio.get_running_loop()
+    results = [loop.create_future() for _ in texts]
+    # Normalized text -> indexes sharing its extraction
+    indexes: dict[str, list[int]] = {}
+    pending: list[tuple[str, str]] = []
+
+    def result(index: int, raw: dict[str, Any] | None, source: str, error: str | None) -> dict[str, Any]:
+        filters = parser.normalize_extraction(raw) if raw is not None else None
+        return {"index": index, "filters": filters, "source": source, "error": error}
+
+    def resolve(key: str, raw: dict[str, Any] | None, source: str, error: str | None) -> None:
+        for index in indexes[key]:
+            if not results[index].done():
+                results[index].set_result(result(index, raw, source, error))
+
+    _STATS["texts"] += len(texts)
+    for index, text in enumerate(texts):
+        local = _local(text)
+        if local is not None:
+            _STATS[local[1]] += 1
+            results[index].set_result(result(index, local[0], local[1], None))
+            continue
+        key = normalize_text(text)
+        if key in indexes:
+            _STATS["duplicates"] += 1
+            indexes[key].append(index)
+            continue
+        indexes[key] = [index]
+        pending.append((key, text))
+
+    semaphore = asyncio.Semaphore(max(settings.llm_batch_concurrency, 1))
+    tasks = []
+    for group in _groups(pending):
+        task = asyncio.ensure_future(_run_group(group, semaphore, resolve))
+
+        def settle(finished: asyncio.Task, group: list[tuple[str, str]] = group) -> None:
+            # Never leave a result unresolved, whatever happened in the group
+            if not finished.cancelled() and finished.exception() is not None:
+                for key, _ in group:
+                    resolve(key, None, "llm", type(finished.exception()).__name__)
+
+        task.add_done_callback(settle)
+        tasks.append(task)
+    try:
+        for future in results:
+            yield await future
+    finally:
+        # Consumer gone (client disconnected): stop the remaining calls
+        for task in tasks:
+            task.cancel()
+
+
+async def extract_all(texts: Sequence[str]) -> list[dict[str, Any]]:
+    """`extract_many`, collected into a list."""
+    return [item async for item in extract_many(texts)]
+
+
+def get_batch_extraction_stats() -> dict[str, int]:
+    return dict(_STATS)
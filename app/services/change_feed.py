@@ -0,0 +1,170 @@
+"""Row-change feed for the in-memory property caches.
+
+`trigger_ddl()` installs AFTER INSERT/UPDATE/DELETE row triggers on
+propiedad and edificio that `pg_notify` the change channel with
+`{"t": table, "op": "I"|"U"|"D", "id": row id}`. db.py LISTENs on it and
+passes debounced batches to `_on_change`, which:
+
+- marks session candidate sets and prefetched results stale (they are
+  per session and small, so they are re-fetched rather than patched);
+- re-reads the changed rows from the primary, one statement per table,
+  and patches them into the top-k cube and the property index. Requested
+  propiedad ids that do not come back were deleted and are removed.
+
+The db result cache clears itself on every batch (see db.py). After the
+listener (re)connects, notifications may have been missed, so `_on_resync`
+drops what cannot be patched precisely: candidate sets, the cube buckets,
+and the property index (reloaded). Those reloads read from the primary too,
+so replica lag cannot bring back rows that were just invalidated.
+
+With the triggers installed, the cache TTLs and refresh intervals only
+bound staleness when the listener is down.
+
+    python -m app.services.change_feed            # print the trigger DDL
+    python -m app.services.change_feed --install  # run it on DATABASE_URL
+"""
+
+import asyncio
+import logging
+from typing import Any
+from app.config import get_settings
+from app.services import db as db_service
+from app.services import filter_algebra
+from app.services import property_index
+from app.services import query_builder
+from app.services import topk_cube
+from app.utils.security import is_safe_identifier
+
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_SCHEMA = "property_infrastructure"
+_TABLES = ("propiedad", "edificio")
+
+_APPLY_LOCK = asyncio.Lock()
+_TASKS: set[asyncio.Task] = set()
+_STATS = {"batches": 0, "rows_patched": 0, "rows_deleted": 0, "apply_errors": 0, "resyncs": 0}
+
+
+def trigger_ddl(channel: str | None = None) -> str:
+    """Function and triggers that notify `channel` of every row change."""
+    channel = channel or settings.db_change_channel
+    if not is_safe_identifier(channel):
+        raise RuntimeError(f"Invalid DB_CHANGE_CHANNEL: {channel!r}")
+    triggers = "\n".join(
+        f"DROP TRIGGER IF EXISTS {table}_notify_change ON {_SCHEMA}.{table};\n"
+        f"CREATE TRIGGER {table}_notify_change\n"
+        f"    AFTER INSERT OR UPDATE OR DELETE ON {_SCHEMA}.{table}\n"
+        f"    FOR EACH ROW EXECUTE FUNCTION {_SCHEMA}.notify_property_change();"
+        for table in _TABLES
+    )
+    return f"""CREATE OR REPLACE FUNCTION {_SCHEMA}.notify_property_change() RETURNS trigger AS $$
+DECLARE
+    row_id integer;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        row_id := OLD.id;
+    ELSE
+        row_id := NEW.id;
+    END IF;
+    PERFORM pg_notify(
+        '{channel}',
+        json_build_object('t', TG_TABLE_NAME, 'op', left(TG_OP, 1), 'id', row_id)::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+{triggers}
+"""
+
+
+def _track(coroutine: Any) -> None:
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(coroutine)
+    _TASKS.add(task)
+    task.add_done_callback(_TASKS.discard)
+
+
+async def _apply(changes: list[dict]) -> None:
+    propiedad_ids = sorted({change["id"] for change in changes if change.get("t") == "propiedad"})
+    edificio_ids = sorted({change["id"] for change in changes if change.get("t") == "edificio"})
+    # One batch at a time, so a later re-read is never overwritten by an earlier one
+    async with _APPLY_LOCK:
+        try:
+            rows: list[dict] = []
+            if propiedad_ids:
+                rows += await db_service.fetch(query_builder.build_property_rows_query(), propiedad_ids, primary=True)
+            if edificio_ids:
+                sql = query_builder.build_property_rows_query(by_edificio=True)
+                rows += await db_service.fetch(sql, edificio_ids, primary=True)
+        except Exception:
+            # Rows could not be re-read: fall back to dropping what may be stale
+            _STATS["apply_errors"] += 1
+            logger.exception("Could not re-read %d changed rows", len(changes))
+            _on_resync()
+            return
+        returned = {row["id"] for row in rows}
+        deleted_ids = [row_id for row_id in propiedad_ids if row_id not in returned]
+        topk_cube.apply_changes(rows, deleted_ids)
+        await property_index.apply_changes(rows, deleted_ids)
+        _STATS["rows_patched"] += len(rows)
+        _STATS["rows_deleted"] += len(deleted_ids)
+
+
+def _on_change(changes: list[dict]) -> None:
+    _STATS["batches"] += 1
+    filter_algebra.invalidate_candidates()
+    # Loads already in flight may predate these changes
+    topk_cube.mark_changed()
+    property_index.mark_changed()
+    _track(_apply(changes))
+
+
+def _on_resync() -> None:
+    _STATS["resyncs"] += 1
+    filter_algebra.invalidate_candidates()
+    topk_cube.clear()
+    if property_index.is_ready():
+        _track(property_index.load_full(primary=True))
+
+
+def get_change_feed_stats() -> dict[str, Any]:
+    return {**_STATS, "listener": db_service.get_change_listener_stats()}
+
+
+db_service.add_change_listener(_on_change, _on_resync)
+
+
+async def install(dsn: str) -> None:
+    import asyncpg
+
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute(trigger_ddl())
+    finally:
+        await conn.close()
+
+
+def main() -> None:
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Print or install the row-change triggers")
+    ap.add_argument("--install", action="store_true", help="run the DDL on DATABASE_URL")
+    args = ap.parse_args()
+
+    if not args.install:
+        print(trigger_ddl(), end="")
+        return
+    if not settings.database_url:
+        raise SystemExit("DATABASE_URL is not set")
+    asyncio.run(install(settings.database_url))
+    print(f"Triggers installed; notifying channel {settings.db_change_channel!r}")
+
+
+if __name__ == "__main__":
+    main()
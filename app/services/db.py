@@ -1,45 +1,548 @@
-"""Database helpers using asyncpg (skeleton).
+"""Database helpers using asyncpg.
 
-This module will create and manage an asyncpg pool and provide safe
+This module creates and manages asyncpg pools and provides safe
 parameterized query execution helpers.
+
+There is one pool per DSN: the primary (`database_url`) and each replica
+(`database_replica_urls`). Every query here is a read. Reads go to the
+healthy replica with the fewest outstanding requests (ties go to the lower
+latency EWMA). The primary is used when no replica is healthy or none is
+configured. A read that fails with a connection error is retried once on
+another node.
+
+A background task runs `SELECT 1` on every node each
+`db_health_check_interval_seconds`. A node is ejected after
+`db_eject_after_failures` consecutive failures (checks or queries), and
+re-admitted after `db_readmit_after_successes` passing checks. Pools are
+created by `_create_pool(dsn)`; tests can replace it with a fake pool
+factory.
+
+Queries run through asyncpg's per-connection statement cache (bounded by
+`db_statement_cache_size`) instead of an explicit `prepare` per call. The
+canonical statements from `query_builder` are prepared on every new pooled
+connection, so parse/plan work stays off the request path.
+
+Searches go through `fetch_result_shared` (or `fetch_shared` without
+orjson): concurrent calls with the same
+(sql, params) share one query, and results are kept for
+`db_result_cache_ttl_seconds`, so popular searches cost one pooled query
+per TTL window at most.
+
+Exports go through `stream`, which reads from a server-side cursor in
+batches of `properties_export_prefetch` rows, so memory does not grow
+with the size of the result. The cursor is read by its own task, so the
+connection is given back when the export runs too long, returns too many
+rows or its consumer stops reading (`properties_export_*`).
+
+`fetch_result` / `fetch_result_shared` return a ResultSet (one tuple per
+row) instead of dicts; cached ResultSets are shared without copying since
+their rows are immutable.
+
+Row changes arrive on a dedicated LISTEN connection to the primary
+(`db_change_channel`, fed by the triggers in `change_feed`). Notifications
+are batched for `db_change_debounce_seconds` and passed to the callbacks
+registered with `add_change_listener`. Notifications sent while the
+connection is down are lost. So after every (re)connect each listener's
+`on_resync` runs and drops or reloads whatever it caches. The result
+cache registers itself here, so its TTL can be long.
 """
 
-from typing import Any
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable
 import asyncpg
 from app.config import get_settings
+from app.services import admission
+from app.services import query_builder
+from app.services.result_set import ResultSet
+from app.utils import metrics
+from app.utils.cache import TTLCache
+from app.utils.security import is_safe_identifier
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_RESULT_CACHE = TTLCache(
+    max_entries=settings.db_result_cache_max_entries,
+    ttl_seconds=settings.db_result_cache_ttl_seconds,
+)
+
+# Errors that say the node (not the statement) is broken
+_CONNECTION_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.InterfaceError,
+)
+
+
+class _Node:
+    """One DSN: its pool, in-flight requests and health."""
+
+    __slots__ = ("name", "dsn", "role", "pool", "outstanding", "healthy", "failures", "successes", "latency", "stats")
+
+    def __init__(self, name: str, dsn: str, role: str) -> None:
+        self.name = name
+        self.dsn = dsn
+        self.role = role
+        self.pool: Any = None
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.successes = 0
+        # EWMA of query latency in seconds (routing tie-break)
+        self.latency = 0.0
+        self.stats = {"queries": 0, "errors": 0, "ejections": 0, "readmissions": 0}
+
+    def record_success(self, elapsed: float) -> None:
+        self.failures = 0
+        self.stats["queries"] += 1
+        self.latency += 0.2 * (elapsed - self.latency)
+        metrics.observe("db_node_query_seconds", elapsed, node=self.name)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.successes = 0
+        self.stats["errors"] += 1
+        if self.healthy and self.failures >= settings.db_eject_after_failures:
+            self.healthy = False
+            self.stats["ejections"] += 1
+
+    def record_check(self, elapsed: float) -> None:
+        self.failures = 0
+        self.successes += 1
+        metrics.observe("db_node_health_check_seconds", elapsed, node=self.name)
+        if not self.healthy and self.successes >= settings.db_readmit_after_successes:
+            self.healthy = True
+            self.stats["readmissions"] += 1
+
+    def snapshot(self) -> dict[str, Any]:
+        size = self.pool.get_size() if self.pool is not None else 0
+        idle = self.pool.get_idle_size() if self.pool is not None else 0
+        return {
+            "role": self.role,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "latency_ms": self.latency * 1000,
+            "size": size,
+            "idle": idle,
+            **self.stats,
+        }
+
+
+_NODES: list[_Node] = []
+_HEALTH_TASK: asyncio.Task | None = None
+# callback(sql, params, seconds) after each executed query (see index_advisor)
+_QUERY_OBSERVERS: list[Callable[[str, tuple, float], None]] = []
+
+# (on_change(changes), on_resync()) pairs fed by the LISTEN connection
+_CHANGE_LISTENERS: list[tuple[Callable[[list[dict]], None], Callable[[], None] | None]] = []
+_PENDING_CHANGES: list[dict] = []
+_DISPATCH_HANDLE: asyncio.TimerHandle | None = None
+_LISTENER_TASK: asyncio.Task | None = None
+_CHANGE_STATS = {"connected": 0, "notifications": 0, "batches": 0, "bad_payloads": 0, "reconnects": 0, "resyncs": 0}
+
+
+async def _warm_connection(conn: asyncpg.Connection) -> None:
+    """Pool `init` hook: load the canonical statements into the cache."""
+    for sql, params in query_builder.canonical_statements():
+        await conn.fetch(sql, *params)
 
-_POOL: asyncpg.pool.Pool | None = None
+
+async def _create_pool(dsn: str) -> Any:
+    return await asyncpg.create_pool(
+        dsn,
+        min_size=settings.db_pool_min_size,
+        max_size=settings.db_pool_max_size,
+        max_inactive_connection_lifetime=settings.db_max_inactive_connection_lifetime,
+        statement_cache_size=settings.db_statement_cache_size,
+        command_timeout=settings.db_command_timeout,
+        init=_warm_connection,
+    )
 
 
 async def init_db_pool() -> None:
-    global _POOL
+    global _HEALTH_TASK
     settings = get_settings()
     dsn = settings.database_url
     if not dsn:
         raise RuntimeError("DATABASE_URL not configured in settings")
-    _POOL = await asyncpg.create_pool(dsn)
+    primary = _Node("primary", dsn, "primary")
+    primary.pool = await _create_pool(dsn)
+    nodes = [primary]
+    for i, replica_dsn in enumerate(settings.database_replica_urls):
+        replica = _Node(f"replica-{i}", replica_dsn, "replica")
+        try:
+            replica.pool = await _create_pool(replica_dsn)
+        except Exception:
+            # Starts ejected; the health checks keep trying to connect
+            replica.healthy = False
+        nodes.append(replica)
+    _NODES[:] = nodes
+    if settings.db_health_check_interval_seconds > 0 and (_HEALTH_TASK is None or _HEALTH_TASK.done()):
+        _HEALTH_TASK = asyncio.get_running_loop().create_task(_health_forever())
 
 
 async def close_db_pool() -> None:
-    global _POOL
-    if _POOL:
-        await _POOL.close()
-        _POOL = None
+    global _HEALTH_TASK
+    if _HEALTH_TASK is not None:
+        _HEALTH_TASK.cancel()
+        try:
+            await _HEALTH_TASK
+        except asyncio.CancelledError:
+            pass
+        _HEALTH_TASK = None
+    nodes, _NODES[:] = list(_NODES), []
+    for node in nodes:
+        if node.pool is not None:
+            await node.pool.close()
+
+
+async def _check(node: _Node) -> None:
+    """One health check: (re)create the pool if needed, then SELECT 1."""
+    timeout = settings.db_health_check_timeout_seconds
+    started = time.perf_counter()
+    try:
+        if node.pool is None:
+            node.pool = await asyncio.wait_for(_create_pool(node.dsn), timeout)
+        async with node.pool.acquire(timeout=timeout) as conn:
+            await conn.fetchval("SELECT 1", timeout=timeout)
+    except Exception:
+        node.record_failure()
+        return
+    node.record_check(time.perf_counter() - started)
+
+
+async def _health_forever() -> None:
+    while True:
+        await asyncio.sleep(settings.db_health_check_interval_seconds)
+        await asyncio.gather(*(_check(node) for node in list(_NODES)))
+
+
+def _pick(exclude: _Node | None = None, primary: bool = False) -> _Node | None:
+    """Node for the next read: least outstanding healthy replica, else primary."""
+    nodes = [n for n in _NODES if n.pool is not None and n is not exclude]
+    if primary:
+        return next((n for n in nodes if n.role == "primary"), None)
+    candidates = [n for n in nodes if n.role == "replica" and n.healthy]
+    if not candidates:
+        candidates = [n for n in nodes if n.healthy] or nodes
+    if not candidates:
+        return None
+    return min(candidates, key=lambda n: (n.outstanding, n.latency))
+
+
+@asynccontextmanager
+async def _use(node: _Node) -> AsyncIterator[asyncpg.Connection]:
+    """Connection of `node`, counted as outstanding; feeds its health."""
+    node.outstanding += 1
+    started = time.perf_counter()
+    try:
+        async with node.pool.acquire() as conn:
+            metrics.observe("db_pool_wait_seconds", time.perf_counter() - started, node=node.name)
+            yield conn
+    except _CONNECTION_ERRORS:
+        node.record_failure()
+        raise
+    else:
+        node.record_success(time.perf_counter() - started)
+    finally:
+        node.outstanding -= 1
+
+
+async def _read_node(primary: bool = False) -> _Node:
+    if not _NODES:
+        await init_db_pool()
+    node = _pick(primary=primary)
+    if node is None:
+        raise RuntimeError("No database node available")
+    return node
 
 
-async def fetch(sql: str, *params: Any) -> list[dict]:
+def add_query_observer(callback: Callable[[str, tuple, float], None]) -> None:
+    """Call `callback(sql, params, seconds)` after every query run by `fetch`."""
+    _QUERY_OBSERVERS.append(callback)
+
+
+def get_pool_stats() -> dict[str, int]:
+    """Connections over all pools."""
+    nodes = [node.snapshot() for node in _NODES]
+    return {"size": sum(n["size"] for n in nodes), "idle": sum(n["idle"] for n in nodes)}
+
+
+def get_node_stats() -> dict[str, dict[str, Any]]:
+    return {node.name: node.snapshot() for node in _NODES}
+
+
+async def _fetch_records(sql: str, *params: Any, primary: bool = False) -> list[asyncpg.Record]:
+    async with admission.stage(admission.db_gate):
+        node = await _read_node(primary)
+        started = time.perf_counter()
+        try:
+            async with _use(node) as conn:
+                records = await conn.fetch(sql, *params)
+        except _CONNECTION_ERRORS:
+            # Reads are idempotent: retry once on another node
+            retry = None if primary else _pick(exclude=node)
+            if retry is None:
+                raise
+            metrics.inc("db_read_retries_total", node=node.name)
+            async with _use(retry) as conn:
+                records = await conn.fetch(sql, *params)
+    elapsed = time.perf_counter() - started
+    for observer in _QUERY_OBSERVERS:
+        observer(sql, params, elapsed)
+    metrics.inc("db_rows_total", len(records))
+    metrics.observe("db_rows_per_query", len(records), metrics.ROW_BUCKETS)
+    return records
+
+
+@metrics.timed("db.fetch")
+async def fetch(sql: str, *params: Any, primary: bool = False) -> list[dict]:
     """Execute a SELECT and return rows as list of dicts.
 
     Uses asyncpg pool and returns list of dictionaries mapping column->value.
+    `primary` reads from the primary (no replica lag), e.g. right after a
+    change notification.
     """
-    global _POOL
-    if _POOL is None:
-        await init_db_pool()
+    return [dict(r) for r in await _fetch_records(sql, *params, primary=primary)]
+
+
+@metrics.timed("db.fetch")
+async def fetch_result(sql: str, *params: Any) -> ResultSet:
+    """Execute a SELECT over query_builder.COLUMNS and return a ResultSet."""
+    return ResultSet.from_records(await _fetch_records(sql, *params))
+
+
+class StreamAborted(Exception):
+    """A `stream` was cut short: deadline, row cap or a stalled consumer."""
+
+
+# Last item of a stream buffer that ended normally
+_STREAM_END = object()
+
+
+async def stream(sql: str, *params: Any) -> AsyncIterator[dict]:
+    """Yield the rows of a SELECT one by one from a server-side cursor.
+
+    Holds one pooled connection (and a db gate slot) while the rows are
+    read; asyncpg cursors need a transaction, so one is opened read-only.
+    A reader task fills a buffer of `properties_export_prefetch` rows and
+    gives up, releasing the connection, when the consumer leaves it full
+    for `properties_export_stall_seconds`, after
+    `properties_export_max_seconds` or past `properties_export_max_rows`
+    rows. The iteration then raises StreamAborted.
+    """
+    buffer: asyncio.Queue = asyncio.Queue(maxsize=settings.properties_export_prefetch)
+
+    async def put(item: Any) -> None:
+        try:
+            await asyncio.wait_for(buffer.put(item), settings.properties_export_stall_seconds)
+        except TimeoutError:
+            raise StreamAborted("consumer stopped reading") from None
+
+    def fail(exc: Exception) -> None:
+        if isinstance(exc, StreamAborted):
+            metrics.inc("db_streams_aborted_total")
+            logger.warning("Stream aborted: %s", exc)
+        if buffer.full():
+            # Nobody is reading (stalled): the consumer only needs the error
+            while not buffer.empty():
+                buffer.get_nowait()
+        buffer.put_nowait(exc)
+
+    async def read() -> None:
+        count = 0
+        try:
+            async with asyncio.timeout(settings.properties_export_max_seconds):
+                async with admission.stage(admission.db_gate):
+                    node = await _read_node()
+                    async with _use(node) as conn, conn.transaction(readonly=True):
+                        async for record in conn.cursor(sql, *params, prefetch=settings.properties_export_prefetch):
+                            if count == settings.properties_export_max_rows:
+                                raise StreamAborted("row limit reached")
+                            count += 1
+                            await put(dict(record))
+            await put(_STREAM_END)
+        except TimeoutError:
+            fail(StreamAborted("deadline exceeded"))
+        except Exception as exc:
+            fail(exc)
+        finally:
+            metrics.inc("db_rows_total", count)
+            metrics.inc("db_streamed_rows_total", count)
+
+    reader = asyncio.ensure_future(read())
+    try:
+        while (item := await buffer.get()) is not _STREAM_END:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Consumer went away early
+        reader.cancel()
+
+
+async def fetch_shared(sql: str, *params: Any) -> list[dict]:
+    """`fetch` with single-flight coalescing and a short-TTL result cache.
+
+    Keyed on the exact (sql, params) of a canonical statement. Rows are
+    copied on the way out so callers cannot mutate cached results.
+    """
+    if not settings.db_result_cache_enabled:
+        return await fetch(sql, *params)
+    rows = await _RESULT_CACHE.get_or_load((sql, params), lambda: fetch(sql, *params))
+    return [dict(r) for r in rows]
+
+
+async def fetch_result_shared(sql: str, *params: Any) -> ResultSet:
+    """`fetch_result` with the coalescing and cache of `fetch_shared`."""
+    if not settings.db_result_cache_enabled:
+        return await fetch_result(sql, *params)
+    return await _RESULT_CACHE.get_or_load(("result", sql, params), lambda: fetch_result(sql, *params))
+
+
+def get_result_cache_stats() -> dict[str, int]:
+    return _RESULT_CACHE.stats()
+
+
+def clear_result_cache() -> None:
+    _RESULT_CACHE.clear()
+
+
+def add_change_listener(
+    on_change: Callable[[list[dict]], None],
+    on_resync: Callable[[], None] | None = None,
+) -> None:
+    """Receive batches of row changes, and `on_resync()` after every (re)connect.
+
+    A change is the trigger payload: {"t": table, "op": "I"|"U"|"D", "id": row id}.
+    Callbacks run on the event loop and must not block; schedule tasks for I/O.
+    """
+    _CHANGE_LISTENERS.append((on_change, on_resync))
+
+
+def _dispatch_changes() -> None:
+    global _DISPATCH_HANDLE
+    _DISPATCH_HANDLE = None
+    batch = _PENDING_CHANGES[:]
+    _PENDING_CHANGES.clear()
+    if not batch:
+        return
+    _CHANGE_STATS["batches"] += 1
+    for on_change, _ in _CHANGE_LISTENERS:
+        try:
+            on_change(batch)
+        except Exception:
+            logger.exception("Change listener failed")
+
+
+def _on_notify(conn: Any, pid: int, channel: str, payload: str) -> None:
+    global _DISPATCH_HANDLE
+    try:
+        change = json.loads(payload)
+    except ValueError:
+        change = None
+    if not isinstance(change, dict) or "id" not in change:
+        _CHANGE_STATS["bad_payloads"] += 1
+        return
+    _CHANGE_STATS["notifications"] += 1
+    _PENDING_CHANGES.append(change)
+    if _DISPATCH_HANDLE is None:
+        _DISPATCH_HANDLE = asyncio.get_running_loop().call_later(
+            settings.db_change_debounce_seconds, _dispatch_changes
+        )
+
+
+def _resync() -> None:
+    _CHANGE_STATS["resyncs"] += 1
+    for _, on_resync in _CHANGE_LISTENERS:
+        if on_resync is None:
+            continue
+        try:
+            on_resync()
+        except Exception:
+            logger.exception("Change listener resync failed")
+
+
+async def _listen_once() -> None:
+    """Hold one LISTEN connection until it drops or stops answering pings."""
+    conn = await asyncpg.connect(settings.database_url, timeout=settings.db_health_check_timeout_seconds)
+    try:
+        closed = asyncio.Event()
+        conn.add_termination_listener(lambda _: closed.set())
+        await conn.add_listener(settings.db_change_channel, _on_notify)
+        # Changes may have been missed before LISTEN took effect
+        _resync()
+        _CHANGE_STATS["connected"] = 1
+        interval = settings.db_health_check_interval_seconds or 5.0
+        while not closed.is_set():
+            try:
+                await asyncio.wait_for(closed.wait(), interval)
+            except asyncio.TimeoutError:
+                # A silently dead socket never fires the termination listener
+                await conn.execute("SELECT 1", timeout=settings.db_health_check_timeout_seconds)
+    finally:
+        _CHANGE_STATS["connected"] = 0
+        conn.terminate()
+
+
+async def _listen_forever() -> None:
+    delay = 0.5
+    while True:
+        started = time.monotonic()
+        try:
+            await _listen_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.warning("Change listener disconnected: %s", exc)
+        if time.monotonic() - started > settings.db_change_reconnect_max_seconds:
+            # The last connection was healthy for a while: retry quickly
+            delay = 0.5
+        _CHANGE_STATS["reconnects"] += 1
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, settings.db_change_reconnect_max_seconds)
+
+
+async def start_change_listener() -> None:
+    """Start the LISTEN connection (no-op when disabled or already running)."""
+    global _LISTENER_TASK
+    if not settings.db_change_listener_enabled or not settings.database_url:
+        return
+    if not is_safe_identifier(settings.db_change_channel):
+        raise RuntimeError(f"Invalid DB_CHANGE_CHANNEL: {settings.db_change_channel!r}")
+    if _LISTENER_TASK is None or _LISTENER_TASK.done():
+        _LISTENER_TASK = asyncio.get_running_loop().create_task(_listen_forever())
+
+
+async def stop_change_listener() -> None:
+    global _LISTENER_TASK, _DISPATCH_HANDLE
+    if _LISTENER_TASK is not None:
+        _LISTENER_TASK.cancel()
+        try:
+            await _LISTENER_TASK
+        except asyncio.CancelledError:
+            pass
+        _LISTENER_TASK = None
+    if _DISPATCH_HANDLE is not None:
+        _DISPATCH_HANDLE.cancel()
+        _DISPATCH_HANDLE = None
+    _PENDING_CHANGES.clear()
+
+
+def is_change_listener_connected() -> bool:
+    """True while the LISTEN connection is up, i.e. row changes are being reported."""
+    return _CHANGE_STATS["connected"] == 1
+
+
+def get_change_listener_stats() -> dict[str, int]:
+    return {"pending": len(_PENDING_CHANGES), **_CHANGE_STATS}
+
 
-    async with _POOL.acquire() as conn:
-        stmt = await conn.prepare(sql)
-        records = await stmt.fetch(*params)
-        results: list[dict] = []
-        for r in records:
-            results.append(dict(r))
-        return results
+# Any row change may alter any cached search result
+add_change_listener(lambda changes: _RESULT_CACHE.clear(), _RESULT_CACHE.clear)
@@ -0,0 +1,157 @@
+"""In-memory evaluation of search filters over result rows.
+
+Mirrors the predicates `query_builder` renders to SQL (same FILTER_SPECS,
+same NULL semantics: a NULL column never matches) so rows fetched once can
+be filtered locally with results identical to running the query.
+
+`is_refinement` decides filter subsumption: when the new filters can only
+match a subset of the rows the old filters matched, a complete candidate
+set fetched for the old filters answers the new search exactly.
+
+Candidate sets are snapshots of rows: `invalidate_candidates` (called when
+the change feed reports modified rows) makes every set built before it
+stale, whatever its TTL.
+"""
+
+import operator
+import sys
+import time
+from typing import Any, Iterable, Sequence
+from app.services import query_builder
+
+
+_OPERATORS = {"=": operator.eq, ">=": operator.ge, "<=": operator.le}
+_SPECS = {spec.key: spec for spec in query_builder.FILTER_SPECS}
+# Candidate sets created before this time are stale
+_INVALIDATED_AT = 0.0
+
+
+def _compile(filters: dict) -> list[tuple[str, Any, Any]]:
+    """(row key, comparison, value) for every active filter."""
+    return [
+        (_SPECS[key].row_key, _OPERATORS[_SPECS[key].op], value)
+        for key, value in query_builder.active_filters(filters).items()
+    ]
+
+
+def _matches(row: dict, predicates: list[tuple[str, Any, Any]]) -> bool:
+    for row_key, compare, value in predicates:
+        column_value = row.get(row_key)
+        if column_value is None or not compare(column_value, value):
+            return False
+    return True
+
+
+def row_matches(row: dict, filters: dict) -> bool:
+    """True when `row` satisfies every active filter in `filters`."""
+    return _matches(row, _compile(filters))
+
+
+def apply_filters(rows: Iterable[dict], filters: dict, limit: int | None = None) -> list[dict]:
+    """Filter already ordered `rows`, keeping their order and at most `limit`."""
+    predicates = _compile(filters)
+    matched: list[dict] = []
+    for row in rows:
+        if _matches(row, predicates):
+            matched.append(row)
+            if limit is not None and len(matched) >= limit:
+                break
+    return matched
+
+
+def is_refinement(base: dict, new: dict) -> bool:
+    """True when every row matching `new` also matches `base`.
+
+    Each predicate of `base` must still be present in `new` and be at least
+    as strict: equal for `=`, a higher bound for `>=`, a lower one for `<=`.
+    Extra predicates in `new` only narrow the result further.
+    """
+    base_active = query_builder.active_filters(base)
+    new_active = query_builder.active_filters(new)
+    for key, base_value in base_active.items():
+        if key not in new_active:
+            return False
+        new_value = new_active[key]
+        op = _SPECS[key].op
+        if op == "=" and new_value != base_value:
+            return False
+        if op == ">=" and new_value < base_value:
+            return False
+        if op == "<=" and new_value > base_value:
+            return False
+    return True
+
+
+class CandidateSet:
+    """Every row matching `filters`, in result order, small enough to keep.
+
+    Searches whose filters refine `filters` are answered by `apply_filters`
+    over `rows` without touching the database.
+    """
+
+    __slots__ = ("filters", "rows", "created_at", "size")
+
+    def __init__(self, filters: dict, rows: list[dict], as_of: float | None = None) -> None:
+        self.filters = query_builder.active_filters(filters)
+        self.rows = rows
+        # When the rows were read (before the query, so changes during it count)
+        self.created_at = time.time() if as_of is None else as_of
+        self.size = estimate_rows_size(rows)
+
+    @classmethod
+    def bounded(
+        cls,
+        filters: dict,
+        rows: Sequence[dict],
+        max_rows: int,
+        max_bytes: int,
+        as_of: float | None = None,
+    ) -> "CandidateSet | None":
+        """Build a set from a query run with LIMIT max_rows + 1, or None if it overflowed.
+
+        `rows` may be a ResultSet; its rows become dicts only when they are kept.
+        """
+        if len(rows) > max_rows:
+            return None
+        candidates = cls(filters, list(rows), as_of)
+        if candidates.size > max_bytes:
+            return None
+        return candidates
+
+    def is_current(self) -> bool:
+        """No row change was reported since the set was built."""
+        return self.created_at > _INVALIDATED_AT
+
+    def is_fresh(self, ttl_seconds: float) -> bool:
+        return self.is_current() and time.time() - self.created_at <= ttl_seconds
+
+    def answers(self, filters: dict) -> bool:
+        return is_refinement(self.filters, filters)
+
+    def search(self, filters: dict, limit: int | None = None) -> list[dict]:
+        return apply_filters(self.rows, filters, limit)
+
+
+def invalidate_candidates() -> None:
+    """Make every existing candidate set stale."""
+    global _INVALIDATED_AT
+    _INVALIDATED_AT = time.time()
+
+
+def estimate_row_size(row: dict) -> int:
+    """Approximate bytes held by one row: the dict plus its values.
+
+    Values shared with other rows (small ints, interned strings) are
+    counted every time, so this errs on the large side.
+    """
+    return sys.getsizeof(row) + sum(map(sys.getsizeof, row.values()))
+
+
+def estimate_rows_size(rows: list[dict]) -> int:
+    """Approximate bytes held by a row list (see estimate_row_size)."""
+    return sum(map(estimate_row_size, rows))
+
+
+def without(filters: dict, *keys: Any) -> dict:
+    """Active filters minus `keys`."""
+    return {k: v for k, v in query_builder.active_filters(filters).items() if k not in keys}
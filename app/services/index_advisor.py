@@ -0,0 +1,304 @@
+"""Workload-driven index suggestions for the property search.
+
+Every search statement run by `db.fetch` is recorded by shape: the set of
+filters that were set (the NULL parameters are the ones that were not).
+Per shape the advisor keeps the count and total latency, plus the values
+seen for estado and the booleans. When a search is slower than
+`index_advisor_slow_ms`, a sampled share of them (`index_advisor_sample_rate`)
+is re-run in the background with EXPLAIN (ANALYZE, BUFFERS). The advisor
+then records which relations were read by sequential scan.
+
+`suggest()` turns that into ranked CREATE INDEX statements on
+propiedad/edificio:
+
+- one composite per shape: the equality columns, then the result order
+  (`valor_comercial DESC, id`), so a filtered top-k is an index range scan;
+- partial (`WHERE balcon`, `WHERE estado = '...'`) when one value
+  dominates a filter;
+- `edificio (distrito)` and `propiedad (edificio_id)` for the join when
+  distrito is filtered.
+
+The estimated benefit of an index is the search time of the shapes it
+serves, weighted by the share of their sampled plans that used a
+sequential scan on its table (0.5 when no plan was sampled). The DDL is
+for review only; nothing is created automatically.
+
+    python -m app.services.index_advisor [--url http://localhost:8000]
+
+prints the suggestions of a running server (GET /admin/index-advisor, with
+ADMIN_TOKEN as the Bearer token).
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import re
+from collections import Counter
+from typing import Any
+from app.config import get_settings
+from app.services import db as db_service
+from app.services import query_builder
+
+
+settings = get_settings()
+
+_SCHEMA = "property_infrastructure"
+_SEARCH_SQL = frozenset(sql for sql, _ in query_builder.canonical_statements())
+_FILTER_COUNT = len(query_builder.FILTER_KEYS)
+# Filters whose values are recorded, for partial index predicates
+_TRACKED_VALUES = frozenset(
+    spec.key for spec in query_builder.FILTER_SPECS if spec.pg_type == "boolean" or spec.key == "estado"
+)
+# A value this frequent in a shape becomes a partial index predicate
+_DOMINANT_SHARE = 0.9
+_UNSAMPLED_SCAN_SHARE = 0.5
+_ORDER_COLUMNS = ("valor_comercial DESC", "id")
+
+
+class _ShapeStats:
+    __slots__ = ("count", "total_seconds", "max_seconds", "slow", "values", "plans")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.slow = 0
+        self.values: dict[str, Counter] = {}
+        # Summaries of sampled EXPLAIN ANALYZE plans
+        self.plans: list[dict[str, Any]] = []
+
+    def scan_share(self, relation: str) -> float:
+        if not self.plans:
+            return _UNSAMPLED_SCAN_SHARE
+        return sum(relation in plan["seq_scans"] for plan in self.plans) / len(self.plans)
+
+
+_SHAPES: dict[tuple[str, ...], _ShapeStats] = {}
+_EXPLAINING: set[asyncio.Task] = set()
+_STATS = {"recorded": 0, "sampled": 0, "explain_errors": 0}
+
+
+def _shape(params: tuple) -> tuple[str, ...]:
+    return tuple(key for key, value in zip(query_builder.FILTER_KEYS, params[:_FILTER_COUNT]) if value is not None)
+
+
+def observe(sql: str, params: tuple, seconds: float) -> None:
+    """db query observer: record search statements by shape."""
+    if not settings.index_advisor_enabled or sql not in _SEARCH_SQL:
+        return
+    shape = _shape(params)
+    stats = _SHAPES.get(shape)
+    if stats is None:
+        stats = _SHAPES[shape] = _ShapeStats()
+    stats.count += 1
+    stats.total_seconds += seconds
+    stats.max_seconds = max(stats.max_seconds, seconds)
+    _STATS["recorded"] += 1
+    for key, value in zip(query_builder.FILTER_KEYS, params):
+        if value is not None and key in _TRACKED_VALUES:
+            stats.values.setdefault(key, Counter())[value] += 1
+
+    if seconds * 1000 < settings.index_advisor_slow_ms:
+        return
+    stats.slow += 1
+    if (
+        len(stats.plans) < settings.index_advisor_plans_per_shape
+        and not _EXPLAINING
+        and random.random() < settings.index_advisor_sample_rate
+    ):
+        # One EXPLAIN at a time, off the request path
+        task = asyncio.get_running_loop().create_task(_explain(stats, sql, params))
+        _EXPLAINING.add(task)
+        task.add_done_callback(_EXPLAINING.discard)
+
+
+def _summarize_plan(plan: dict[str, Any]) -> dict[str, Any]:
+    seq_scans: set[str] = set()
+    index_scans: set[str] = set()
+    removed = 0
+
+    def walk(node: dict[str, Any]) -> None:
+        nonlocal removed
+        relation = node.get("Relation Name")
+        if relation:
+            (seq_scans if node.get("Node Type") == "Seq Scan" else index_scans).add(relation)
+        removed += node.get("Rows Removed by Filter", 0)
+        for child in node.get("Plans", ()):
+            walk(child)
+
+    root = plan["Plan"]
+    walk(root)
+    return {
+        "execution_ms": plan.get("Execution Time"),
+        "seq_scans": sorted(seq_scans),
+        "index_scans": sorted(index_scans),
+        "rows_removed_by_filter": removed,
+        "shared_hit_blocks": root.get("Shared Hit Blocks"),
+        "shared_read_blocks": root.get("Shared Read Blocks"),
+    }
+
+
+async def _explain(stats: _ShapeStats, sql: str, params: tuple) -> None:
+    _STATS["sampled"] += 1
+    try:
+        rows = await db_service.fetch(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql.rstrip().rstrip(';')}", *params)
+        document = rows[0]["QUERY PLAN"]
+        if isinstance(document, str):
+            document = json.loads(document)
+        stats.plans.append(_summarize_plan(document[0]))
+    except Exception:
+        _STATS["explain_errors"] += 1
+
+
+def _sql_literal(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _dominant(stats: _ShapeStats, key: str) -> Any:
+    values = stats.values.get(key)
+    if not values:
+        return None
+    value, count = values.most_common(1)[0]
+    return value if count / sum(values.values()) >= _DOMINANT_SHARE else None
+
+
+def _candidates(shape: tuple[str, ...], stats: _ShapeStats) -> list[tuple[str, tuple[str, ...], str | None]]:
+    """(table, columns, where) indexes that would serve `shape`."""
+    columns: list[str] = []
+    predicates: list[str] = []
+    for spec in query_builder.FILTER_SPECS:
+        if spec.key not in shape or not spec.column.startswith("p.") or spec.op != "=":
+            continue
+        name = spec.column[2:]
+        dominant = _dominant(stats, spec.key) if spec.key in _TRACKED_VALUES else None
+        if spec.pg_type == "boolean":
+            # Booleans make poor key columns: only index them as a predicate
+            if dominant is not None:
+                predicates.append(name if dominant else f"NOT {name}")
+        elif dominant is not None:
+            predicates.append(f"{name} = {_sql_literal(dominant)}")
+        else:
+            columns.append(name)
+    candidates = [("propiedad", tuple(columns) + _ORDER_COLUMNS, " AND ".join(predicates) or None)]
+    if "distrito" in shape:
+        candidates.append(("edificio", ("distrito",), None))
+        candidates.append(("propiedad", ("edificio_id",), None))
+    return candidates
+
+
+def _index_name(table: str, columns: tuple[str, ...], where: str | None) -> str:
+    parts = [column.split()[0] for column in columns]
+    name = f"idx_{table}_{'_'.join(parts)}"
+    if where:
+        name += "_where_" + re.sub(r"[^a-z0-9]+", "_", where.lower()).strip("_")
+    if len(name) > 63:
+        # Postgres truncates identifiers at 63 bytes; keep names distinct
+        digest = hashlib.sha1(name.encode()).hexdigest()[:8]
+        name = f"{name[:54].rstrip('_')}_{digest}"
+    return name
+
+
+def _ddl(table: str, columns: tuple[str, ...], where: str | None) -> str:
+    where_sql = f" WHERE {where}" if where else ""
+    return (
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {_index_name(table, columns, where)} "
+        f"ON {_SCHEMA}.{table} ({', '.join(columns)}){where_sql};"
+    )
+
+
+def suggest(limit: int = 10) -> list[dict[str, Any]]:
+    """Ranked index suggestions for the recorded workload."""
+    merged: dict[str, dict[str, Any]] = {}
+    for shape, stats in _SHAPES.items():
+        for table, columns, where in _candidates(shape, stats):
+            ddl = _ddl(table, columns, where)
+            entry = merged.get(ddl)
+            if entry is None:
+                entry = merged[ddl] = {
+                    "table": table,
+                    "columns": list(columns),
+                    "where": where,
+                    "ddl": ddl,
+                    "benefit_seconds": 0.0,
+                    "queries": 0,
+                    "sampled_plans": 0,
+                    "shapes": [],
+                }
+            entry["benefit_seconds"] += stats.total_seconds * stats.scan_share(table)
+            entry["queries"] += stats.count
+            entry["sampled_plans"] += len(stats.plans)
+            entry["shapes"].append(list(shape))
+    ranked = sorted(merged.values(), key=lambda entry: entry["benefit_seconds"], reverse=True)
+    return ranked[:limit]
+
+
+def report(limit: int = 10) -> dict[str, Any]:
+    shapes = [
+        {
+            "filters": list(shape),
+            "count": stats.count,
+            "mean_ms": stats.total_seconds / stats.count * 1000,
+            "max_ms": stats.max_seconds * 1000,
+            "slow": stats.slow,
+            "plans": stats.plans,
+        }
+        for shape, stats in sorted(_SHAPES.items(), key=lambda item: item[1].total_seconds, reverse=True)
+    ]
+    return {
+        **_STATS,
+        "shapes": shapes,
+        "suggestions": suggest(limit),
+        "notes": [
+            "The generic search statement uses ($n IS NULL OR ...) predicates; they only use "
+            "indexes with custom plans (plan_cache_mode = force_custom_plan on the search role).",
+            "Benefits are estimates from observed latency; check with EXPLAIN before creating.",
+        ],
+    }
+
+
+def render_ddl(limit: int = 10) -> str:
+    """Suggestions as a reviewable SQL script."""
+    lines = ["-- Index suggestions from the recorded search workload (review before running)"]
+    for entry in suggest(limit):
+        lines.append(
+            f"-- benefit ~{entry['benefit_seconds']:.2f}s over {entry['queries']} searches, "
+            f"{entry['sampled_plans']} sampled plans, shapes: {entry['shapes']}"
+        )
+        lines.append(entry["ddl"])
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    _SHAPES.clear()
+    for key in _STATS:
+        _STATS[key] = 0
+
+
+db_service.add_query_observer(observe)
+
+
+def main() -> None:
+    import argparse
+    import httpx
+
+    ap = argparse.ArgumentParser(description="Print the index suggestions of a running server")
+    ap.add_argument("--url", default=f"http://{settings.api_host}:{settings.api_port}")
+    ap.add_argument("--limit", type=int, default=10)
+    ap.add_argument("--json", action="store_true", help="full report instead of the DDL script")
+    args = ap.parse_args()
+
+    response = httpx.get(
+        f"{args.url.rstrip('/')}/admin/index-advisor",
+        params={"limit": args.limit, "format": "json" if args.json else "sql"},
+        headers={"Authorization": f"Bearer {settings.admin_token or ''}"},
+        timeout=30,
+    )
+    response.raise_for_status()
+    print(json.dumps(response.json(), indent=2, default=str) if args.json else response.text, end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,94 +1,345 @@
 """LLM client wrapper using OpenAI async API.
 
 This module performs the minimal task of sending a prompt (extraction) to
-OpenAI and returning parsed JSON output. The prompt templates are provided
-by the prompts package (when implemented).
+OpenAI and returning parsed JSON output. The prompt templates and response
+schemas are provided by the prompts package (app.prompts.extraction).
+
+A single long-lived `AsyncOpenAI` client (keep-alive connection pool) is
+created from the app lifespan via `init_llm_client`. Every request holds a
+slot of the admission llm gate (`admission.llm_gate`: bounded concurrency
+and queue), a per-attempt deadline and jittered exponential retries;
+optionally a hedged second request is fired when the first one is slower
+than the recent latency percentile. Token usage is
+accounted per call and per purpose (`get_token_stats`, /metrics).
 """
 
-from typing import Any
+from collections import deque
+from typing import Any, Awaitable, Callable
+import asyncio
 import json
+import random
+import time
+import httpx
 import openai
 from app.config import get_settings
+from app.prompts import extraction as prompts
+from app.services import admission
+from app.utils import metrics
+from app.utils.cache import TTLCache
+from app.utils.nlp_helpers import normalize_text
 
 
 settings = get_settings()
 
+PROMPT_VERSION = prompts.PROMPT_VERSION
+# Tokens per call
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
 
-async def extract_filters_from_text(text: str) -> dict[str, Any]:
-    """Call OpenAI to extract filters from a user message and parse JSON output.
+_EXTRACTION_CACHE = TTLCache(
+    max_entries=settings.llm_cache_max_entries,
+    ttl_seconds=settings.llm_cache_ttl_seconds,
+)
+
+
+@metrics.timed("llm.extract")
+async def extract_filters_from_text(text: str, pending: str | None = None) -> dict[str, Any]:
+    """Extract filters from a user message, serving repeated messages from cache.
 
-    Expects the model to return a JSON object (as text). This function will try
-    to parse the text as JSON and return a dict.
+    `pending` (the field the agent just asked for) is sent as context. The
+    session's known filters are not: the caller merges the answer into
+    them, so the same utterance hits the cache from any session. The cache
+    key is the normalized text, `pending`, the model name and the prompt
+    version. Concurrent misses for the same key share a single OpenAI call.
     """
+    if not settings.llm_cache_enabled:
+        return await _request_extraction(text, pending)
+
+    key = _cache_key(text, pending)
+    result = await _EXTRACTION_CACHE.get_or_load(key, lambda: _request_extraction(text, pending))
+    # Hand out a copy so callers cannot mutate the cached entry
+    return dict(result)
+
+
+def _cache_key(text: str, pending: str | None = None) -> tuple[str | None, ...]:
+    return (normalize_text(text), pending, settings.llm_model, PROMPT_VERSION)
+
+
+def cached_extraction(text: str) -> dict[str, Any] | None:
+    """Cached extraction of `text`, without calling the LLM on a miss."""
+    if not settings.llm_cache_enabled:
+        return None
+    result = _EXTRACTION_CACHE.get(_cache_key(text))
+    return dict(result) if result is not None else None
+
+
+def store_extraction(text: str, result: dict[str, Any]) -> None:
+    """Cache an extraction obtained outside `extract_filters_from_text`."""
+    if settings.llm_cache_enabled:
+        _EXTRACTION_CACHE.set(_cache_key(text), dict(result))
+
+
+def get_extraction_cache_stats() -> dict[str, int]:
+    return _EXTRACTION_CACHE.stats()
+
+
+def clear_extraction_cache() -> None:
+    _EXTRACTION_CACHE.clear()
+
+
+_CLIENT: openai.AsyncOpenAI | None = None
+_LATENCIES: deque[float] = deque(maxlen=settings.llm_latency_window)
+# Token usage per purpose ("extract", "batch")
+_TOKENS: dict[str, dict[str, int]] = {}
+_STATS: dict[str, int] = {
+    "requests": 0,
+    "attempts": 0,
+    "retries": 0,
+    "timeouts": 0,
+    "failures": 0,
+    "hedges": 0,
+    "hedge_wins": 0,
+}
+
+# Transient errors worth another attempt; anything else (auth, bad request)
+# is raised immediately.
+_RETRYABLE = (
+    asyncio.TimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+async def init_llm_client() -> None:
+    """Create the shared OpenAI client and its HTTP connection pool."""
+    global _CLIENT
     api_key = settings.openai_api_key
     if not api_key:
         raise RuntimeError("OPENAI API key not configured in settings")
 
-    openai.api_key = api_key
-
-    # Enhanced prompt for better conversational extraction
-    system_prompt = """Eres un asistente especializado en extraer información de búsqueda de propiedades inmobiliarias.
-Tu trabajo es analizar mensajes en lenguaje natural y extraer los filtros de búsqueda en formato JSON.
-
-FILTROS POSIBLES:
-- distrito: nombre del distrito (ej: "La Molina", "Palermo", "San Isidro")
-- area_min: área mínima en m² (número)
-- estado: estado de la propiedad (DISPONIBLE, OCUPADA, MANTENIMIENTO, VENDIDA)
-- presupuesto_max: presupuesto máximo (número)
-- dormitorios: cantidad de dormitorios (número)
-- banios: cantidad de baños (número)
-- pet_friendly: acepta mascotas (true/false)
-- balcon: tiene balcón (true/false)
-- terraza: tiene terraza (true/false)
-- amoblado: está amoblado (true/false)
-
-REGLAS:
-1. Solo extrae información que esté EXPLÍCITA o IMPLÍCITA en el mensaje
-2. Si el usuario menciona "departamento", "depto", "piso" considera que busca propiedades
-3. Si menciona un lugar, extrae el distrito
-4. Si menciona números de ambientes/habitaciones, extrae dormitorios (ej: "2 ambientes" = 1 dormitorio, "3 ambientes" = 2 dormitorios)
-5. Si menciona área (m², metros), extrae area_min
-6. Si menciona presupuesto/precio/monto, extrae presupuesto_max
-7. NO inventes información que no esté en el mensaje
-8. Devuelve SOLO un objeto JSON válido, sin explicaciones adicionales
-
-EJEMPLOS:
-Input: "Quiero un departamento en La Molina"
-Output: {"distrito": "La Molina"}
-
-Input: "Busco depto de 2 ambientes en Palermo"
-Output: {"distrito": "Palermo", "dormitorios": 1}
-
-Input: "Necesito un depto de 80m² con 3 ambientes"
-Output: {"area_min": 80, "dormitorios": 2}"""
-
-    user_prompt = f"Mensaje del usuario: {text}\n\nExtrae los filtros en formato JSON:"
-
-    # Use the OpenAI async completion via ChatCompletion.create (requires openai>=1.0)
+    http_client = openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=settings.llm_pool_max_connections,
+            max_keepalive_connections=settings.llm_pool_max_keepalive,
+            keepalive_expiry=settings.llm_keepalive_expiry_seconds,
+        ),
+    )
+    # Retries and timeouts are handled here so the policy is uniform
+    _CLIENT = openai.AsyncOpenAI(
+        api_key=api_key,
+        http_client=http_client,
+        timeout=settings.llm_request_timeout_seconds,
+        max_retries=0,
+    )
+
+
+async def close_llm_client() -> None:
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.close()
+        _CLIENT = None
+
+
+async def _get_client() -> openai.AsyncOpenAI:
+    if _CLIENT is None:
+        await init_llm_client()
+    return _CLIENT
+
+
+def get_llm_client_stats() -> dict[str, Any]:
+    return {
+        **_STATS,
+        "in_flight": admission.llm_gate.active,
+        "queued": admission.llm_gate.waiting,
+        "hedge_delay_seconds": _hedge_delay(),
+    }
+
+
+def _hedge_delay() -> float | None:
+    """Latency percentile after which a hedged request is sent (None = no hedge)."""
+    if not settings.llm_hedge_enabled or len(_LATENCIES) < settings.llm_hedge_min_samples:
+        return None
+    ordered = sorted(_LATENCIES)
+    idx = min(len(ordered) - 1, int(settings.llm_hedge_percentile * len(ordered)))
+    return ordered[idx]
+
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter in [delay/2, delay]."""
+    delay = min(settings.llm_retry_max_delay_seconds, settings.llm_retry_base_delay_seconds * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0)
+
+
+async def _hedged(call: Callable[[], Awaitable[Any]]) -> Any:
+    """Run `call`; if it outlives the hedge delay, race a second copy.
+
+    The hedge only fires when a concurrency slot is free, so it never queues
+    behind real traffic. The loser is cancelled. A copy that ends cancelled
+    counts as failed; when neither succeeds, the last error is raised.
+    """
+    first = asyncio.ensure_future(call())
+    delay = _hedge_delay()
+    if delay is None:
+        return await first
+
     try:
-        resp = await openai.ChatCompletion.acreate(
-            model=settings.llm_model,
-            messages=[{"role": "system", "content": system_prompt},
-                      {"role": "user", "content": user_prompt}],
-            temperature=settings.llm_temperature,
-            max_tokens=500,
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done or admission.llm_gate.active >= admission.llm_gate.limit:
+            return await first
+
+        async def _second() -> Any:
+            # Bounded concurrency; sheds the turn when the queue is too long
+            async with admission.stage(admission.llm_gate):
+                return await call()
+
+        _STATS["hedges"] += 1
+        second = asyncio.ensure_future(_second())
+        pending = {first, second}
+        error: BaseException = asyncio.CancelledError()
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is None:
+                        if task is second:
+                            _STATS["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            second.cancel()
+    finally:
+        first.cancel()
+
+
+def _record_usage(purpose: str, usage: Any) -> None:
+    prompt = usage.prompt_tokens or 0
+    completion = usage.completion_tokens or 0
+    # Prompt tokens served from the provider's prefix cache
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+    totals = _TOKENS.setdefault(purpose, {"calls": 0, "prompt": 0, "completion": 0, "cached": 0})
+    totals["calls"] += 1
+    totals["prompt"] += prompt
+    totals["completion"] += completion
+    totals["cached"] += cached
+    metrics.inc("llm_tokens_total", prompt, kind="prompt", purpose=purpose)
+    metrics.inc("llm_tokens_total", completion, kind="completion", purpose=purpose)
+    metrics.inc("llm_tokens_total", cached, kind="cached", purpose=purpose)
+    metrics.observe("llm_tokens_per_call", prompt, TOKEN_BUCKETS, kind="prompt", purpose=purpose)
+    metrics.observe("llm_tokens_per_call", completion, TOKEN_BUCKETS, kind="completion", purpose=purpose)
+
+
+def get_token_stats() -> dict[str, dict[str, float]]:
+    """Token totals and per-call means for each purpose."""
+    return {
+        purpose: {
+            **totals,
+            "prompt_per_call": totals["prompt"] / totals["calls"],
+            "completion_per_call": totals["completion"] / totals["calls"],
+        }
+        for purpose, totals in _TOKENS.items()
+    }
+
+
+async def _complete(
+    messages: list[dict[str, str]],
+    max_tokens: int,
+    response_format: dict[str, Any] | None = None,
+    purpose: str = "extract",
+) -> Any:
+    """Send a chat completion with bounded concurrency, deadlines and retries."""
+    client = await _get_client()
+    extra: dict[str, Any] = {}
+    if response_format is not None and settings.llm_structured_output:
+        extra["response_format"] = response_format
+
+    async def _call() -> Any:
+        _STATS["attempts"] += 1
+        started = time.perf_counter()
+        resp = await asyncio.wait_for(
+            client.chat.completions.create(
+                model=settings.llm_model,
+                messages=messages,
+                temperature=settings.llm_temperature,
+                max_tokens=max_tokens,
+                **extra,
+            ),
+            timeout=settings.llm_request_timeout_seconds,
         )
+        _LATENCIES.append(time.perf_counter() - started)
+        metrics.observe("llm_request_duration_seconds", _LATENCIES[-1])
+        usage = getattr(resp, "usage", None)
+        if usage is not None:
+            _record_usage(purpose, usage)
+        return resp
 
-        content = resp.choices[0].message.content.strip()
+    _STATS["requests"] += 1
+    attempt = 0
+    while True:
+        try:
+            async with admission.stage(admission.llm_gate):
+                return await _hedged(_call)
+        except _RETRYABLE as exc:
+            if isinstance(exc, asyncio.TimeoutError):
+                _STATS["timeouts"] += 1
+            if attempt >= settings.llm_max_retries:
+                _STATS["failures"] += 1
+                raise
+            _STATS["retries"] += 1
+            await asyncio.sleep(_backoff(attempt))
+            attempt += 1
 
-        # Attempt to extract JSON substring (in case the model includes backticks)
-        json_start = content.find("{")
-        json_end = content.rfind("}")
-        if json_start != -1 and json_end != -1 and json_end >= json_start:
-            json_text = content[json_start:json_end + 1]
-        else:
-            json_text = content
 
-        parsed = json.loads(json_text)
-        if isinstance(parsed, dict):
-            return parsed
-        return {}
+async def _request_extraction(text: str, pending: str | None = None) -> dict[str, Any]:
+    """Call OpenAI to extract filters from a user message and parse JSON output.
 
-    except Exception as e:
-        # Bubble up exceptions for the caller to handle (agent_service will decide)
-        raise
+    Expects the model to return a JSON object (schema-constrained when
+    `llm_structured_output` is on). Filters answered as null are dropped.
+    Exceptions bubble up for the caller to handle (agent_service decides).
+    """
+    resp = await _complete(
+        prompts.build_messages(text, pending),
+        max_tokens=settings.llm_extraction_max_tokens,
+        response_format=prompts.RESPONSE_FORMAT,
+    )
+    return prompts.drop_nulls(_parse_json_object(resp.choices[0].message.content))
+
+
+def _parse_json_object(content: str) -> Any:
+    content = content.strip()
+    # Attempt to extract JSON substring (in case the model includes backticks)
+    json_start = content.find("{")
+    json_end = content.rfind("}")
+    if json_start != -1 and json_end != -1 and json_end >= json_start:
+        json_text = content[json_start:json_end + 1]
+    else:
+        json_text = content
+    return json.loads(json_text)
+
+
+async def request_batch_extraction(texts: list[str]) -> list[dict[str, Any] | None]:
+    """Extract filters of several independent messages in one call.
+
+    Returns one raw dict per text, in order; None for texts the answer did
+    not cover (the caller retries those alone). Raises like `_complete`, or
+    ValueError when the answer is not JSON (e.g. cut at max_tokens).
+    """
+    resp = await _complete(
+        prompts.build_batch_messages(texts),
+        max_tokens=settings.llm_batch_output_tokens_per_item * len(texts) + 50,
+        response_format=prompts.BATCH_RESPONSE_FORMAT,
+        purpose="batch",
+    )
+    parsed = _parse_json_object(resp.choices[0].message.content)
+    items = parsed.get("resultados") if isinstance(parsed, dict) else None
+    results: list[dict[str, Any] | None] = [None] * len(texts)
+    for item in items if isinstance(items, list) else ():
+        if not isinstance(item, dict) or not isinstance(item.get("filtros"), dict):
+            continue
+        index = item.get("id")
+        if isinstance(index, int) and 0 <= index < len(texts):
+            results[index] = prompts.drop_nulls(item["filtros"])
+    return results
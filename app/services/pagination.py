@@ -0,0 +1,98 @@
+"""Keyset pagination and streamed exports of search results.
+
+A page is addressed by an opaque cursor: the (valor_comercial, id) of the
+last row already returned plus a short fingerprint of the filters it was
+issued for, base64url-encoded. The next page is the canonical page
+statement of `query_builder` with that key as parameters, so deep pages
+cost the same as the first one (no OFFSET). A cursor presented with
+different filters is rejected instead of silently mixing two result sets.
+
+Exports read the whole result through a server-side cursor (db.stream).
+"""
+
+import base64
+import hashlib
+import json
+from decimal import Decimal, InvalidOperation
+from typing import Any, AsyncIterator
+from app.services import db as db_service
+from app.services import query_builder
+from app.utils import json_codec
+
+
+class InvalidCursor(ValueError):
+    """Malformed cursor, or one issued for other filters."""
+
+
+def _fingerprint(filters: dict) -> str:
+    active = query_builder.active_filters(filters)
+    payload = json.dumps(active, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()[:12]
+
+
+def encode_cursor(filters: dict, row: dict) -> str:
+    """Cursor pointing after `row` in the results of `filters`."""
+    value = row.get("valor_comercial")
+    payload = {
+        "v": None if value is None else str(value),
+        "i": row["id"],
+        "f": _fingerprint(filters),
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(token: str, filters: dict) -> tuple[Decimal | None, int]:
+    """(valor_comercial, id) of a cursor issued for `filters`."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+        value = None if payload["v"] is None else Decimal(payload["v"])
+        last_id = int(payload["i"])
+        fingerprint = payload["f"]
+    except (ValueError, TypeError, KeyError, InvalidOperation) as exc:
+        raise InvalidCursor("Malformed cursor") from exc
+    if fingerprint != _fingerprint(filters):
+        raise InvalidCursor("Cursor was issued for other filters")
+    return value, last_id
+
+
+def next_cursor(filters: dict, rows: list[dict], page_size: int) -> str | None:
+    """Cursor after a full page, None after a short (last) one."""
+    if not rows or len(rows) < page_size:
+        return None
+    return encode_cursor(filters, rows[-1])
+
+
+async def fetch_page(
+    filters: dict,
+    cursor: str | None,
+    page_size: int,
+) -> tuple[str, Any, str | None]:
+    """Return (sql, rows, next_cursor) of the page after `cursor`.
+
+    Rows are a ResultSet on the fast JSON path, else a list of dicts.
+
+    One extra row is fetched to know whether another page exists, so the
+    last page never hands out a cursor to an empty one.
+    """
+    after = decode_cursor(cursor, filters) if cursor else None
+    sql, params = query_builder.build_property_page_query(filters, after, page_size + 1)
+    if json_codec.is_fast():
+        rows = await db_service.fetch_result_shared(sql, *params)
+    else:
+        rows = await db_service.fetch_shared(sql, *params)
+    page = rows[:page_size]
+    more = len(rows) > page_size
+    return sql, page, encode_cursor(filters, page[-1]) if more else None
+
+
+def export(filters: dict, cursor: str | None = None) -> AsyncIterator[dict[str, Any]]:
+    """Every row of `filters` after `cursor`, streamed in result order.
+
+    The cursor is checked here, before the first row is awaited, so a bad
+    one fails before a streaming response has started.
+    """
+    after = decode_cursor(cursor, filters) if cursor else None
+    sql, params = query_builder.build_property_page_query(filters, after, None)
+    return db_service.stream(sql, *params)
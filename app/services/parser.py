@@ -5,21 +5,63 @@ models in app.models.schemas.
 """
 
 from typing import Any
+from app.config import get_settings
 from app.services import llm_client
+from app.services import rule_extractor
 from app.models.schemas import FilterEssential, FilterOptional
+from app.utils import metrics
 
 
-async def parse_filters(text: str, current_filters: dict | None = None) -> dict[str, Any]:
+settings = get_settings()
+
+# How each turn was resolved: locally by rules or through llm_client
+_PATH_COUNTS: dict[str, int] = {"rules": 0, "llm": 0}
+
+
+@metrics.timed("parser.parse_filters")
+async def parse_filters(
+    text: str,
+    current_filters: dict | None = None,
+    pending: str | None = None,
+) -> dict[str, Any]:
     """Parse text and return candidate filters.
 
-    - Calls the LLM client (mockable) to extract filters as JSON
+    - Tries the rule-based extractor first (using the `pending` essential the
+      agent just asked for) and trusts it above the configured confidence
+    - Otherwise calls the LLM client (mockable) to extract filters as JSON
     - Validates and returns merged filters (only the keys present)
     """
     current_filters = current_filters or {}
 
-    # Call LLM client to get extraction (tests will mock this function)
-    raw = await llm_client.extract_filters_from_text(text)
+    raw = None
+    if settings.fast_path_enabled:
+        local, confidence = rule_extractor.extract(text, pending)
+        if local and confidence >= settings.fast_path_min_confidence:
+            _PATH_COUNTS["rules"] += 1
+            raw = local
+
+    if raw is None:
+        # Call LLM client to get extraction (tests will mock this function)
+        _PATH_COUNTS["llm"] += 1
+        raw = await llm_client.extract_filters_from_text(text, pending)
+
+    return normalize_extraction(raw, current_filters)
+
+
+def get_extraction_path_stats() -> dict[str, int]:
+    """Per-path turn counters; `offline` counts turns that never hit the network."""
+    cache = llm_client.get_extraction_cache_stats()
+    cache_served = cache["hits"] + cache["coalesced"]
+    return {
+        "rules": _PATH_COUNTS["rules"],
+        "llm": _PATH_COUNTS["llm"],
+        "llm_cache": cache_served,
+        "offline": _PATH_COUNTS["rules"] + cache_served,
+    }
+
 
+def normalize_extraction(raw: Any, current_filters: dict | None = None) -> dict[str, Any]:
+    """Map raw extracted keys to internal filter names and validate them."""
     if not isinstance(raw, dict):
         # If LLM returned unexpected format, return empty
         return {}
@@ -67,6 +109,8 @@ async def parse_filters(text: str, current_filters: dict | None = None) -> dict[
                 if isinstance(vv, str) and vv.replace('.', '', 1).isdigit():
                     # numeric string
                     coerced_essentials[kk] = float(vv) if '.' in vv else int(vv)
+                elif kk == "estado" and isinstance(vv, str):
+                    coerced_essentials[kk] = vv.strip().upper()
                 else:
                     coerced_essentials[kk] = vv
 
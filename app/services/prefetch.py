@@ -0,0 +1,136 @@
+"""Speculative candidate prefetch for the last missing essential.
+
+When exactly one essential is missing, the agent asks for it and starts a
+background query with every other filter and a bounded row cap. If the
+user's answer only refines those filters, the final search is answered
+from the prefetched candidate set in memory instead of a blocking DB
+round-trip. Prefetches are kept per session in this process, bounded
+in rows, bytes and number of sessions, and cancelled when superseded.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from app.config import get_settings
+from app.services import db as db_service
+from app.services import filter_algebra
+from app.services import query_builder
+
+
+settings = get_settings()
+
+
+class _Prefetch:
+    __slots__ = ("base_filters", "missing", "task", "candidates")
+
+    def __init__(self, base_filters: dict, missing: str) -> None:
+        self.base_filters = base_filters
+        self.missing = missing
+        self.task: asyncio.Task | None = None
+        # Stays None when the candidate set hit the row or byte cap
+        self.candidates: filter_algebra.CandidateSet | None = None
+
+
+_PREFETCHES: "OrderedDict[str, _Prefetch]" = OrderedDict()
+_STATS: dict[str, int] = {
+    "started": 0,
+    "hits": 0,
+    "misses": 0,
+    "stale": 0,
+    "overflow": 0,
+    "errors": 0,
+    "cancelled": 0,
+}
+
+
+async def _run(entry: _Prefetch) -> None:
+    cap = settings.prefetch_max_rows
+    sql, params = query_builder.build_property_search_query(entry.base_filters, limit=cap + 1)
+    started = time.time()
+    rows = await db_service.fetch_shared(sql, *params)
+    entry.candidates = filter_algebra.CandidateSet.bounded(
+        entry.base_filters, rows, cap, settings.prefetch_max_bytes, as_of=started
+    )
+    if entry.candidates is None:
+        # Too many candidates: the final top-k may lie beyond the cap
+        _STATS["overflow"] += 1
+
+
+def _retrieve_exception(task: asyncio.Task) -> None:
+    # Errors are counted in take(); avoid "exception was never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+
+def _discard(session_id: str) -> None:
+    entry = _PREFETCHES.pop(session_id, None)
+    if entry is not None and entry.task is not None and not entry.task.done():
+        entry.task.cancel()
+        _STATS["cancelled"] += 1
+
+
+def start(session_id: str, filters: dict, missing: str) -> None:
+    """Begin prefetching candidates for `filters` without the `missing` essential."""
+    if not settings.prefetch_enabled:
+        return
+    base = filter_algebra.without(filters, missing)
+    current = _PREFETCHES.get(session_id)
+    if current is not None and current.base_filters == base and current.missing == missing:
+        _PREFETCHES.move_to_end(session_id)
+        return
+
+    _discard(session_id)
+    entry = _Prefetch(base, missing)
+    entry.task = asyncio.get_running_loop().create_task(_run(entry))
+    entry.task.add_done_callback(_retrieve_exception)
+    _PREFETCHES[session_id] = entry
+    _STATS["started"] += 1
+    while len(_PREFETCHES) > settings.prefetch_max_sessions:
+        _discard(next(iter(_PREFETCHES)))
+
+
+def cancel(session_id: str) -> None:
+    _discard(session_id)
+
+
+async def take(session_id: str, filters: dict) -> filter_algebra.CandidateSet | None:
+    """Return the session's prefetched candidates if they answer `filters`.
+
+    The prefetch is consumed either way. A still-running prefetch is awaited,
+    since its query is already in flight. None means fall back to SQL.
+    Sessions without a prefetch are not counted; `misses` are prefetches
+    that did not answer (stale, failed or overflowed).
+    """
+    entry = _PREFETCHES.pop(session_id, None)
+    if entry is None:
+        return None
+    if not filter_algebra.is_refinement(entry.base_filters, filters):
+        if entry.task is not None and not entry.task.done():
+            entry.task.cancel()
+        _STATS["stale"] += 1
+        _STATS["misses"] += 1
+        return None
+
+    try:
+        await entry.task
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        _STATS["errors"] += 1
+        _STATS["misses"] += 1
+        return None
+    if entry.candidates is None:
+        _STATS["misses"] += 1
+        return None
+    if not entry.candidates.is_current():
+        # Rows changed while the prefetch was held
+        _STATS["stale"] += 1
+        _STATS["misses"] += 1
+        return None
+
+    _STATS["hits"] += 1
+    return entry.candidates
+
+
+def get_prefetch_stats() -> dict[str, int]:
+    return {"pending": len(_PREFETCHES), **_STATS}
@@ -0,0 +1,317 @@
+"""In-memory columnar index over the propiedad/edificio join (optional engine).
+
+The search is a conjunctive filter over a small, slowly changing join, so
+the whole join is loaded at startup into NumPy column arrays: numeric columns
+as float64 (NaN for NULL), distrito/estado dictionary-encoded, and the
+boolean columns as packed bitsets. `search` evaluates the same filter dict
+as `query_builder.build_property_search_query` with vectorized masks and
+returns the original row dicts in the same order (valor_comercial DESC,
+NULLs first as in Postgres, then id), so results match the SQL path.
+
+The snapshot is refreshed on a schedule. When `property_index_version_column`
+is set, refreshes only fetch rows whose version increased and patch them in;
+a full reload still runs every `property_index_full_reload_every` refreshes
+to pick up deletions and edificio changes. Rows reported by the change
+feed (change_feed) are patched in between refreshes. Snapshots are built
+in a worker thread, one at a time, so searches keep running on the
+previous snapshot meanwhile.
+
+NumPy is an optional dependency; without it the engine stays disabled.
+"""
+
+import asyncio
+import logging
+from typing import Any
+from app.config import get_settings
+from app.services import db as db_service
+from app.services import query_builder
+from app.utils.security import is_safe_identifier
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_NUMERIC_KEYS = ("area", "valor_comercial", "dormitorios", "banios")
+_CATEGORICAL_KEYS = ("edificio_distrito", "estado")
+_BOOLEAN_KEYS = ("permite_mascotas", "balcon", "terraza", "amoblado")
+
+
+class _Snapshot:
+    """Immutable columnar view of the rows; rebuilt wholesale on refresh."""
+
+    def __init__(self, rows: list[dict]) -> None:
+        self.rows = rows
+        self.n = len(rows)
+        self.numeric = {
+            key: np.array(
+                [np.nan if r.get(key) is None else float(r[key]) for r in rows], dtype=np.float64
+            )
+            for key in _NUMERIC_KEYS
+        }
+        self.dictionaries: dict[str, dict[Any, int]] = {}
+        self.codes: dict[str, Any] = {}
+        for key in _CATEGORICAL_KEYS:
+            dictionary: dict[Any, int] = {}
+            codes = np.empty(self.n, dtype=np.int32)
+            for i, r in enumerate(rows):
+                value = r.get(key)
+                codes[i] = -1 if value is None else dictionary.setdefault(value, len(dictionary))
+            self.dictionaries[key] = dictionary
+            self.codes[key] = codes
+        # Two bitsets per boolean column so NULL matches neither true nor false
+        self.bits: dict[tuple[str, bool], Any] = {}
+        for key in _BOOLEAN_KEYS:
+            values = [r.get(key) for r in rows]
+            self.bits[(key, True)] = np.packbits(np.array([v is True for v in values], dtype=bool))
+            self.bits[(key, False)] = np.packbits(np.array([v is False for v in values], dtype=bool))
+
+        # valor_comercial DESC with NULLs first (Postgres default), then id ASC
+        valor = self.numeric["valor_comercial"]
+        sort_key = np.where(np.isnan(valor), -np.inf, -valor)
+        ids = np.array([r["id"] for r in rows], dtype=np.int64) if rows else np.empty(0, dtype=np.int64)
+        self.order = np.lexsort((ids, sort_key))
+
+    def predicate_masks(self, filters: dict) -> dict[str, Any]:
+        """One boolean mask per active filter, keyed by filter name."""
+        masks = {}
+        for spec in query_builder.FILTER_SPECS:
+            value = filters.get(spec.key)
+            if value is None:
+                continue
+            key = spec.row_key
+            if key in self.codes:
+                code = self.dictionaries[key].get(value)
+                if code is None:
+                    masks[spec.key] = np.zeros(self.n, dtype=bool)
+                else:
+                    masks[spec.key] = self.codes[key] == code
+            elif key in self.numeric:
+                column = self.numeric[key]
+                target = float(value)
+                if spec.op == ">=":
+                    masks[spec.key] = column >= target
+                elif spec.op == "<=":
+                    masks[spec.key] = column <= target
+                else:
+                    masks[spec.key] = column == target
+            else:
+                masks[spec.key] = np.unpackbits(self.bits[(key, bool(value))], count=self.n).view(bool)
+        return masks
+
+    def mask(self, filters: dict) -> Any:
+        mask = np.ones(self.n, dtype=bool)
+        for predicate in self.predicate_masks(filters).values():
+            mask &= predicate
+        return mask
+
+    def facets(self, filters: dict) -> dict[str, Any]:
+        """Same counts as the SQL facet statement (see query_builder)."""
+        masks = self.predicate_masks(filters)
+
+        def conjunction(skip: str | None = None) -> Any:
+            mask = np.ones(self.n, dtype=bool)
+            for key, predicate in masks.items():
+                if key != skip:
+                    mask &= predicate
+            return mask
+
+        districts = self.dictionaries["edificio_distrito"]
+        names = {code: name for name, code in districts.items()}
+        codes = self.codes["edificio_distrito"][conjunction("distrito")]
+        district_counts = np.bincount(codes[codes >= 0], minlength=len(districts))
+        bedrooms = self.numeric["dormitorios"][conjunction("dormitorios")]
+        values, counts = np.unique(bedrooms[~np.isnan(bedrooms)], return_counts=True)
+        return {
+            "matches": int(conjunction().sum()),
+            "without": {key: int(conjunction(key).sum()) for key in masks},
+            "distrito": {names[c]: int(n) for c, n in enumerate(district_counts) if n},
+            "dormitorios": {int(v): int(n) for v, n in zip(values, counts)},
+        }
+
+    def top_k(self, filters: dict, limit: int) -> list[dict]:
+        if self.n == 0:
+            return []
+        hits = np.flatnonzero(self.mask(filters)[self.order])[:limit]
+        return [self.rows[i] for i in self.order[hits]]
+
+
+_SNAPSHOT: _Snapshot | None = None
+_ROWS_BY_ID: dict[Any, dict] = {}
+_VERSION: Any = None
+_REFRESHES = 0
+# Bumped on every reported change; a load that straddles one is redone
+_GENERATION = 0
+# Serializes row updates and snapshot swaps (builds run in a thread)
+_BUILD_LOCK = asyncio.Lock()
+_REFRESHER: asyncio.Task | None = None
+_STATS: dict[str, int] = {"searches": 0, "full_loads": 0, "incremental_loads": 0, "patched_rows": 0}
+
+
+def is_available() -> bool:
+    return np is not None
+
+
+def is_ready() -> bool:
+    return _SNAPSHOT is not None
+
+
+def _version_column() -> str | None:
+    column = settings.property_index_version_column
+    if column and not is_safe_identifier(column):
+        raise RuntimeError(f"Invalid PROPERTY_INDEX_VERSION_COLUMN: {column!r}")
+    return column or None
+
+
+def _strip_version(row: dict) -> Any:
+    return row.pop("_version", None)
+
+
+async def load_full(primary: bool = False) -> None:
+    """Load the whole join and swap in a fresh snapshot.
+
+    `primary` skips the replicas, for reloads caused by a change
+    notification (a lagging replica could hand back the old rows).
+    """
+    global _SNAPSHOT, _ROWS_BY_ID, _VERSION
+    version_column = _version_column()
+    sql = query_builder.build_property_snapshot_query(version_column)
+    for attempt in range(3):
+        generation = _GENERATION
+        rows = await db_service.fetch(sql, primary=primary)
+        async with _BUILD_LOCK:
+            if generation != _GENERATION and attempt < 2:
+                # A change was reported during the load: re-read it from the primary
+                primary = True
+                continue
+            max_version = None
+            for row in rows:
+                version = _strip_version(row)
+                if version is not None and (max_version is None or version > max_version):
+                    max_version = version
+            snapshot = await asyncio.to_thread(_Snapshot, rows)
+            _ROWS_BY_ID = {row["id"]: row for row in rows}
+            _VERSION = max_version
+            _SNAPSHOT = snapshot
+            _STATS["full_loads"] += 1
+            return
+
+
+async def load_incremental() -> int:
+    """Fetch rows whose version increased and patch them in; returns row count."""
+    global _SNAPSHOT, _VERSION
+    version_column = _version_column()
+    if version_column is None or _VERSION is None:
+        await load_full()
+        return len(_ROWS_BY_ID)
+    sql = query_builder.build_property_snapshot_query(version_column, incremental=True)
+    changed = await db_service.fetch(sql, _VERSION)
+    if not changed:
+        return 0
+    async with _BUILD_LOCK:
+        for row in changed:
+            version = _strip_version(row)
+            if version is not None and version > _VERSION:
+                _VERSION = version
+            _ROWS_BY_ID[row["id"]] = row
+        _SNAPSHOT = await asyncio.to_thread(_Snapshot, list(_ROWS_BY_ID.values()))
+    _STATS["incremental_loads"] += 1
+    _STATS["patched_rows"] += len(changed)
+    return len(changed)
+
+
+def mark_changed() -> None:
+    global _GENERATION
+    _GENERATION += 1
+
+
+async def apply_changes(rows: list[dict], deleted_ids: list[Any]) -> None:
+    """Patch re-read rows and deletions reported by the change feed."""
+    global _SNAPSHOT
+    mark_changed()
+    if not rows and not deleted_ids:
+        return
+    async with _BUILD_LOCK:
+        if _SNAPSHOT is None:
+            return
+        for row_id in deleted_ids:
+            _ROWS_BY_ID.pop(row_id, None)
+        for row in rows:
+            _ROWS_BY_ID[row["id"]] = row
+        snapshot = await asyncio.to_thread(_Snapshot, list(_ROWS_BY_ID.values()))
+        if _SNAPSHOT is not None:
+            # Not stopped meanwhile
+            _SNAPSHOT = snapshot
+    _STATS["patched_rows"] += len(rows) + len(deleted_ids)
+
+
+async def refresh() -> None:
+    global _REFRESHES
+    _REFRESHES += 1
+    if _REFRESHES % max(settings.property_index_full_reload_every, 1) == 0:
+        await load_full()
+    else:
+        await load_incremental()
+
+
+def search(filters: dict, limit: int = query_builder.DEFAULT_LIMIT) -> list[dict]:
+    """Answer a search from the snapshot; rows match the SQL path's output.
+
+    Returned dicts are shared with the index; copy them before mutating.
+    """
+    if _SNAPSHOT is None:
+        raise RuntimeError("Property index not loaded")
+    _STATS["searches"] += 1
+    return _SNAPSHOT.top_k(query_builder.active_filters(filters), limit)
+
+
+def facets(filters: dict) -> dict[str, Any]:
+    """Facet counts for `filters` from the snapshot (see search_service.facets)."""
+    if _SNAPSHOT is None:
+        raise RuntimeError("Property index not loaded")
+    return _SNAPSHOT.facets(query_builder.active_filters(filters))
+
+
+async def _refresh_forever() -> None:
+    while True:
+        await asyncio.sleep(settings.property_index_refresh_seconds)
+        try:
+            await refresh()
+        except Exception:
+            # Keep serving the previous snapshot; the next tick retries
+            logger.exception("Property index refresh failed")
+
+
+async def start() -> None:
+    """Load the index and schedule refreshes (no-op when disabled or no NumPy)."""
+    global _REFRESHER
+    if not settings.property_index_enabled or not is_available():
+        return
+    if _REFRESHER is None or _REFRESHER.done():
+        _REFRESHER = asyncio.get_running_loop().create_task(_refresh_forever())
+    await load_full()
+
+
+async def stop() -> None:
+    global _REFRESHER, _SNAPSHOT
+    if _REFRESHER is not None:
+        _REFRESHER.cancel()
+        try:
+            await _REFRESHER
+        except asyncio.CancelledError:
+            pass
+        _REFRESHER = None
+    _SNAPSHOT = None
+
+
+def get_index_stats() -> dict[str, Any]:
+    return {
+        "ready": is_ready(),
+        "rows": _SNAPSHOT.n if _SNAPSHOT is not None else 0,
+        "version": None if _VERSION is None else str(_VERSION),
+        **_STATS,
+    }
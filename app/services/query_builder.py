@@ -1,72 +1,293 @@
-"""Query builder (skeleton): build parameterized SELECT queries from filters.
+"""Query builder: build parameterized SELECT queries from filters.
 
 This module must ensure only SELECT queries are produced and use parameter
 placeholders compatible with asyncpg ($1, $2...).
+
+Every search maps onto one of a small, fixed set of canonical statements
+(see `canonical_statements`). Filters that are not set are passed as NULL
+parameters instead of changing the SQL text, so each pooled connection
+only ever prepares and plans a handful of statements.
+
+Pages beyond the first use keyset pagination on the result order
+(`valor_comercial DESC, id`): the page statement takes the last row seen
+as two more parameters instead of an OFFSET, so every page costs the same.
 """
 
-from typing import Any, Tuple
+from decimal import Decimal
+from typing import Any, NamedTuple, Tuple
+from app.config import get_settings
+from app.utils import metrics
 
 
-def build_property_search_query(filters: dict) -> Tuple[str, Tuple[Any, ...]]:
-    """Return (sql, params) for given filters.
+settings = get_settings()
+
+DEFAULT_LIMIT = settings.properties_limit
+
+# Explicit column list to match PropertyResponse schema
+COLUMNS = [
+    "p.id",
+    "p.numero",
+    "p.piso",
+    "p.tipo",
+    "p.area",
+    "p.dormitorios",
+    "p.banios",
+    "p.balcon",
+    "p.terraza",
+    "p.amoblado",
+    "p.permite_mascotas",
+    "p.valor_comercial",
+    "p.mantenimiento_mensual",
+    "p.estado",
+    "e.nombre as edificio_nombre",
+    "e.direccion as edificio_direccion",
+    "e.distrito as edificio_distrito",
+]
+
+# Keys of the result rows, in COLUMNS order
+RESULT_KEYS: tuple[str, ...] = tuple(
+    column.split(" as ")[-1].split(".")[-1] for column in COLUMNS
+)
+
+
+class FilterSpec(NamedTuple):
+    key: str       # internal filter name (parser output)
+    column: str    # SQL expression
+    pg_type: str   # parameter cast
+    op: str        # comparison operator, column on the left
+    row_key: str   # key of the column in result rows
+
+
+# Parameter order of the canonical statements.
+# Filter mappings - expect internal keys (presupuesto_max, area_min, distrito, estado, dormitorios)
+FILTER_SPECS: tuple[FilterSpec, ...] = (
+    FilterSpec("distrito", "e.distrito", "text", "=", "edificio_distrito"),
+    FilterSpec("area_min", "p.area", "numeric", ">=", "area"),
+    FilterSpec("estado", "p.estado", "text", "=", "estado"),
+    # valor_comercial in DB
+    FilterSpec("presupuesto_max", "p.valor_comercial", "numeric", "<=", "valor_comercial"),
+    FilterSpec("dormitorios", "p.dormitorios", "int", "=", "dormitorios"),
+    # Optional filters
+    FilterSpec("pet_friendly", "p.permite_mascotas", "boolean", "=", "permite_mascotas"),
+    FilterSpec("balcon", "p.balcon", "boolean", "=", "balcon"),
+    FilterSpec("terraza", "p.terraza", "boolean", "=", "terraza"),
+    FilterSpec("amoblado", "p.amoblado", "boolean", "=", "amoblado"),
+    FilterSpec("banios", "p.banios", "int", "=", "banios"),
+)
+
+ESSENTIAL_KEYS = ("distrito", "area_min", "estado", "presupuesto_max", "dormitorios")
+FILTER_KEYS = tuple(spec.key for spec in FILTER_SPECS)
+_NUMERIC_FILTER_KEYS = frozenset(spec.key for spec in FILTER_SPECS if spec.pg_type == "numeric")
+
+# Result order; p.id breaks ties so every engine returns the same rows
+ORDER_BY_SQL = "ORDER BY p.valor_comercial DESC, p.id"
+
+_FROM_SQL = (
+    "FROM property_infrastructure.propiedad p\n"
+    "JOIN property_infrastructure.edificio e ON p.edificio_id = e.id"
+)
+
+
+def _filter_value(filters: dict, key: str) -> Any:
+    value = filters.get(key)
+    # Text filters keep the original truthiness check: "" means "not set"
+    if key in ("distrito", "estado") and not value:
+        return None
+    if isinstance(value, float) and key in _NUMERIC_FILTER_KEYS:
+        # asyncpg sends a float as its exact binary expansion (299999.99 ->
+        # 299999.98999...), which would drop a row priced 299999.99; use the
+        # decimal that was written, as every engine compares against it
+        return Decimal(repr(value))
+    return value
+
+
+def active_filters(filters: dict) -> dict[str, Any]:
+    """The subset of `filters` that turns into a predicate, keyed by filter name."""
+    active = {}
+    for key in FILTER_KEYS:
+        value = _filter_value(filters, key)
+        if value is not None:
+            active[key] = value
+    return active
 
-    TODO: implement safe builder and allowlist of columns.
+
+def _predicate(pos: int, spec: FilterSpec, required: bool = False) -> str:
+    """SQL predicate for `spec` bound to parameter `pos`; optional ones accept NULL."""
+    param = f"${pos}::{spec.pg_type}"
+    if required:
+        return f"{spec.column} {spec.op} {param}"
+    return f"({param} IS NULL OR {spec.column} {spec.op} {param})"
+
+
+def _render_search(essentials_required: bool) -> str:
+    """Render one canonical search statement.
+
+    With `essentials_required` the five essentials are plain predicates
+    (the shape used once the conversation is complete, which lets the planner
+    use indexes on them); every other filter is `($n IS NULL OR col op $n)`.
     """
-    # Explicit column list to match PropertyResponse schema
-    columns = [
-        "p.id",
-        "p.numero",
-        "p.piso",
-        "p.tipo",
-        "p.area",
-        "p.dormitorios",
-        "p.banios",
-        "p.balcon",
-        "p.terraza",
-        "p.amoblado",
-        "p.permite_mascotas",
-        "p.valor_comercial",
-        "p.mantenimiento_mensual",
-        "p.estado",
-        "e.nombre as edificio_nombre",
-        "e.direccion as edificio_direccion",
-        "e.distrito as edificio_distrito",
+    where_clauses = [
+        _predicate(pos, spec, essentials_required and spec.key in ESSENTIAL_KEYS)
+        for pos, spec in enumerate(FILTER_SPECS, start=1)
     ]
+    limit_param = f"${len(FILTER_SPECS) + 1}::int"
+
+    where_sql = "\n    AND ".join(where_clauses)
+    return (
+        f"SELECT\n    {', '.join(COLUMNS)}\n{_FROM_SQL}\nWHERE\n    {where_sql}\n"
+        f"{ORDER_BY_SQL}\nLIMIT {limit_param};"
+    )
+
+
+def _keyset_predicate(value_pos: int, id_pos: int) -> str:
+    """Rows strictly after (valor_comercial, id) in ORDER_BY_SQL order.
+
+    DESC puts NULL valor_comercial first, so after a NULL key the remaining
+    NULL rows (by id) and then every non-NULL row follow. With a NULL id
+    parameter (first page) every row passes.
+    """
+    value = f"${value_pos}::numeric"
+    last_id = f"${id_pos}::int"
+    return (
+        f"({last_id} IS NULL"
+        f"\n        OR ({value} IS NULL AND (p.valor_comercial IS NOT NULL OR p.id > {last_id}))"
+        f"\n        OR p.valor_comercial < {value}"
+        f"\n        OR (p.valor_comercial = {value} AND p.id > {last_id}))"
+    )
+
+
+def _render_page() -> str:
+    """Render the keyset page statement.
+
+    Same filter parameters as the search, then the last (valor_comercial, id)
+    seen and the page size. A NULL page size means no LIMIT (exports).
+    """
+    count = len(FILTER_SPECS)
+    where_clauses = [_predicate(pos, spec) for pos, spec in enumerate(FILTER_SPECS, start=1)]
+    where_clauses.append(_keyset_predicate(count + 1, count + 2))
+    where_sql = "\n    AND ".join(where_clauses)
+    return (
+        f"SELECT\n    {', '.join(COLUMNS)}\n{_FROM_SQL}\nWHERE\n    {where_sql}\n"
+        f"{ORDER_BY_SQL}\nLIMIT ${count + 3}::int;"
+    )
+
+
+# Facet dimensions: (filter key, SQL column, result column)
+FACET_DIMENSIONS = (
+    ("distrito", "e.distrito", "edificio_distrito"),
+    ("dormitorios", "p.dormitorios", "dormitorios"),
+)
+
+
+def _render_facets() -> str:
+    """Render the facet statement (same parameters as the search, no LIMIT).
 
-    where_clauses: list[str] = []
-    params: list[Any] = []
-
-    def add_param(value: Any) -> str:
-        params.append(value)
-        return f"${len(params)}"
-
-    # Filter mappings - expect internal keys (presupuesto_max, area_min, distrito, estado, dormitorios)
-    if filters.get("distrito"):
-        where_clauses.append(f"e.distrito = {add_param(filters['distrito'])}")
-    if filters.get("area_min") is not None:
-        where_clauses.append(f"p.area >= {add_param(filters['area_min'])}")
-    if filters.get("estado"):
-        where_clauses.append(f"p.estado = {add_param(filters['estado'])}")
-    if filters.get("presupuesto_max") is not None:
-        # valor_comercial in DB
-        where_clauses.append(f"p.valor_comercial <= {add_param(filters['presupuesto_max'])}")
-    if filters.get("dormitorios") is not None:
-        where_clauses.append(f"p.dormitorios = {add_param(filters['dormitorios'])}")
-
-    # Optional boolean filters
-    if filters.get("pet_friendly") is not None:
-        where_clauses.append(f"p.permite_mascotas = {add_param(filters['pet_friendly'])}")
-    if filters.get("balcon") is not None:
-        where_clauses.append(f"p.balcon = {add_param(filters['balcon'])}")
-    if filters.get("terraza") is not None:
-        where_clauses.append(f"p.terraza = {add_param(filters['terraza'])}")
-    if filters.get("amoblado") is not None:
-        where_clauses.append(f"p.amoblado = {add_param(filters['amoblado'])}")
-    if filters.get("banios") is not None:
-        where_clauses.append(f"p.banios = {add_param(filters['banios'])}")
-
-    where_sql = "\n    AND ".join(where_clauses) if where_clauses else "1=1"
-
-    sql = f"SELECT\n    {', '.join(columns)}\nFROM property_infrastructure.propiedad p\nJOIN property_infrastructure.edificio e ON p.edificio_id = e.id\nWHERE\n    {where_sql}\nORDER BY p.valor_comercial DESC\nLIMIT 5;"
-
-    return sql, tuple(params)
+    One scan computes, with `count(*) FILTER`, the rows matching all filters
+    (`matches`) and, per filter, the rows matching every filter but that one
+    (`without_<key>`). GROUPING SETS repeats those aggregates per distrito
+    and per dormitorios value; read with `without_distrito` and
+    `without_dormitorios` they give disjunctive facet counts, i.e. how many
+    rows each alternative value would return with the other filters kept.
+    The `facet` column (GROUPING bitmask) tells the sets apart.
+    """
+    predicates = [_predicate(pos, spec) for pos, spec in enumerate(FILTER_SPECS, start=1)]
+    aggregates = [f"count(*) FILTER (WHERE {' AND '.join(predicates)}) AS matches"]
+    for i, spec in enumerate(FILTER_SPECS):
+        others = " AND ".join(p for j, p in enumerate(predicates) if j != i)
+        aggregates.append(f"count(*) FILTER (WHERE {others}) AS without_{spec.key}")
+    dim_columns = [column for _, column, _ in FACET_DIMENSIONS]
+    select_sql = ",\n    ".join(
+        [f"{column} AS {alias}" for _, column, alias in FACET_DIMENSIONS]
+        + [f"GROUPING({', '.join(dim_columns)}) AS facet"]
+        + aggregates
+    )
+    sets_sql = ", ".join(f"({column})" for column in dim_columns) + ", ()"
+    return f"SELECT\n    {select_sql}\n{_FROM_SQL}\nGROUP BY GROUPING SETS ({sets_sql});"
+
+
+_SEARCH_ESSENTIALS_SQL = _render_search(essentials_required=True)
+_SEARCH_GENERIC_SQL = _render_search(essentials_required=False)
+_SEARCH_PAGE_SQL = _render_page()
+_FACETS_SQL = _render_facets()
+
+
+def canonical_statements() -> list[tuple[str, Tuple[Any, ...]]]:
+    """Every statement the builder can emit, with cheap warm-up parameters.
+
+    The warm-up parameters use LIMIT 0 so executing them only parses and
+    plans the statement (used to pre-fill per-connection statement caches).
+    """
+    warm_params = tuple([None] * len(FILTER_SPECS)) + (0,)
+    return [
+        (_SEARCH_ESSENTIALS_SQL, warm_params),
+        (_SEARCH_GENERIC_SQL, warm_params),
+        (_SEARCH_PAGE_SQL, warm_params[:-1] + (None, None, 0)),
+    ]
+
+
+def build_property_snapshot_query(version_column: str | None = None, incremental: bool = False) -> str:
+    """Full join used to load in-memory engines (all rows, result columns).
+
+    With `version_column` the column is also returned as `_version`; with
+    `incremental` the statement takes one parameter and only returns rows
+    whose version is greater than it. The column name must be validated by
+    the caller (see security.is_safe_identifier).
+    """
+    columns = ", ".join(COLUMNS)
+    if version_column is None:
+        return f"SELECT\n    {columns}\n{_FROM_SQL}\nORDER BY p.id;"
+    where_sql = f"\nWHERE p.{version_column} > $1" if incremental else ""
+    return f"SELECT\n    {columns}, p.{version_column} AS _version\n{_FROM_SQL}{where_sql}\nORDER BY p.id;"
+
+
+def build_property_rows_query(by_edificio: bool = False) -> str:
+    """Current result rows of given propiedad ids (or of given edificio ids).
+
+    One parameter: an int array. Used to re-read rows reported changed.
+    """
+    column = "p.edificio_id" if by_edificio else "p.id"
+    return f"SELECT\n    {', '.join(COLUMNS)}\n{_FROM_SQL}\nWHERE {column} = ANY($1::int[])\nORDER BY p.id;"
+
+
+def build_max_version_query(version_column: str) -> str:
+    """Highest version in propiedad (baseline for incremental refreshes).
+
+    The column name must be validated by the caller.
+    """
+    return f"SELECT max(p.{version_column}) AS version FROM property_infrastructure.propiedad p;"
+
+
+@metrics.timed("query_builder.build")
+def build_property_search_query(filters: dict, limit: int = DEFAULT_LIMIT) -> Tuple[str, Tuple[Any, ...]]:
+    """Return (sql, params) for given filters.
+
+    The SQL text only depends on whether all essentials are present; unset
+    filters are sent as NULL parameters.
+    """
+    params = [_filter_value(filters, key) for key in FILTER_KEYS]
+    has_essentials = all(params[FILTER_KEYS.index(k)] is not None for k in ESSENTIAL_KEYS)
+    sql = _SEARCH_ESSENTIALS_SQL if has_essentials else _SEARCH_GENERIC_SQL
+    return sql, tuple(params) + (limit,)
+
+
+def build_property_page_query(
+    filters: dict,
+    after: tuple[Any, int] | None = None,
+    limit: int | None = DEFAULT_LIMIT,
+) -> Tuple[str, Tuple[Any, ...]]:
+    """Return (sql, params) of the page after `after` = (valor_comercial, id).
+
+    `after=None` is the first page; `limit=None` returns every remaining row.
+    """
+    after_value, after_id = after if after is not None else (None, None)
+    params = tuple(_filter_value(filters, key) for key in FILTER_KEYS)
+    return _SEARCH_PAGE_SQL, params + (after_value, after_id, limit)
+
+
+def build_facet_query(filters: dict) -> Tuple[str, Tuple[Any, ...]]:
+    """Return (sql, params) of the facet statement for given filters.
+
+    Only run after a search comes back empty: it aggregates over the whole
+    join, so it is not warmed up on new connections.
+    """
+    return _FACETS_SQL, tuple(_filter_value(filters, key) for key in FILTER_KEYS)
@@ -0,0 +1,59 @@
+"""Compact, shared form of search results.
+
+A `ResultSet` keeps one tuple of column names and one tuple of values per
+row, instead of a dict per row. Rows are immutable, so the same object can
+be stored in the session and returned in the response without copies; it
+is turned into dicts only while being encoded (see utils.json_codec). The
+JSON-ready values are computed on the first encode and kept in `json_rows`,
+so a shared result, and slices of it, skip that work afterwards.
+
+It reads like a list of row dicts (`len`, indexing and iteration build the
+dict on demand) for code that does not care about the representation.
+"""
+
+from typing import Any, Iterable, Iterator
+from app.services import query_builder
+
+
+class ResultSet:
+    __slots__ = ("columns", "rows", "json_rows")
+
+    def __init__(self, columns: tuple[str, ...], rows: list[tuple], json_rows: list[tuple] | None = None) -> None:
+        self.columns = columns
+        self.rows = rows
+        # `rows` with values converted for JSON, filled by utils.json_codec
+        self.json_rows = json_rows
+
+    @classmethod
+    def from_dicts(cls, rows: Iterable[dict], columns: tuple[str, ...] = query_builder.RESULT_KEYS) -> "ResultSet":
+        """Pack row dicts; keys outside `columns` are dropped."""
+        return cls(columns, [tuple(row.get(key) for key in columns) for row in rows])
+
+    @classmethod
+    def from_records(cls, records: list, columns: tuple[str, ...] = query_builder.RESULT_KEYS) -> "ResultSet":
+        """Pack asyncpg Records of a statement selecting `columns` in order."""
+        return cls(columns, [tuple(record) for record in records])
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __bool__(self) -> bool:
+        return bool(self.rows)
+
+    def __getitem__(self, index: int | slice) -> Any:
+        if isinstance(index, slice):
+            json_rows = self.json_rows[index] if self.json_rows is not None else None
+            return ResultSet(self.columns, self.rows[index], json_rows)
+        return dict(zip(self.columns, self.rows[index]))
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        columns = self.columns
+        for row in self.rows:
+            yield dict(zip(columns, row))
+
+    def to_dicts(self) -> list[dict[str, Any]]:
+        return list(self)
+
+    def __reduce__(self) -> tuple:
+        # Pickled (session store) without the JSON cache
+        return ResultSet, (self.columns, self.rows)
@@ -0,0 +1,215 @@
+"""Deterministic rule-based filter extraction (LLM fast path).
+
+Most turns answer the single question the agent just asked ("80", "San
+Isidro", "DISPONIBLE", "3 dormitorios"). This module resolves those locally
+with a district gazetteer, the estado enum and a few regexes for areas,
+amounts and room counts. `extract` returns the candidate filters together
+with a confidence score; the parser only trusts results above
+`settings.fast_path_min_confidence` and falls back to the LLM otherwise.
+"""
+
+import re
+from typing import Any
+from app.utils.nlp_helpers import fold_text, parse_number, apply_multiplier, as_int_if_whole
+
+
+# Districts of Lima Metropolitana and Callao, spelled as stored in edificio.distrito
+DISTRICTS = (
+    "Ancón", "Ate", "Barranco", "Bellavista", "Breña", "Callao", "Carabayllo",
+    "Carmen de la Legua", "Cercado de Lima", "Chaclacayo", "Chorrillos",
+    "Cieneguilla", "Comas", "El Agustino", "Independencia", "Jesús María",
+    "La Molina", "La Perla", "La Punta", "La Victoria", "Lince", "Los Olivos",
+    "Lurigancho", "Lurín", "Magdalena del Mar", "Miraflores", "Pachacámac",
+    "Pucusana", "Pueblo Libre", "Puente Piedra", "Punta Hermosa", "Punta Negra",
+    "Rímac", "San Bartolo", "San Borja", "San Isidro", "San Juan de Lurigancho",
+    "San Juan de Miraflores", "San Luis", "San Martín de Porres", "San Miguel",
+    "Santa Anita", "Santa María del Mar", "Santa Rosa", "Santiago de Surco",
+    "Surquillo", "Ventanilla", "Villa El Salvador", "Villa María del Triunfo",
+)
+
+ESTADOS = {
+    "disponible": "DISPONIBLE",
+    "disponibles": "DISPONIBLE",
+    "libre": "DISPONIBLE",
+    "available": "DISPONIBLE",
+    "ocupada": "OCUPADA",
+    "ocupado": "OCUPADA",
+    "ocupadas": "OCUPADA",
+    "occupied": "OCUPADA",
+    "mantenimiento": "MANTENIMIENTO",
+    "maintenance": "MANTENIMIENTO",
+    "vendida": "VENDIDA",
+    "vendido": "VENDIDA",
+    "vendidas": "VENDIDA",
+    "sold": "VENDIDA",
+}
+
+# Words that carry no filter information and do not lower confidence
+_FILLER = frozenset("""
+    a al algo alrededor aprox aproximadamente bueno busco buscando casa como con
+    cuadrados de del departamento departamentos depa depas depto deptos el en es
+    estado favor gracias gustaria hola la las los m2 maximo max me menos metros
+    minimo min mi necesito ok para perfecto piso por porfavor precio presupuesto
+    propiedad propiedades quiero que se si tenga tener ubicado un una unos unas
+    area y hasta mas o of dormitorios dormitorio
+""".split())
+
+# Negations and exclusions change meaning in ways the rules cannot express
+_NEGATIONS = frozenset({"no", "sin", "excepto", "salvo", "ni", "nada"})
+
+_NUM = r"(\d{1,3}(?:[.,]\d{3})+|\d+(?:[.,]\d+)?)"
+_COUNT = r"(\d+|un|uno|una|dos|tres|cuatro|cinco|seis|siete|ocho|nueve|diez)"
+_MULT = r"(?:\s*(k|mil|millones|millon)\b)?"
+_END = r"(?![a-z0-9])"
+
+_AREA_RE = re.compile(_NUM + r"\s*(?:m2|m²|mt2|mts2|mts|metros cuadrados|metros|m)" + _END)
+_MONEY_PREFIX_RE = re.compile(r"(?:s/\.?|us\$|\$|usd)\s*" + _NUM + _MULT)
+_MONEY_SUFFIX_RE = re.compile(_NUM + _MULT + r"\s*(?:soles|sol|dolares|usd)" + _END)
+_MONEY_MAGNITUDE_RE = re.compile(_NUM + r"\s*(k|mil|millones|millon)" + _END)
+_BUDGET_KEYWORD_RE = re.compile(
+    r"(?:presupuesto|hasta|maximo|max|precio|pagar)\s*(?:de|es|:)?\s*" + _NUM + _MULT + _END
+)
+_BEDROOMS_RE = re.compile(_COUNT + r"\s*(?:dormitorios?|habitaciones?|cuartos?|dorms?|recamaras?)" + _END)
+_AMBIENTES_RE = re.compile(_COUNT + r"\s*ambientes?" + _END)
+_BANIOS_RE = re.compile(_COUNT + r"\s*(?:baños?|banos?)" + _END)
+_BARE_NUMBER_RE = re.compile(r"(?<![a-z0-9])" + _NUM + _MULT + _END)
+_WORD_RE = re.compile(r"[a-zñ0-9]+")
+
+_BOOLEAN_RES = {
+    "balcon": re.compile(r"\bbalcon(?:es)?\b"),
+    "terraza": re.compile(r"\bterrazas?\b"),
+    "amoblado": re.compile(r"\b(?:amoblad|amueblad)[oa]s?\b"),
+    "pet_friendly": re.compile(r"\b(?:mascotas?|pet ?friendly|perros?|gatos?)\b"),
+}
+
+_DISTRICT_INDEX = {fold_text(d): d for d in DISTRICTS}
+_DISTRICT_RE = re.compile(
+    r"\b(" + "|".join(re.escape(d) for d in sorted(_DISTRICT_INDEX, key=len, reverse=True)) + r")\b"
+)
+_ESTADO_RE = re.compile(r"\b(" + "|".join(sorted(ESTADOS, key=len, reverse=True)) + r")\b")
+
+_UNEXPLAINED_PENALTY = 0.25
+
+
+class _Extraction:
+    """Accumulates matches while masking consumed spans of the text."""
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.filters: dict[str, Any] = {}
+        self.conflict = False
+
+    def put(self, key: str, value: Any) -> None:
+        if key in self.filters and self.filters[key] != value:
+            self.conflict = True
+        self.filters[key] = value
+
+    def consume(self, pattern: re.Pattern, handler) -> None:
+        def _sub(m: re.Match) -> str:
+            handler(m)
+            return " " * len(m.group(0))
+        self.text = pattern.sub(_sub, self.text)
+
+
+def _count(token: str) -> int | None:
+    value = parse_number(token)
+    if value is None or not value.is_integer():
+        return None
+    return int(value)
+
+
+def _money(m: re.Match) -> float | None:
+    value = parse_number(m.group(1))
+    if value is None:
+        return None
+    return apply_multiplier(value, m.group(2))
+
+
+def extract(text: str, pending: str | None = None) -> tuple[dict[str, Any], float]:
+    """Extract filters from `text` without calling the LLM.
+
+    `pending` is the essential the agent asked for last; a bare number is
+    attributed to it. Returns `(filters, confidence)` where confidence is in
+    [0, 1] and 0 means "do not trust, ask the LLM".
+    """
+    folded = fold_text(text)
+    if not folded:
+        return {}, 0.0
+
+    words = set(_WORD_RE.findall(folded))
+    if words & _NEGATIONS or "menos de" in folded:
+        return {}, 0.0
+
+    ex = _Extraction(folded)
+
+    def _area(m):
+        value = parse_number(m.group(1))
+        if value is not None:
+            ex.put("area_min", as_int_if_whole(value))
+
+    def _budget(m):
+        value = _money(m)
+        if value is not None:
+            ex.put("presupuesto_max", as_int_if_whole(value))
+
+    def _bedrooms(m):
+        value = _count(m.group(1))
+        if value is not None:
+            ex.put("dormitorios", value)
+
+    def _ambientes(m):
+        value = _count(m.group(1))
+        if value is not None:
+            ex.put("dormitorios", max(value - 1, 0))
+
+    def _banios(m):
+        value = _count(m.group(1))
+        if value is not None:
+            ex.put("banios", value)
+
+    def _district(m):
+        ex.put("distrito", _DISTRICT_INDEX[m.group(1)])
+
+    def _estado(m):
+        ex.put("estado", ESTADOS[m.group(1)])
+
+    # Order matters: unit-anchored patterns consume their numbers first
+    ex.consume(_AREA_RE, _area)
+    ex.consume(_MONEY_PREFIX_RE, _budget)
+    ex.consume(_MONEY_SUFFIX_RE, _budget)
+    ex.consume(_BEDROOMS_RE, _bedrooms)
+    ex.consume(_AMBIENTES_RE, _ambientes)
+    ex.consume(_BANIOS_RE, _banios)
+    ex.consume(_MONEY_MAGNITUDE_RE, _budget)
+    ex.consume(_BUDGET_KEYWORD_RE, _budget)
+    ex.consume(_DISTRICT_RE, _district)
+    ex.consume(_ESTADO_RE, _estado)
+    for key, pattern in _BOOLEAN_RES.items():
+        ex.consume(pattern, lambda m, key=key: ex.put(key, True))
+
+    # A single unit-less number answers the pending question
+    bare = list(_BARE_NUMBER_RE.finditer(ex.text))
+    if len(bare) == 1 and pending in ("area_min", "presupuesto_max", "dormitorios") and pending not in ex.filters:
+        m = bare[0]
+        if pending == "dormitorios":
+            value = _count(m.group(1)) if not m.group(2) else None
+            if value is not None and value <= 20:
+                ex.put("dormitorios", value)
+                ex.text = ex.text[:m.start()] + " " * len(m.group(0)) + ex.text[m.end():]
+        else:
+            value = _money(m)
+            if value is not None:
+                ex.put(pending, as_int_if_whole(value))
+                ex.text = ex.text[:m.start()] + " " * len(m.group(0)) + ex.text[m.end():]
+    elif pending == "dormitorios" and "dormitorios" not in ex.filters:
+        leftover = _WORD_RE.findall(ex.text)
+        if len(leftover) == 1 and _count(leftover[0]) is not None:
+            ex.put("dormitorios", _count(leftover[0]))
+            ex.text = ""
+
+    if not ex.filters or ex.conflict:
+        return {}, 0.0
+
+    unexplained = [w for w in _WORD_RE.findall(ex.text) if w not in _FILLER]
+    confidence = max(0.0, 1.0 - _UNEXPLAINED_PENALTY * len(unexplained))
+    return ex.filters, confidence
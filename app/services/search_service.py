@@ -0,0 +1,177 @@
+"""Property search dispatch.
+
+Runs a filter dict against the cheapest engine that can answer it exactly:
+
+1. the session's candidate set (from the speculative prefetch or from the
+   previous search) when the new filters only refine its filters,
+2. the in-memory property index when it is loaded,
+3. the top-k cube bucket of the (distrito, estado, dormitorios)
+   combination, when it is loaded and holds enough rows,
+4. Postgres through db.fetch_result_shared (db.fetch_shared without
+   orjson), fetching up to `refine_max_rows` rows so the session can
+   answer follow-up refinements locally. Identical concurrent searches
+   share one query and a short-TTL result. On the fast JSON path the rows
+   are packed once into a ResultSet, which the session and the response
+   share as is.
+
+The generated SQL is always returned so it can be saved with the session.
+"""
+
+import time
+from typing import Any
+from app.config import get_settings
+from app.services import db as db_service
+from app.services import filter_algebra
+from app.services import prefetch
+from app.services import property_index
+from app.services import query_builder
+from app.services import session_manager
+from app.services import topk_cube
+from app.utils import json_codec
+from app.utils.cache import TTLCache
+
+
+settings = get_settings()
+
+_STATS: dict[str, int] = {"local": 0, "index": 0, "cube": 0, "sql": 0, "speculative": 0, "speculation_skipped": 0}
+# Session -> filters whose last SQL search overflowed refine_max_rows
+_OVERFLOWED = TTLCache(settings.session_max_count, settings.refine_ttl_seconds)
+
+
+def start_prefetch(session_id: str, filters: dict, missing: str) -> None:
+    """Speculatively fetch candidates while the last essential is asked for."""
+    if property_index.is_ready():
+        # Searches are answered in memory anyway
+        return
+    prefetch.start(session_id, filters, missing)
+
+
+async def _session_candidates(session_id: str, filters: dict) -> filter_algebra.CandidateSet | None:
+    """Candidate set of this session that answers `filters`, if any."""
+    prefetched = await prefetch.take(session_id, filters)
+    if prefetched is not None:
+        if settings.refine_enabled:
+            session_manager.save_candidates(session_id, prefetched)
+        return prefetched
+    if not settings.refine_enabled:
+        return None
+    cached = session_manager.load_candidates(session_id)
+    if cached is not None and cached.is_fresh(settings.refine_ttl_seconds) and cached.answers(filters):
+        return cached
+    return None
+
+
+async def search(
+    filters: dict,
+    limit: int = query_builder.DEFAULT_LIMIT,
+    session_id: str | None = None,
+) -> tuple[str, Any]:
+    """Return (sql, rows) for `filters`, ordered by valor_comercial DESC.
+
+    Rows are a list of dicts, or a ResultSet when they come from Postgres
+    on the fast JSON path.
+    """
+    sql, params = query_builder.build_property_search_query(filters, limit)
+    if session_id is not None:
+        candidates = await _session_candidates(session_id, filters)
+        if candidates is not None:
+            _STATS["local"] += 1
+            return sql, candidates.search(filters, limit)
+
+    if property_index.is_ready():
+        _STATS["index"] += 1
+        return sql, property_index.search(filters, limit)
+
+    rows = topk_cube.search(filters, limit)
+    if rows is not None:
+        _STATS["cube"] += 1
+        return sql, rows
+
+    _STATS["sql"] += 1
+    if session_id is None or not settings.refine_enabled:
+        return sql, await _fetch(sql, params)
+    rows = await _fetch_candidates(session_id, filters, limit)
+    return sql, rows[:limit]
+
+
+async def _fetch(sql: str, params: tuple) -> Any:
+    """Rows of a search statement: a shared ResultSet on the fast JSON path, else dicts."""
+    if json_codec.is_fast():
+        return await db_service.fetch_result_shared(sql, *params)
+    return await db_service.fetch_shared(sql, *params)
+
+
+async def _fetch_candidates(session_id: str, filters: dict, limit: int) -> Any:
+    """Run the search with a wider LIMIT and keep the rows for refinements."""
+    cap = settings.refine_max_rows
+    sql, params = query_builder.build_property_search_query(filters, max(cap + 1, limit))
+    started = time.time()
+    rows = await _fetch(sql, params)
+    candidates = filter_algebra.CandidateSet.bounded(filters, rows, cap, settings.refine_max_bytes, as_of=started)
+    session_manager.save_candidates(session_id, candidates)
+    if candidates is None:
+        _OVERFLOWED.set(session_id, filters)
+    else:
+        _OVERFLOWED.invalidate(session_id)
+    return rows
+
+
+async def warm_candidates(session_id: str, filters: dict) -> None:
+    """Load the session's candidate set for `filters` ahead of the search.
+
+    Runs while a follow-up message is being extracted: when the extracted
+    filters only refine `filters`, the search is then answered locally.
+    Skipped when the last search, on these filters or narrower ones,
+    overflowed: the rows would be thrown away and the search run again.
+    """
+    if not settings.refine_enabled or property_index.is_ready():
+        return
+    cached = session_manager.load_candidates(session_id)
+    if cached is not None and cached.is_fresh(settings.refine_ttl_seconds) and cached.answers(filters):
+        return
+    overflowed = _OVERFLOWED.get(session_id)
+    if overflowed is not None and filter_algebra.is_refinement(filters, overflowed):
+        _STATS["speculation_skipped"] += 1
+        return
+    _STATS["speculative"] += 1
+    await _fetch_candidates(session_id, filters, query_builder.DEFAULT_LIMIT)
+
+
+def _facets_from_rows(rows: list[dict], filters: dict) -> dict[str, Any]:
+    """Fold the GROUPING SETS rows of the facet statement into one dict."""
+    dimensions = query_builder.FACET_DIMENSIONS
+    all_grouped = (1 << len(dimensions)) - 1
+    result: dict[str, Any] = {"matches": 0, "without": {}}
+    for key, _, _ in dimensions:
+        result[key] = {}
+    active = query_builder.active_filters(filters)
+    for row in rows:
+        if row["facet"] == all_grouped:
+            result["matches"] = row["matches"]
+            result["without"] = {key: row[f"without_{key}"] for key in active}
+            continue
+        for i, (key, _, alias) in enumerate(dimensions):
+            # GROUPING() sets the bit of every dimension not in the set
+            if row["facet"] == all_grouped & ~(1 << (len(dimensions) - 1 - i)):
+                count = row[f"without_{key}"]
+                if row[alias] is not None and count:
+                    result[key][row[alias]] = count
+    return result
+
+
+async def facets(filters: dict) -> dict[str, Any]:
+    """Counts that show how to relax `filters` when they match nothing.
+
+    Returns `matches` (rows matching every filter), `without` (rows matching
+    when one active filter is dropped, per filter) and, for `distrito` and
+    `dormitorios`, the rows each value would match with the other filters
+    kept. Computed by one SQL statement, or from the property index.
+    """
+    if property_index.is_ready():
+        return property_index.facets(filters)
+    sql, params = query_builder.build_facet_query(filters)
+    return _facets_from_rows(await db_service.fetch_shared(sql, *params), filters)
+
+
+def get_search_stats() -> dict[str, int]:
+    return dict(_STATS)
@@ -0,0 +1,603 @@
+"""Storage backends for session_manager.
+
+`MemorySessionBackend` keeps live objects in one process (the default).
+`SQLiteSessionBackend` stores sessions in a local SQLite database in WAL
+mode so several uvicorn workers on the same box share them. Rows hold
+compact pickled tuples, and writes are buffered and committed in one
+transaction per event-loop tick (group commit) or on `flush()`. Commits and
+sweeps run on a dedicated writer thread with its own connection, so waiting
+on another worker's write lock never blocks the event loop; reads stay on
+the loop (WAL readers do not wait for writers) with a millisecond busy
+timeout.
+
+Several workers may run turns of the same session, and the per-session
+locks of admission are per process. Every SQLite row therefore carries a
+version: a conversation write only lands if the row still has the version
+the state was read at (compare-and-swap). A write based on a state another
+worker has replaced since is dropped, and `pop_conflict` reports it so the
+turn fails instead of silently overwriting the newer conversation. The
+memory backend applies the same rule to its live objects: writing a state
+the session no longer holds (it was reset or re-created) is a conflict.
+"""
+
+import asyncio
+import os
+import pickle
+import random
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from app.models.state import ConversationState
+
+
+# Rough per-object overheads used by the size estimate (bytes)
+_BASE_BYTES = 512
+_MESSAGE_BYTES = 96
+_FILTER_BYTES = 64
+_ROW_FIELD_BYTES = 48
+
+# SQLite busy timeouts: reads run on the event loop, writes on the writer thread
+_READ_BUSY_TIMEOUT_MS = 20
+_WRITE_BUSY_TIMEOUT = 5.0
+
+
+def estimate_conversation_size(state: ConversationState) -> int:
+    size = _FILTER_BYTES * len(state.collected_filters)
+    for message in state.messages:
+        size += _MESSAGE_BYTES + len(message.get("content") or "")
+    return size
+
+
+def estimate_query_size(sql: str | None, results: list | None) -> int:
+    size = len(sql) if sql else 0
+    if results:
+        # A ResultSet exposes its value tuples as `rows`
+        size += sum(_ROW_FIELD_BYTES * len(row) for row in getattr(results, "rows", results))
+    return size
+
+
+class SessionBackend:
+    """Interface used by session_manager. Unknown ids are ignored on writes."""
+
+    name = "base"
+
+    def create(self, session_id: str, state: ConversationState) -> None:
+        raise NotImplementedError
+
+    def get_conversation(self, session_id: str) -> ConversationState | None:
+        raise NotImplementedError
+
+    def put_conversation(self, session_id: str, state: ConversationState) -> None:
+        raise NotImplementedError
+
+    def get_query(self, session_id: str) -> tuple[str | None, list | None] | None:
+        raise NotImplementedError
+
+    def put_query(self, session_id: str, sql: str | None, results: list | None) -> None:
+        raise NotImplementedError
+
+    def get_candidates(self, session_id: str) -> Any:
+        raise NotImplementedError
+
+    def put_candidates(self, session_id: str, candidates: Any) -> None:
+        """Store the session's candidate set (None clears it)."""
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    def pop_conflict(self, session_id: str) -> bool:
+        """True (once) when a conversation write of the session lost to a newer one."""
+        return False
+
+    def sweep(self) -> int:
+        """Remove expired sessions and enforce caps; returns sessions expired."""
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Make buffered writes visible to other processes."""
+
+    async def commit(self) -> None:
+        """`flush` for callers on the event loop."""
+        self.flush()
+
+    async def run_sweep(self) -> int:
+        """`sweep` for callers on the event loop."""
+        return self.sweep()
+
+    def close(self) -> None:
+        """Release resources held by the backend."""
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> dict[str, int]:
+        raise NotImplementedError
+
+
+class _SessionEntry:
+    __slots__ = ("conversation", "generated_sql", "query_results", "candidates", "last_access", "size")
+
+    def __init__(self, conversation: ConversationState) -> None:
+        self.conversation = conversation
+        self.generated_sql: str | None = None
+        self.query_results: list | None = None
+        self.candidates: Any = None
+        self.last_access = time.monotonic()
+        self.size = 0
+
+
+class MemorySessionBackend(SessionBackend):
+    """Per-process store of live objects with TTL, count/byte caps and LRU eviction."""
+
+    name = "memory"
+
+    def __init__(self, ttl_seconds: float, max_count: int, max_bytes: int) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self._sessions: "OrderedDict[str, _SessionEntry]" = OrderedDict()
+        self._bytes = 0
+        self._conflicts: set[str] = set()
+        self._stats = {"expired": 0, "evicted": 0, "conflicts": 0}
+
+    def _resize(self, entry: _SessionEntry) -> None:
+        new_size = (
+            _BASE_BYTES
+            + estimate_conversation_size(entry.conversation)
+            + estimate_query_size(entry.generated_sql, entry.query_results)
+            + (entry.candidates.size if entry.candidates is not None else 0)
+        )
+        self._bytes += new_size - entry.size
+        entry.size = new_size
+
+    def _drop(self, session_id: str) -> None:
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _lookup(self, session_id: str) -> _SessionEntry | None:
+        """Return a live entry, expiring it lazily and refreshing its LRU slot."""
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if now - entry.last_access > self.ttl_seconds:
+            self._drop(session_id)
+            self._stats["expired"] += 1
+            return None
+        entry.last_access = now
+        self._sessions.move_to_end(session_id)
+        return entry
+
+    def _enforce_limits(self) -> None:
+        """Evict least recently used sessions until both caps are respected."""
+        while self._sessions and (len(self._sessions) > self.max_count or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._sessions)))
+            self._stats["evicted"] += 1
+
+    def create(self, session_id: str, state: ConversationState) -> None:
+        self._drop(session_id)
+        entry = _SessionEntry(state)
+        self._sessions[session_id] = entry
+        self._resize(entry)
+        self._enforce_limits()
+
+    def get_conversation(self, session_id: str) -> ConversationState | None:
+        entry = self._lookup(session_id)
+        return entry.conversation if entry is not None else None
+
+    def put_conversation(self, session_id: str, state: ConversationState) -> None:
+        entry = self._lookup(session_id)
+        if entry is None:
+            return
+        if entry.conversation is not state:
+            # Not the state the session holds (reset or re-created since): stale
+            self._conflicts.add(session_id)
+            self._stats["conflicts"] += 1
+            return
+        self._resize(entry)
+        self._enforce_limits()
+
+    def get_query(self, session_id: str) -> tuple[str | None, list | None] | None:
+        entry = self._lookup(session_id)
+        if entry is None:
+            return None
+        return entry.generated_sql, entry.query_results
+
+    def put_query(self, session_id: str, sql: str | None, results: list | None) -> None:
+        entry = self._lookup(session_id)
+        if entry is not None:
+            entry.generated_sql = sql
+            entry.query_results = results
+            self._resize(entry)
+            self._enforce_limits()
+
+    def get_candidates(self, session_id: str) -> Any:
+        entry = self._lookup(session_id)
+        return entry.candidates if entry is not None else None
+
+    def put_candidates(self, session_id: str, candidates: Any) -> None:
+        entry = self._lookup(session_id)
+        if entry is not None:
+            entry.candidates = candidates
+            self._resize(entry)
+            self._enforce_limits()
+
+    def delete(self, session_id: str) -> None:
+        self._drop(session_id)
+
+    def pop_conflict(self, session_id: str) -> bool:
+        if session_id in self._conflicts:
+            self._conflicts.discard(session_id)
+            return True
+        return False
+
+    def sweep(self) -> int:
+        now = time.monotonic()
+        expired = [sid for sid, e in self._sessions.items() if now - e.last_access > self.ttl_seconds]
+        for sid in expired:
+            self._drop(sid)
+        self._stats["expired"] += len(expired)
+        return len(expired)
+
+    def count(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> dict[str, int]:
+        return {"active": len(self._sessions), "bytes": self._bytes, **self._stats}
+
+
+# Marks a session field with no uncommitted value
+_UNSET = object()
+
+
+def _new_version() -> int:
+    # Random rather than counted, so a re-created session never reuses one
+    return random.getrandbits(62)
+
+
+def _dump(value: Any) -> bytes:
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _dump_conversation(state: ConversationState) -> bytes:
+    return _dump((state.messages, state.collected_filters, state.required_remaining, state.optional_allowed))
+
+
+def _load_conversation(session_id: str, blob: bytes) -> ConversationState:
+    messages, filters, remaining, optional_allowed = pickle.loads(blob)
+    return ConversationState.model_construct(
+        session_id=session_id,
+        messages=messages,
+        collected_filters=filters,
+        required_remaining=remaining,
+        optional_allowed=optional_allowed,
+    )
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Sessions shared by all worker processes through one SQLite file (WAL)."""
+
+    name = "sqlite"
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            conversation BLOB NOT NULL,
+            query BLOB,
+            candidates BLOB,
+            last_access REAL NOT NULL,
+            size INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access);
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_count: int, max_bytes: int) -> None:
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self._conn: sqlite3.Connection | None = None
+        self._write_conn: sqlite3.Connection | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._pid: int | None = None
+        # session_id -> {"create": bool, "delete": bool, "conversation": state,
+        #                "query": (sql, rows), "candidates": CandidateSet | None}
+        self._pending: dict[str, dict[str, Any]] = {}
+        # Batches handed to the writer thread and not committed yet, oldest first
+        self._inflight: list[dict[str, dict[str, Any]]] = []
+        self._flush_scheduled = False
+        # Sessions whose last conversation write lost the compare-and-swap
+        self._conflicts: set[str] = set()
+        self._stats = {"expired": 0, "evicted": 0, "flushes": 0, "rows_written": 0, "conflicts": 0}
+
+    def _check_fork(self) -> None:
+        # Connections and threads must not cross a fork, so reopen in each worker process
+        if self._pid != os.getpid():
+            self._conn = self._write_conn = self._executor = None
+            self._inflight = []
+            self._pid = os.getpid()
+
+    def _db(self) -> sqlite3.Connection:
+        """Read connection, used on the event loop."""
+        self._check_fork()
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=_WRITE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self._SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+            if "candidates" not in columns:
+                # Files created before candidate sets were stored
+                conn.execute("ALTER TABLE sessions ADD COLUMN candidates BLOB")
+            if "version" not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            conn.execute(f"PRAGMA busy_timeout = {_READ_BUSY_TIMEOUT_MS}")
+            self._conn = conn
+        return self._conn
+
+    def _write_db(self) -> sqlite3.Connection:
+        """Write connection, only used on the writer thread."""
+        if self._write_conn is None:
+            self._db()
+            conn = sqlite3.connect(self.path, timeout=_WRITE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._write_conn = conn
+        return self._write_conn
+
+    def _writer(self) -> ThreadPoolExecutor:
+        self._check_fork()
+        if self._executor is None:
+            self._db()
+            # One thread: commits run one at a time, in submission order
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-sqlite")
+        return self._executor
+
+    def _schedule_flush(self) -> None:
+        if self._flush_scheduled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self._flush_scheduled = True
+        loop.call_soon(self._start_commit)
+
+    def _buffer(self, session_id: str, **fields: Any) -> None:
+        self._pending.setdefault(session_id, {}).update(fields)
+        self._schedule_flush()
+
+    def _buffered(self, session_id: str, field: str) -> Any:
+        """Latest uncommitted value of a session field, or _UNSET."""
+        for batch in (self._pending, *reversed(self._inflight)):
+            fields = batch.get(session_id)
+            if not fields:
+                continue
+            if field in fields:
+                return fields[field]
+            if fields.get("create") or fields.get("delete"):
+                # Replaced or removed after that field was last committed
+                return None
+        return _UNSET
+
+    def _row(self, session_id: str) -> tuple[bytes, bytes | None, int] | None:
+        row = self._db().execute(
+            "SELECT conversation, query, last_access, version FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[2] > self.ttl_seconds:
+            self.delete(session_id)
+            self._stats["expired"] += 1
+            return None
+        return row[0], row[1], row[3]
+
+    def create(self, session_id: str, state: ConversationState) -> None:
+        state._version = _new_version()
+        self._pending[session_id] = {
+            "create": True,
+            "conversation": state,
+            "query": (None, None),
+            "version": state._version,
+        }
+        self._schedule_flush()
+
+    def get_conversation(self, session_id: str) -> ConversationState | None:
+        conversation = self._buffered(session_id, "conversation")
+        if conversation is not _UNSET:
+            return conversation
+        row = self._row(session_id)
+        if row is None:
+            return None
+        state = _load_conversation(session_id, row[0])
+        state._version = row[2]
+        return state
+
+    def put_conversation(self, session_id: str, state: ConversationState) -> None:
+        fields = self._pending.get(session_id, {})
+        if "version" in fields and state._version != fields["version"]:
+            # Not derived from the buffered write of this session: it is stale
+            self._conflicts.add(session_id)
+            self._stats["conflicts"] += 1
+            return
+        if not fields.get("create"):
+            # The version the row must still have when this batch commits
+            fields.setdefault("expected", state._version)
+        state._version = _new_version()
+        fields.update(conversation=state, version=state._version)
+        self._pending[session_id] = fields
+        self._schedule_flush()
+
+    def get_query(self, session_id: str) -> tuple[str | None, list | None] | None:
+        query = self._buffered(session_id, "query")
+        if query is not _UNSET:
+            return query
+        row = self._row(session_id)
+        if row is None:
+            return None
+        return pickle.loads(row[1]) if row[1] is not None else (None, None)
+
+    def put_query(self, session_id: str, sql: str | None, results: list | None) -> None:
+        self._buffer(session_id, query=(sql, results))
+
+    def get_candidates(self, session_id: str) -> Any:
+        candidates = self._buffered(session_id, "candidates")
+        if candidates is not _UNSET:
+            return candidates
+        row = self._db().execute("SELECT candidates FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return pickle.loads(row[0])
+
+    def put_candidates(self, session_id: str, candidates: Any) -> None:
+        self._buffer(session_id, candidates=candidates)
+
+    def delete(self, session_id: str) -> None:
+        self._pending[session_id] = {"delete": True}
+        self._schedule_flush()
+
+    def pop_conflict(self, session_id: str) -> bool:
+        if session_id in self._conflicts:
+            self._conflicts.discard(session_id)
+            return True
+        return False
+
+    def _take_batch(self) -> dict[str, dict[str, Any]]:
+        self._flush_scheduled = False
+        batch, self._pending = self._pending, {}
+        if batch:
+            self._inflight.append(batch)
+        return batch
+
+    def _settle(self, batch: dict[str, dict[str, Any]]) -> None:
+        if batch:
+            self._inflight = [b for b in self._inflight if b is not batch]
+
+    def _start_commit(self) -> asyncio.Future:
+        """Hand the buffered writes to the writer thread (event loop only)."""
+        batch = self._take_batch()
+        future = asyncio.get_running_loop().run_in_executor(self._writer(), self._commit, batch)
+        future.add_done_callback(lambda _: self._settle(batch))
+        return future
+
+    def flush(self) -> None:
+        """Commit every buffered write in a single transaction, blocking until done."""
+        batch = self._take_batch()
+        try:
+            self._writer().submit(self._commit, batch).result()
+        finally:
+            self._settle(batch)
+
+    async def commit(self) -> None:
+        # Waits for earlier scheduled commits too: the writer runs them in order
+        await self._start_commit()
+
+    def _commit(self, batch: dict[str, dict[str, Any]]) -> None:
+        if not batch:
+            return
+        now = time.time()
+        deletes, inserts, updates = [], [], []
+        for sid, fields in batch.items():
+            if fields.get("delete"):
+                deletes.append((sid,))
+                continue
+            conversation = fields.get("conversation")
+            conv_blob = _dump_conversation(conversation) if conversation is not None else None
+            query_blob = _dump(fields["query"]) if "query" in fields else None
+            # A stored pickled None (not SQL NULL) clears the candidate set
+            cand_blob = _dump(fields["candidates"]) if "candidates" in fields else None
+            if fields.get("create"):
+                size = _BASE_BYTES + sum(len(b) for b in (conv_blob, query_blob, cand_blob) if b)
+                inserts.append((sid, conv_blob, query_blob, cand_blob, now, size, fields["version"]))
+            else:
+                updates.append((conv_blob, query_blob, cand_blob, now, sid, fields.get("version"), fields.get("expected")))
+
+        db = self._write_db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if deletes:
+                db.executemany("DELETE FROM sessions WHERE id = ?", deletes)
+            if inserts:
+                db.executemany(
+                    "INSERT OR REPLACE INTO sessions (id, conversation, query, candidates, last_access, size, version) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    inserts,
+                )
+            for update in updates:
+                # Only touch columns that were written; keep the others as they are
+                written = db.execute(
+                    "UPDATE sessions SET conversation = COALESCE(?1, conversation), "
+                    "query = COALESCE(?2, query), candidates = COALESCE(?3, candidates), "
+                    "last_access = ?4, version = COALESCE(?6, version) "
+                    "WHERE id = ?5 AND (?7 IS NULL OR version = ?7)",
+                    update,
+                ).rowcount
+                if not written and update[6] is not None:
+                    exists = db.execute("SELECT 1 FROM sessions WHERE id = ?", (update[4],)).fetchone()
+                    if exists:
+                        # Another worker saved the session since this state was read
+                        self._conflicts.add(update[4])
+                        self._stats["conflicts"] += 1
+                db.execute(
+                    "UPDATE sessions SET size = length(conversation) + COALESCE(length(query), 0) "
+                    "+ COALESCE(length(candidates), 0) WHERE last_access = ?",
+                    (now,),
+                )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        self._stats["flushes"] += 1
+        self._stats["rows_written"] += len(deletes) + len(inserts) + len(updates)
+
+    def _sweep(self) -> int:
+        db = self._write_db()
+        expired = db.execute(
+            "DELETE FROM sessions WHERE last_access < ?", (time.time() - self.ttl_seconds,)
+        ).rowcount
+        self._stats["expired"] += expired
+
+        count, total = db.execute("SELECT count(*), COALESCE(sum(size), 0) FROM sessions").fetchone()
+        if count > self.max_count or total > self.max_bytes:
+            # Evict the least recently written sessions until both caps hold
+            rows = db.execute("SELECT id, size FROM sessions ORDER BY last_access").fetchall()
+            victims = []
+            for sid, size in rows:
+                if count <= self.max_count and total <= self.max_bytes:
+                    break
+                victims.append((sid,))
+                count -= 1
+                total -= size
+            db.executemany("DELETE FROM sessions WHERE id = ?", victims)
+            self._stats["evicted"] += len(victims)
+        return expired
+
+    def sweep(self) -> int:
+        self.flush()
+        return self._writer().submit(self._sweep).result()
+
+    async def run_sweep(self) -> int:
+        await self.commit()
+        return await asyncio.get_running_loop().run_in_executor(self._writer(), self._sweep)
+
+    def close(self) -> None:
+        if self._pending or self._executor is not None:
+            self.flush()
+            self._executor.shutdown()
+        for conn in (self._conn, self._write_conn):
+            if conn is not None:
+                conn.close()
+        self._conn = self._write_conn = self._executor = None
+
+    def count(self) -> int:
+        # Committed sessions only: /metrics must not wait on the write lock
+        return self._db().execute("SELECT count(*) FROM sessions").fetchone()[0]
+
+    def stats(self) -> dict[str, int]:
+        count, total = self._db().execute("SELECT count(*), COALESCE(sum(size), 0) FROM sessions").fetchone()
+        pending = len(self._pending) + sum(len(batch) for batch in self._inflight)
+        return {"active": count, "bytes": total, "pending": pending, **self._stats}
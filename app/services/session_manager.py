@@ -1,89 +1,184 @@
-"""In-memory session manager using ConversationState for storage.
+"""Session manager using ConversationState for storage.
 
 Lightweight wrapper to create, load and persist conversation state and search
-results. For MVP it's in-memory; can be swapped for Redis later.
+results. The actual storage is a pluggable backend (see session_backends):
+`memory` keeps live objects in this process, `sqlite` shares sessions
+between uvicorn workers through a local WAL-mode database.
+
+Idle sessions expire after `session_ttl_seconds` (checked lazily on access
+and by a periodic sweep), the store is bounded by `session_max_count` and
+`session_max_bytes` with LRU eviction, and each conversation keeps at most
+`session_max_messages` messages.
 """
 
+import asyncio
 from uuid import uuid4
 from typing import Any
+from app.config import get_settings
 from app.models.state import ConversationState
+from app.utils import metrics
+from app.services.session_backends import (
+    SessionBackend,
+    MemorySessionBackend,
+    SQLiteSessionBackend,
+)
 
 
-_SESSIONS: dict[str, dict[str, Any]] = {}
+settings = get_settings()
 
+_STATS: dict[str, int] = {
+    "created": 0,
+    "compacted_messages": 0,
+    "conflicts": 0,
+}
+_SWEEPER: asyncio.Task | None = None
 
-def create_session() -> str:
-    session_id = str(uuid4())
-    _SESSIONS[session_id] = {
-        "conversation": ConversationState(session_id=session_id).model_dump(),
-        "generated_sql": None,
-        "query_results": None,
-    }
+
+class SessionConflict(Exception):
+    """Another worker saved the session while this turn was running."""
+
+
+def _make_backend() -> SessionBackend:
+    if settings.session_backend == "sqlite":
+        return SQLiteSessionBackend(
+            settings.session_sqlite_path,
+            ttl_seconds=settings.session_ttl_seconds,
+            max_count=settings.session_max_count,
+            max_bytes=settings.session_max_bytes,
+        )
+    if settings.session_backend != "memory":
+        raise RuntimeError(f"Unknown SESSION_BACKEND: {settings.session_backend}")
+    return MemorySessionBackend(
+        ttl_seconds=settings.session_ttl_seconds,
+        max_count=settings.session_max_count,
+        max_bytes=settings.session_max_bytes,
+    )
+
+
+_BACKEND: SessionBackend = _make_backend()
+
+
+def set_backend(backend: SessionBackend) -> None:
+    """Swap the storage backend (tests, benchmarks)."""
+    global _BACKEND
+    _BACKEND.close()
+    _BACKEND = backend
+
+
+def _compact_history(state: ConversationState) -> None:
+    excess = len(state.messages) - settings.session_max_messages
+    if excess > 0:
+        del state.messages[:excess]
+        _STATS["compacted_messages"] += excess
+
+
+def create_session(session_id: str | None = None) -> str:
+    session_id = session_id or str(uuid4())
+    _BACKEND.create(session_id, ConversationState(session_id=session_id))
+    _STATS["created"] += 1
     return session_id
 
 
 def get_session(session_id: str) -> dict[str, Any] | None:
-    return _SESSIONS.get(session_id)
+    state = _BACKEND.get_conversation(session_id)
+    if state is None:
+        return None
+    sql, results = _BACKEND.get_query(session_id) or (None, None)
+    return {"conversation": state, "generated_sql": sql, "query_results": results}
 
 
+@metrics.timed("session.save")
 def save_conversation_state(session_id: str, state: ConversationState) -> None:
-    if session_id in _SESSIONS:
-        _SESSIONS[session_id]["conversation"] = state.model_dump()
+    _compact_history(state)
+    _BACKEND.put_conversation(session_id, state)
 
 
+@metrics.timed("session.load")
 def load_conversation_state(session_id: str) -> ConversationState | None:
-    raw = _SESSIONS.get(session_id)
-    if not raw:
-        return None
-    return ConversationState(**raw.get("conversation", {}))
+    return _BACKEND.get_conversation(session_id)
 
 
+@metrics.timed("session.save")
 def save_query_result(session_id: str, sql: str, results: list[dict] | None) -> None:
-    if session_id in _SESSIONS:
-        _SESSIONS[session_id]["generated_sql"] = sql
-        _SESSIONS[session_id]["query_results"] = results
+    _BACKEND.put_query(session_id, sql, results)
 
 
+@metrics.timed("session.load")
 def load_query_result(session_id: str) -> tuple[str | None, list[dict] | None]:
-    raw = _SESSIONS.get(session_id)
-    if not raw:
-        return None, None
-    return raw.get("generated_sql"), raw.get("query_results")
+    return _BACKEND.get_query(session_id) or (None, None)
+
+
+@metrics.timed("session.save")
+def save_candidates(session_id: str, candidates: Any) -> None:
+    """Keep the candidate set of the last search (None clears it)."""
+    _BACKEND.put_candidates(session_id, candidates)
+
+
+@metrics.timed("session.load")
+def load_candidates(session_id: str) -> Any:
+    return _BACKEND.get_candidates(session_id)
 
 
 def reset_session(session_id: str) -> None:
-    if session_id in _SESSIONS:
-        _SESSIONS[session_id] = {
-            "conversation": ConversationState(session_id=session_id).model_dump(),
-            "generated_sql": None,
-            "query_results": None,
-        }
+    if _BACKEND.get_conversation(session_id) is not None:
+        create_session(session_id)
 
 
-def get_active_sessions_count() -> int:
-    return len(_SESSIONS)
-"""Simple in-memory session manager (skeleton).
+def flush() -> None:
+    """Commit buffered session writes so other workers can see them."""
+    _BACKEND.flush()
 
-This will keep per-session conversation state and collected filters. It's an
-in-memory dict for MVP; can be swapped for Redis later.
-"""
 
-from typing import Any
-from uuid import uuid4
+async def commit(session_id: str | None = None) -> None:
+    """`flush` for request handlers: the event loop is not blocked meanwhile.
 
-_SESSIONS: dict[str, dict[str, Any]] = {}
+    Raises SessionConflict when the turn's conversation write of
+    `session_id` was dropped because another worker saved a newer one.
+    """
+    await _BACKEND.commit()
+    if session_id is not None and _BACKEND.pop_conflict(session_id):
+        _STATS["conflicts"] += 1
+        raise SessionConflict(session_id)
 
 
-def create_session() -> str:
-    session_id = str(uuid4())
-    _SESSIONS[session_id] = {"messages": [], "filters": {}, "state": {}}
-    return session_id
+def sweep_expired_sessions() -> int:
+    """Drop every expired session; returns how many were removed."""
+    return _BACKEND.sweep()
 
 
-def get_session(session_id: str) -> dict[str, Any] | None:
-    return _SESSIONS.get(session_id)
+async def _sweep_forever() -> None:
+    while True:
+        await asyncio.sleep(settings.session_sweep_interval_seconds)
+        await _BACKEND.run_sweep()
 
 
-def update_session(session_id: str, data: dict) -> None:
-    if session_id in _SESSIONS:
-        _SESSIONS[session_id].update(data)
+def start_session_sweeper() -> None:
+    global _SWEEPER
+    if _SWEEPER is None or _SWEEPER.done():
+        _SWEEPER = asyncio.get_running_loop().create_task(_sweep_forever())
+
+
+async def stop_session_sweeper() -> None:
+    global _SWEEPER
+    if _SWEEPER is not None:
+        _SWEEPER.cancel()
+        try:
+            await _SWEEPER
+        except asyncio.CancelledError:
+            pass
+        _SWEEPER = None
+    await _BACKEND.commit()
+
+
+def get_active_sessions_count() -> int:
+    return _BACKEND.count()
+
+
+def get_session_store_stats() -> dict[str, Any]:
+    return {
+        "backend": _BACKEND.name,
+        "max_count": settings.session_max_count,
+        "max_bytes": settings.session_max_bytes,
+        **_STATS,
+        **_BACKEND.stats(),
+    }
@@ -0,0 +1,369 @@
+"""Top-k cube: result-ordered candidate lists per essential-filter combination.
+
+Traffic concentrates on a few (distrito, estado, dormitorios) combinations,
+and searches within one differ only in area_min, presupuesto_max and the
+optional filters. For each combination seen, a bucket keeps the rows
+matching those three filters in result order (valor_comercial DESC, NULLs
+first, then id). At most `topk_cube_bucket_max_rows` rows are kept, loaded
+with the keyset page statement.
+
+A bucket is always an exact prefix of its combination's result order:
+
+- a complete bucket (every matching row) answers any search of its key;
+- a truncated one answers when scanning it yields `limit` matches, since
+  no row past its tail can rank before them;
+
+otherwise the search falls through to Postgres.
+
+Buckets are built in the background on the first miss of a combination.
+They are kept in LRU order within `topk_cube_max_bytes`; the coldest are
+evicted first. With `property_index_version_column` set, a periodic
+refresh fetches the rows whose version increased and patches them into
+the buckets in place (moving rows whose combination changed). Buckets
+older than `topk_cube_ttl_seconds` are rebuilt in any case, which also
+picks up deletions. The change feed (change_feed) patches buckets as soon
+as rows change; a build whose query overlapped a reported change is
+dropped, since its rows may predate it.
+
+The cube only answers while the change listener is connected: without it,
+buckets could lag writes by up to `topk_cube_ttl_seconds`, so searches go
+to Postgres (`unfed`). It is off by default; enable it once the change
+triggers are installed.
+"""
+
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Any
+from app.config import get_settings
+from app.services import db as db_service
+from app.services import filter_algebra
+from app.services import query_builder
+from app.utils import metrics
+from app.utils.security import is_safe_identifier
+
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+KEY_FILTERS = ("distrito", "estado", "dormitorios")
+# Result-row columns of the key filters
+_KEY_COLUMNS = ("edificio_distrito", "estado", "dormitorios")
+_MAX_BUILDS = 4
+
+BucketKey = tuple[Any, Any, Any]
+
+
+def _order_key(row: dict) -> tuple:
+    """Sort key of the result order: valor_comercial DESC NULLS FIRST, id."""
+    value = row.get("valor_comercial")
+    return (0, 0, row["id"]) if value is None else (1, -value, row["id"])
+
+
+class _Bucket:
+    __slots__ = ("key", "rows", "order", "complete", "size", "built_at", "hits")
+
+    def __init__(self, key: BucketKey, rows: list[dict], complete: bool) -> None:
+        self.key = key
+        self.rows = rows
+        # Sort keys parallel to rows, for incremental inserts
+        self.order = [_order_key(row) for row in rows]
+        self.complete = complete
+        self.size = filter_algebra.estimate_rows_size(rows)
+        self.built_at = time.time()
+        self.hits = 0
+
+    def remove(self, row_id: Any) -> bool:
+        for i, row in enumerate(self.rows):
+            if row["id"] == row_id:
+                del self.rows[i]
+                del self.order[i]
+                self.size -= filter_algebra.estimate_row_size(row)
+                return True
+        return False
+
+    def insert(self, row: dict) -> bool:
+        order = _order_key(row)
+        pos = bisect_left(self.order, order)
+        if pos == len(self.rows) and not self.complete:
+            # Past the tail of a truncated bucket: not part of the known prefix
+            return False
+        self.rows.insert(pos, row)
+        self.order.insert(pos, order)
+        self.size += filter_algebra.estimate_row_size(row)
+        if len(self.rows) > settings.topk_cube_bucket_max_rows:
+            self.size -= filter_algebra.estimate_row_size(self.rows.pop())
+            self.order.pop()
+            self.complete = False
+        return True
+
+
+_BUCKETS: "OrderedDict[BucketKey, _Bucket]" = OrderedDict()
+_BUCKET_OF: dict[Any, BucketKey] = {}
+_BUILDING: dict[BucketKey, asyncio.Task] = {}
+_BYTES = 0
+# Bumped on every reported change; builds that straddle one are dropped
+_GENERATION = 0
+# Combinations whose rows a reported change invalidated: rebuilt from the
+# primary, since a replica may not have the change yet
+_CHANGED_KEYS: set[BucketKey] = set()
+_VERSION: Any = None
+_REFRESHER: asyncio.Task | None = None
+_STATS: dict[str, int] = {
+    "hits": 0,
+    "misses": 0,
+    "truncated": 0,
+    "unfed": 0,
+    "builds": 0,
+    "evictions": 0,
+    "patched_rows": 0,
+}
+
+
+def _key(filters: dict) -> BucketKey | None:
+    active = query_builder.active_filters(filters)
+    if not all(name in active for name in KEY_FILTERS):
+        return None
+    return tuple(active[name] for name in KEY_FILTERS)
+
+
+def _row_key(row: dict) -> BucketKey:
+    return tuple(row.get(column) for column in _KEY_COLUMNS)
+
+
+def _resize(delta: int) -> None:
+    global _BYTES
+    _BYTES += delta
+
+
+def _drop(key: BucketKey) -> None:
+    bucket = _BUCKETS.pop(key, None)
+    if bucket is None:
+        return
+    _resize(-bucket.size)
+    for row in bucket.rows:
+        if _BUCKET_OF.get(row["id"]) == key:
+            del _BUCKET_OF[row["id"]]
+
+
+def _evict() -> None:
+    while _BYTES > settings.topk_cube_max_bytes and _BUCKETS:
+        coldest = next(iter(_BUCKETS))
+        _drop(coldest)
+        _STATS["evictions"] += 1
+
+
+def search(filters: dict, limit: int = query_builder.DEFAULT_LIMIT) -> list[dict] | None:
+    """Rows for `filters` from its bucket, or None to fall through to SQL.
+
+    A miss schedules the bucket's build. Returned dicts are shared with the
+    cube; copy them before mutating.
+    """
+    if not settings.topk_cube_enabled:
+        return None
+    key = _key(filters)
+    if key is None:
+        return None
+    if not db_service.is_change_listener_connected():
+        # Writes would go unnoticed until the TTL; the resync on reconnect clears the cube
+        _STATS["unfed"] += 1
+        return None
+    bucket = _BUCKETS.get(key)
+    if bucket is None:
+        _STATS["misses"] += 1
+        _schedule_build(key)
+        return None
+    rows = filter_algebra.apply_filters(bucket.rows, filters, limit)
+    if len(rows) < limit and not bucket.complete:
+        _STATS["truncated"] += 1
+        return None
+    _BUCKETS.move_to_end(key)
+    bucket.hits += 1
+    _STATS["hits"] += 1
+    return rows
+
+
+async def build(key: BucketKey) -> None:
+    """Load (or reload) the bucket of one combination."""
+    cap = settings.topk_cube_bucket_max_rows
+    filters = dict(zip(KEY_FILTERS, key))
+    sql, params = query_builder.build_property_page_query(filters, None, cap + 1)
+    generation = _GENERATION
+    rows = await db_service.fetch(sql, *params, primary=key in _CHANGED_KEYS)
+    if generation != _GENERATION:
+        # Rows changed during the query; the next miss rebuilds
+        _CHANGED_KEYS.add(key)
+        return
+    _CHANGED_KEYS.discard(key)
+    complete = len(rows) <= cap
+    bucket = _Bucket(key, rows[:cap], complete)
+    _drop(key)
+    if bucket.size > settings.topk_cube_max_bytes:
+        return
+    _BUCKETS[key] = bucket
+    _resize(bucket.size)
+    for row in bucket.rows:
+        _BUCKET_OF[row["id"]] = key
+    _STATS["builds"] += 1
+    metrics.observe("topk_cube_bucket_rows", len(bucket.rows), metrics.ROW_BUCKETS)
+    _evict()
+
+
+def _schedule_build(key: BucketKey) -> None:
+    if key in _BUILDING or len(_BUILDING) >= _MAX_BUILDS:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(build(key))
+    _BUILDING[key] = task
+
+    def done(finished: asyncio.Task) -> None:
+        _BUILDING.pop(key, None)
+        if not finished.cancelled() and finished.exception() is not None:
+            logger.warning("Top-k cube build failed for %s: %s", key, finished.exception())
+
+    task.add_done_callback(done)
+
+
+def _version_column() -> str | None:
+    column = settings.property_index_version_column
+    if column and not is_safe_identifier(column):
+        raise RuntimeError(f"Invalid PROPERTY_INDEX_VERSION_COLUMN: {column!r}")
+    return column or None
+
+
+def patch(rows: list[dict]) -> int:
+    """Apply changed rows to the loaded buckets; returns rows placed in one."""
+    placed = 0
+    for row in rows:
+        old_key = _BUCKET_OF.pop(row["id"], None)
+        if old_key is not None and old_key in _BUCKETS:
+            bucket = _BUCKETS[old_key]
+            before = bucket.size
+            if bucket.remove(row["id"]):
+                _resize(bucket.size - before)
+        new_key = _row_key(row)
+        bucket = _BUCKETS.get(new_key)
+        before = bucket.size if bucket is not None else 0
+        if bucket is not None and bucket.insert(row):
+            _resize(bucket.size - before)
+            _BUCKET_OF[row["id"]] = new_key
+            placed += 1
+    _STATS["patched_rows"] += placed
+    _evict()
+    return placed
+
+
+def mark_changed() -> None:
+    """A row change was reported: drop builds whose query is in flight."""
+    global _GENERATION
+    _GENERATION += 1
+
+
+def remove(row_ids: list[Any]) -> int:
+    """Drop deleted rows from their buckets; returns how many were held."""
+    removed = 0
+    for row_id in row_ids:
+        key = _BUCKET_OF.pop(row_id, None)
+        bucket = _BUCKETS.get(key) if key is not None else None
+        if bucket is None:
+            continue
+        before = bucket.size
+        if bucket.remove(row_id):
+            _resize(bucket.size - before)
+            removed += 1
+    return removed
+
+
+def apply_changes(rows: list[dict], deleted_ids: list[Any]) -> None:
+    """Patch re-read rows and deletions reported by the change feed."""
+    mark_changed()
+    remove(deleted_ids)
+    patch(rows)
+
+
+async def _load_changes() -> None:
+    """Fetch rows whose version increased since the last refresh and patch them."""
+    global _VERSION
+    column = _version_column()
+    if column is None:
+        return
+    if _VERSION is None:
+        rows = await db_service.fetch(query_builder.build_max_version_query(column))
+        _VERSION = rows[0]["version"] if rows else None
+        return
+    sql = query_builder.build_property_snapshot_query(column, incremental=True)
+    changed = await db_service.fetch(sql, _VERSION)
+    for row in changed:
+        version = row.pop("_version", None)
+        if version is not None and version > _VERSION:
+            _VERSION = version
+    patch(changed)
+
+
+async def refresh() -> None:
+    await _load_changes()
+    cutoff = time.time() - settings.topk_cube_ttl_seconds
+    for key in [key for key, bucket in _BUCKETS.items() if bucket.built_at < cutoff]:
+        await build(key)
+
+
+def clear() -> None:
+    global _BYTES
+    mark_changed()
+    _CHANGED_KEYS.update(_BUCKETS)
+    _CHANGED_KEYS.update(_BUILDING)
+    _BUCKETS.clear()
+    _BUCKET_OF.clear()
+    _BYTES = 0
+
+
+async def _refresh_forever() -> None:
+    while True:
+        await asyncio.sleep(settings.topk_cube_refresh_seconds)
+        try:
+            await refresh()
+        except Exception:
+            # Keep serving the current buckets; the next tick retries
+            logger.exception("Top-k cube refresh failed")
+
+
+async def start() -> None:
+    global _REFRESHER
+    if not settings.topk_cube_enabled:
+        return
+    if _REFRESHER is None or _REFRESHER.done():
+        _REFRESHER = asyncio.get_running_loop().create_task(_refresh_forever())
+    await _load_changes()
+
+
+async def stop() -> None:
+    global _REFRESHER
+    tasks = list(_BUILDING.values())
+    if _REFRESHER is not None:
+        tasks.append(_REFRESHER)
+        _REFRESHER = None
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    clear()
+
+
+def get_cube_stats(top: int = 10) -> dict[str, Any]:
+    lookups = _STATS["hits"] + _STATS["misses"] + _STATS["truncated"]
+    hottest = sorted(_BUCKETS.values(), key=lambda bucket: bucket.hits, reverse=True)[:top]
+    return {
+        "buckets": len(_BUCKETS),
+        "bytes": _BYTES,
+        "hit_rate": _STATS["hits"] / lookups if lookups else 0.0,
+        **_STATS,
+        "hottest": [
+            {"key": list(bucket.key), "rows": len(bucket.rows), "complete": bucket.complete,
+             "bytes": bucket.size, "hits": bucket.hits}
+            for bucket in hottest
+        ],
+    }
@@ -0,0 +1,203 @@
+"""Write-behind log of agent turns, for analytics and replay.
+
+`record(entry)` appends to a bounded in-memory ring buffer and returns:
+turns never wait for I/O. A background task (`start`/`stop`, tied to the
+app lifespan) wakes every `turn_log_flush_seconds`, or early once
+`turn_log_flush_rows` records are pending, and appends the whole batch to
+the current segment from a worker thread.
+
+Segments are gzip-compressed JSONL files in `turn_log_dir`, named
+`turns-<UTC start>-<pid>-<n>.jsonl.gz` so several workers can share the
+directory. Each flush is appended as its own gzip member, so a segment is
+readable at any time (gzip reads members in sequence) and a crash loses at
+most the records still buffered. A segment is rotated once it exceeds
+`turn_log_segment_max_bytes` (compressed) or `turn_log_segment_max_seconds`
+of age; only the newest `turn_log_retain_segments` are kept.
+
+Under overload the oldest buffered record is dropped rather than blocking
+a turn (`dropped`); `backpressure` counts records appended while the
+buffer was more than half full, i.e. while the writer was falling behind.
+
+`read_segments` yields the records back; `python -m benchmarks.replay`
+replays them through the app as a load test.
+"""
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+from app.config import get_settings
+from app.utils import json_codec
+
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+SEGMENT_GLOB = "turns-*.jsonl.gz"
+
+_BUFFER: deque[dict[str, Any]] = deque(maxlen=max(settings.turn_log_buffer_size, 1))
+_WAKE: asyncio.Event | None = None
+_WRITER: asyncio.Task | None = None
+_STOPPING = False
+# Current segment; only touched by the writer thread
+_SEGMENT: Path | None = None
+_SEGMENT_STARTED = 0.0
+_SEGMENT_BYTES = 0
+_SEGMENT_COUNT = 0
+_STATS: dict[str, int] = {
+    "recorded": 0,
+    "written": 0,
+    "dropped": 0,
+    "backpressure": 0,
+    "flushes": 0,
+    "segments": 0,
+    "bytes_written": 0,
+    "write_errors": 0,
+}
+
+
+def is_enabled() -> bool:
+    return settings.turn_log_enabled
+
+
+def record(entry: dict[str, Any]) -> None:
+    """Queue one turn record; never blocks. The dict must not be mutated later."""
+    if not settings.turn_log_enabled:
+        return
+    if len(_BUFFER) == _BUFFER.maxlen:
+        # The deque drops the oldest record on append
+        _STATS["dropped"] += 1
+    _BUFFER.append(entry)
+    _STATS["recorded"] += 1
+    pending = len(_BUFFER)
+    if pending * 2 > _BUFFER.maxlen:
+        _STATS["backpressure"] += 1
+    if pending >= settings.turn_log_flush_rows and _WAKE is not None:
+        _WAKE.set()
+
+
+def _prune(directory: Path) -> None:
+    # The current segment counts towards the limit even before its first write
+    segments = sorted(path for path in directory.glob(SEGMENT_GLOB) if path != _SEGMENT)
+    for path in segments[:max(len(segments) - settings.turn_log_retain_segments + 1, 0)]:
+        # Another worker may have pruned it already
+        path.unlink(missing_ok=True)
+
+
+def _rotate(now: float) -> None:
+    global _SEGMENT, _SEGMENT_STARTED, _SEGMENT_BYTES, _SEGMENT_COUNT
+    directory = Path(settings.turn_log_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    _SEGMENT_COUNT += 1
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(now))
+    _SEGMENT = directory / f"turns-{stamp}-{os.getpid()}-{_SEGMENT_COUNT}.jsonl.gz"
+    _SEGMENT_STARTED = now
+    _SEGMENT_BYTES = 0
+    _STATS["segments"] += 1
+    _prune(directory)
+
+
+def _write(batch: list[dict[str, Any]]) -> tuple[int, int]:
+    """Append a batch to the current segment as one gzip member (worker thread).
+
+    Returns (records, compressed bytes) written.
+    """
+    global _SEGMENT_BYTES
+    lines = []
+    for entry in batch:
+        try:
+            lines.append(json_codec.dumps(entry))
+        except (TypeError, ValueError):
+            _STATS["write_errors"] += 1
+    if not lines:
+        return 0, 0
+    data = gzip.compress(b"\n".join(lines) + b"\n", settings.turn_log_compress_level)
+    now = time.time()
+    if (
+        _SEGMENT is None
+        or _SEGMENT_BYTES >= settings.turn_log_segment_max_bytes
+        or now - _SEGMENT_STARTED >= settings.turn_log_segment_max_seconds
+    ):
+        _rotate(now)
+    with open(_SEGMENT, "ab") as fh:
+        fh.write(data)
+    _SEGMENT_BYTES += len(data)
+    return len(lines), len(data)
+
+
+async def flush() -> int:
+    """Write out every buffered record; returns how many were taken."""
+    if not _BUFFER:
+        return 0
+    batch = list(_BUFFER)
+    _BUFFER.clear()
+    try:
+        written, size = await asyncio.to_thread(_write, batch)
+    except OSError:
+        _STATS["write_errors"] += 1
+        _STATS["dropped"] += len(batch)
+        logger.exception("Could not write %d turn log records", len(batch))
+        return 0
+    _STATS["flushes"] += 1
+    _STATS["written"] += written
+    _STATS["bytes_written"] += size
+    return len(batch)
+
+
+async def _flush_forever() -> None:
+    while True:
+        try:
+            await asyncio.wait_for(_WAKE.wait(), settings.turn_log_flush_seconds)
+        except asyncio.TimeoutError:
+            pass
+        _WAKE.clear()
+        await flush()
+        if _STOPPING:
+            return
+
+
+async def start() -> None:
+    global _WAKE, _WRITER, _STOPPING
+    if not settings.turn_log_enabled:
+        return
+    if _WRITER is None or _WRITER.done():
+        _WAKE = asyncio.Event()
+        _STOPPING = False
+        _WRITER = asyncio.get_running_loop().create_task(_flush_forever())
+
+
+async def stop() -> None:
+    """Flush what is buffered and stop the writer."""
+    global _WRITER, _STOPPING
+    if _WRITER is None:
+        return
+    # Not cancelled: a write in progress in the worker thread must finish first
+    _STOPPING = True
+    _WAKE.set()
+    await asyncio.gather(_WRITER, return_exceptions=True)
+    _WRITER = None
+
+
+def read_segments(paths: Iterable[str | Path]) -> Iterator[dict[str, Any]]:
+    """Records of the given segment files (or directories of them), in file order."""
+    files: list[Path] = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob(SEGMENT_GLOB)) if path.is_dir() else [path])
+    for path in files:
+        try:
+            with gzip.open(path, "rb") as fh:
+                for line in fh:
+                    if line.strip():
+                        yield json.loads(line)
+        except EOFError:
+            # Segment cut mid-member by a crash: keep what was complete
+            logger.warning("Truncated turn log segment %s", path)
+
+
+def get_turn_log_stats() -> dict[str, Any]:
+    return {"pending": len(_BUFFER), "capacity": _BUFFER.maxlen, "segment": str(_SEGMENT) if _SEGMENT else None, **_STATS}
@@ -0,0 +1,77 @@
+"""JSON encoding of API payloads.
+
+With `fast_json_enabled` and orjson installed, payloads are encoded by
+orjson in one pass; Decimals and ResultSets go through `_default`, so
+nothing walks the payload beforehand. Otherwise they go through FastAPI's
+`jsonable_encoder` and the standard `json` module, like FastAPI's own
+JSONResponse. Both produce the same JSON.
+
+On the fast path a ResultSet's values are converted once and cached on it
+(`json_rows`), so encoding a shared result again only zips them with the
+column names.
+"""
+
+import json
+from decimal import Decimal
+from typing import Any
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from app.config import get_settings
+from app.services.result_set import ResultSet
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+settings = get_settings()
+
+
+def _decimal(value: Decimal) -> int | float:
+    # Same rule as FastAPI's decimal encoder: integral values stay ints
+    if value.as_tuple().exponent >= 0:
+        return int(value)
+    return float(value)
+
+
+def _json_rows(result: ResultSet) -> list[tuple]:
+    """Rows of `result` with Decimals converted, computed once per result."""
+    if result.json_rows is None:
+        result.json_rows = [
+            tuple(_decimal(v) if isinstance(v, Decimal) else v for v in row) for row in result.rows
+        ]
+    return result.json_rows
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return _decimal(value)
+    if isinstance(value, ResultSet):
+        columns = value.columns
+        return [dict(zip(columns, row)) for row in _json_rows(value)]
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+# jsonable_encoder returns custom encoder output as is, so encode the rows too
+_CUSTOM_ENCODERS = {ResultSet: lambda value: jsonable_encoder(value.to_dicts())}
+
+
+def is_fast() -> bool:
+    return settings.fast_json_enabled and orjson is not None
+
+
+def dumps(value: Any) -> bytes:
+    if is_fast():
+        return orjson.dumps(value, default=_default)
+    encoded = jsonable_encoder(value, custom_encoder=_CUSTOM_ENCODERS)
+    return json.dumps(encoded, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class JSONBody(Response):
+    """JSONResponse encoded with `dumps`."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
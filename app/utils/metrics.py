@@ -0,0 +1,226 @@
+"""Low-overhead timing spans, counters and histograms in Prometheus format.
+
+`timed(stage)` wraps a sync or async function in a span; every span feeds
+the `stage_duration_seconds{stage=...}` histogram and, while a request is
+being traced, the request's Server-Timing entries. Counters and histograms
+use fixed label sets and fixed buckets, so recording is a dict lookup, a
+bisect and two additions. Values owned by other modules (cache stats,
+active sessions) are read at scrape time through `register_collector`.
+
+With `metrics_enabled` off, `inc`/`observe` return immediately; with
+`metrics_server_timing` off as well, `timed` returns the function unchanged,
+so the instrumentation costs nothing.
+Metrics are per process: with several workers, each one reports its own.
+"""
+
+import functools
+import inspect
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator
+from app.config import get_settings
+
+
+settings = get_settings()
+
+# Seconds; covers rule-path turns (sub-ms) up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Row counts per query
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+_HELP: dict[str, tuple[str, str]] = {}
+_COUNTERS: dict[tuple[str, Labels], float] = {}
+_HISTOGRAMS: dict[tuple[str, Labels], Histogram] = {}
+_COLLECTORS: list[Callable[[], Iterator[tuple[str, str, str, Labels, float]]]] = []
+
+# (stage, seconds) spans of the request being traced, for Server-Timing
+_REQUEST_SPANS: ContextVar[list[tuple[str, float]] | None] = ContextVar("request_spans", default=None)
+
+
+def is_enabled() -> bool:
+    return settings.metrics_enabled
+
+
+def _spans_enabled() -> bool:
+    # Spans feed both the stage histogram and the Server-Timing header
+    return settings.metrics_enabled or settings.metrics_server_timing
+
+
+def describe(name: str, kind: str, help_text: str) -> None:
+    _HELP[name] = (kind, help_text)
+
+
+def inc(name: str, value: float = 1.0, **labels: str) -> None:
+    if not settings.metrics_enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    _COUNTERS[key] = _COUNTERS.get(key, 0.0) + value
+
+
+def observe(name: str, value: float, buckets: tuple[float, ...] = DEFAULT_BUCKETS, **labels: str) -> None:
+    if not settings.metrics_enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    histogram = _HISTOGRAMS.get(key)
+    if histogram is None:
+        histogram = _HISTOGRAMS[key] = Histogram(buckets)
+    histogram.observe(value)
+
+
+def _record_span(stage: str, seconds: float) -> None:
+    observe("stage_duration_seconds", seconds, stage=stage)
+    spans = _REQUEST_SPANS.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a block as `stage` (use `timed` for whole functions)."""
+    if not _spans_enabled():
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record_span(stage, time.perf_counter() - started)
+
+
+def timed(stage: str) -> Callable[[Callable], Callable]:
+    """Decorator: time every call of the function as `stage`."""
+
+    def decorate(func: Callable) -> Callable:
+        if not _spans_enabled():
+            return func
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    _record_span(stage, time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record_span(stage, time.perf_counter() - started)
+        return wrapper
+
+    return decorate
+
+
+def start_request_trace() -> tuple[Any, list[tuple[str, float]]]:
+    """Collect the spans of the current request; returns (reset token, spans)."""
+    spans: list[tuple[str, float]] = []
+    return _REQUEST_SPANS.set(spans), spans
+
+
+def finish_request_trace(token: Any) -> None:
+    _REQUEST_SPANS.reset(token)
+
+
+def server_timing_header(spans: list[tuple[str, float]], total: float) -> str:
+    """Server-Timing value; repeated stages are summed, durations in ms."""
+    totals: dict[str, float] = {}
+    for stage, seconds in spans:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    entries = [f"{stage.replace('.', '-')};dur={seconds * 1000:.2f}" for stage, seconds in totals.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+def register_collector(collector: Callable[[], Iterator[tuple[str, str, str, Labels, float]]]) -> None:
+    """Add a scrape-time source yielding (name, kind, help, labels, value)."""
+    _COLLECTORS.append(collector)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_prometheus() -> str:
+    """All metrics in the Prometheus text exposition format (0.0.4)."""
+    families: dict[str, list[str]] = {}
+    kinds: dict[str, tuple[str, str]] = dict(_HELP)
+
+    for (name, labels), value in sorted(_COUNTERS.items()):
+        families.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        kinds.setdefault(name, ("counter", ""))
+
+    for (name, labels), histogram in sorted(_HISTOGRAMS.items()):
+        lines = families.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', _format_value(bound)),))} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {histogram.count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum!r}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        kinds.setdefault(name, ("histogram", ""))
+
+    for collector in _COLLECTORS:
+        for name, kind, help_text, labels, value in collector():
+            families.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            kinds.setdefault(name, (kind, help_text))
+
+    out: list[str] = []
+    for name, lines in families.items():
+        kind, help_text = kinds[name]
+        if help_text:
+            out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        out.extend(lines)
+    return "\n".join(out) + "\n"
+
+
+def reset() -> None:
+    """Drop recorded counters and histograms (benchmarks)."""
+    _COUNTERS.clear()
+    _HISTOGRAMS.clear()
+
+
+describe("stage_duration_seconds", "histogram", "Wall time per agent stage")
+describe("llm_tokens_total", "counter", "Tokens reported by the LLM API")
+describe("llm_request_duration_seconds", "histogram", "Latency of single LLM API attempts")
+describe("db_rows_total", "counter", "Rows returned by db.fetch")
+describe("db_streams_aborted_total", "counter", "Streamed reads cut short by db.stream limits")
+describe("db_rows_per_query", "histogram", "Rows returned per db.fetch")
+describe("db_pool_wait_seconds", "histogram", "Time waiting to acquire a pooled connection")
+describe("http_request_duration_seconds", "histogram", "Wall time per HTTP request")
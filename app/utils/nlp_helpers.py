@@ -3,5 +3,67 @@
 Small utilities used by parser and llm prompts.
 """
 
+import re
+import unicodedata
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_THOUSANDS_RE = re.compile(r"^\d{1,3}(?:[.,]\d{3})+$")
+
+_WORD_NUMBERS = {
+    "un": 1, "uno": 1, "una": 1,
+    "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5,
+    "seis": 6, "siete": 7, "ocho": 8, "nueve": 9, "diez": 10,
+}
+
+_MULTIPLIERS = {
+    "k": 1_000,
+    "mil": 1_000,
+    "millon": 1_000_000,
+    "millones": 1_000_000,
+}
+
+
 def normalize_text(text: str) -> str:
-    return text.strip()
+    """Trim, collapse inner whitespace and casefold (used for cache keys)."""
+    return _WHITESPACE_RE.sub(" ", text.strip()).casefold()
+
+
+def strip_accents(text: str) -> str:
+    """Remove diacritics ("Jesús María" -> "Jesus Maria"), keeping ñ."""
+    decomposed = unicodedata.normalize("NFD", text.replace("ñ", "\0").replace("Ñ", "\1"))
+    stripped = "".join(c for c in decomposed if unicodedata.category(c) != "Mn")
+    return stripped.replace("\0", "ñ").replace("\1", "Ñ")
+
+
+def fold_text(text: str) -> str:
+    """Normalize for matching: casefolded, accent-free, single-spaced."""
+    return strip_accents(normalize_text(text))
+
+
+def parse_number(token: str) -> float | None:
+    """Parse a numeric token, accepting "300,000", "300.000", "85.5" and "85,5".
+
+    Word numbers ("dos", "tres") up to ten are also accepted.
+    """
+    token = token.strip()
+    if not token:
+        return None
+    if token in _WORD_NUMBERS:
+        return float(_WORD_NUMBERS[token])
+    if _THOUSANDS_RE.match(token):
+        return float(re.sub(r"[.,]", "", token))
+    try:
+        return float(token.replace(",", "."))
+    except ValueError:
+        return None
+
+
+def apply_multiplier(value: float, suffix: str | None) -> float:
+    """Scale `value` by a magnitude suffix such as "k", "mil" or "millones"."""
+    if not suffix:
+        return value
+    return value * _MULTIPLIERS.get(suffix.strip().casefold(), 1)
+
+
+def as_int_if_whole(value: float) -> int | float:
+    return int(value) if float(value).is_integer() else value
@@ -4,8 +4,16 @@ This module will contain functions to validate column/table names and ensure
 queries only use allowed identifiers.
 """
 
+import re
 from typing import Iterable
 
+_IDENTIFIER_RE = re.compile(r"^[a-z_][a-z0-9_]{0,62}$")
+
 
 def is_allowed_column(col: str, allowed: Iterable[str]) -> bool:
     return col in allowed
+
+
+def is_safe_identifier(name: str) -> bool:
+    """True for a plain lowercase SQL identifier that needs no quoting."""
+    return bool(_IDENTIFIER_RE.match(name))
@@ -0,0 +1,12 @@
+"""Reproducible benchmarks for the agent.
+
+- `python -m benchmarks.micro`: microbenchmarks of filter normalization,
+  query building and the session save/load cycle.
+- `python -m benchmarks.load`: in-process load test of
+  /api/v1/agent/message with multi-turn scripts, a stub LLM with
+  configurable latency and a fixture DB (or a real one via --database-url).
+
+Both write a JSON result (`--out`) and can compare against a previous one
+(`--baseline`). Fixtures are seeded, so runs on the same machine are
+comparable.
+"""
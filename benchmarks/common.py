@@ -0,0 +1,81 @@
+"""Shared helpers: environment setup, percentiles and JSON results."""
+
+import json
+import os
+import platform
+import sys
+import time
+from typing import Any
+
+
+def configure_environment(**overrides: str) -> None:
+    """Set env defaults before any `app` module reads the settings.
+
+    Must run before importing `app.*`: settings are cached on first use.
+    """
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("METRICS_ENABLED", "true")
+    os.environ.setdefault("METRICS_SERVER_TIMING", "true")
+    for key, value in overrides.items():
+        os.environ[key.upper()] = value
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile (0 for no samples)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    """Count, mean and p50/p95/p99 of samples in seconds, reported in ms."""
+    return {
+        "count": len(samples),
+        "mean_ms": sum(samples) / len(samples) * 1000 if samples else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+
+
+def write_result(path: str | None, kind: str, config: dict[str, Any], results: dict[str, Any]) -> dict[str, Any]:
+    document = {
+        "kind": kind,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+    if path:
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(document, fh, indent=2, sort_keys=True)
+    return document
+
+
+def _flatten(prefix: str, value: Any, out: dict[str, float]) -> None:
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else key, item, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = float(value)
+
+
+def compare(current: dict[str, Any], baseline_path: str) -> list[str]:
+    """Lines describing the relative change of every numeric result."""
+    with open(baseline_path, encoding="utf-8") as fh:
+        baseline = json.load(fh)
+    now: dict[str, float] = {}
+    before: dict[str, float] = {}
+    _flatten("", current["results"], now)
+    _flatten("", baseline.get("results", {}), before)
+    lines = []
+    for key in sorted(now):
+        if key not in before or key.endswith(".count"):
+            continue
+        old, new = before[key], now[key]
+        change = (new - old) / old * 100 if old else 0.0
+        lines.append(f"{key:<60} {old:>12.3f} -> {new:>12.3f} ({change:+.1f}%)")
+    return lines
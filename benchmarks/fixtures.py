@@ -0,0 +1,189 @@
+"""Seeded fixture data, a fixture `db.fetch` and a stub LLM extractor.
+
+The fixture DB evaluates the canonical statements of `query_builder` over
+generated rows with `filter_algebra`, so searches return what Postgres would.
+The stub LLM answers every scripted message with the filters the script
+expects, after a configurable latency.
+"""
+
+import asyncio
+import random
+from decimal import Decimal
+from typing import Any
+from app.services import filter_algebra
+from app.services import query_builder
+from app.services.result_set import ResultSet
+
+
+DISTRICTS = ["Miraflores", "San Isidro", "Barranco", "Surco", "La Molina", "Lince", "Jesús María", "San Borja"]
+ESTADOS = ["DISPONIBLE", "OCUPADA", "MANTENIMIENTO", "VENDIDA"]
+
+# Multi-turn conversations: (message, filters the LLM should extract)
+SCRIPTS: list[list[tuple[str, dict[str, Any]]]] = [
+    [
+        ("Hola, busco un departamento en Miraflores", {"distrito": "Miraflores"}),
+        ("de unos 80 m2", {"area_min": 80}),
+        ("que esté disponible", {"estado": "DISPONIBLE"}),
+        ("mi presupuesto es 350 mil", {"presupuesto_max": 350000}),
+        ("2 dormitorios", {"dormitorios": 2}),
+        ("que tenga balcón", {"balcon": True}),
+    ],
+    [
+        ("Quiero algo en San Isidro de 100 m2 disponible", {"distrito": "San Isidro", "area_min": 100, "estado": "DISPONIBLE"}),
+        ("hasta 500000", {"presupuesto_max": 500000}),
+        ("3 dormitorios", {"dormitorios": 3}),
+        ("mejor hasta 450000", {"presupuesto_max": 450000}),
+    ],
+    [
+        ("Busco en Barranco, 60 metros, disponible, hasta 250 mil, 1 dormitorio", {
+            "distrito": "Barranco", "area_min": 60, "estado": "DISPONIBLE", "presupuesto_max": 250000, "dormitorios": 1,
+        }),
+        ("que acepte mascotas", {"pet_friendly": True}),
+    ],
+    [
+        ("departamento en Surco", {"distrito": "Surco"}),
+        ("120", {"area_min": 120}),
+        ("disponible", {"estado": "DISPONIBLE"}),
+        ("200000", {"presupuesto_max": 200000}),
+        ("4", {"dormitorios": 4}),
+    ],
+]
+
+
+def make_rows(count: int = 2000, seed: int = 7) -> list[dict[str, Any]]:
+    """Rows shaped like the search result columns (query_builder.COLUMNS)."""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(1, count + 1):
+        rows.append({
+            "id": i,
+            "numero": f"{rng.randint(1, 20)}{rng.randint(1, 9):02d}",
+            "piso": rng.randint(1, 20),
+            "tipo": rng.choice(["departamento", "duplex", "penthouse"]),
+            "area": Decimal(rng.randint(35, 250)),
+            "dormitorios": rng.choice([1, 2, 2, 3, 3, 4, None]),
+            "banios": rng.randint(1, 4),
+            "balcon": rng.choice([True, False, None]),
+            "terraza": rng.choice([True, False]),
+            "amoblado": rng.choice([True, False]),
+            "permite_mascotas": rng.choice([True, False, None]),
+            "valor_comercial": Decimal(rng.randint(8, 120) * 5000),
+            "mantenimiento_mensual": Decimal(rng.randint(100, 900)),
+            "estado": rng.choice(ESTADOS),
+            "edificio_nombre": f"Edificio {i % 150}",
+            "edificio_direccion": f"Av. Principal {i % 150 * 10}",
+            "edificio_distrito": rng.choice(DISTRICTS),
+        })
+    return rows
+
+
+def _facet_rows(rows: list[dict], filters: dict) -> list[dict]:
+    """What the GROUPING SETS facet statement returns for `filters`."""
+    dimensions = query_builder.FACET_DIMENSIONS
+    all_grouped = (1 << len(dimensions)) - 1
+    active = query_builder.active_filters(filters)
+
+    def failed(row: dict) -> list[str]:
+        return [key for key, value in active.items() if not filter_algebra.row_matches(row, {key: value})]
+
+    def add(counts: dict[str, int], misses: list[str]) -> None:
+        # A row counts for without_<key> when <key> is its only failing filter
+        if not misses:
+            counts["matches"] += 1
+        for key in query_builder.FILTER_KEYS:
+            if not misses or misses == [key]:
+                counts[f"without_{key}"] += 1
+
+    def zeroed() -> dict[str, int]:
+        return {"matches": 0, **{f"without_{key}": 0 for key in query_builder.FILTER_KEYS}}
+
+    empty = {alias: None for _, _, alias in dimensions}
+    total = zeroed()
+    groups: list[dict[Any, dict[str, int]]] = [{} for _ in dimensions]
+    for row in rows:
+        misses = failed(row)
+        if len(misses) > 1:
+            continue
+        add(total, misses)
+        for i, (_, _, alias) in enumerate(dimensions):
+            add(groups[i].setdefault(row[alias], zeroed()), misses)
+
+    out = [{**empty, "facet": all_grouped, **total}]
+    for i, (_, _, alias) in enumerate(dimensions):
+        grouping = all_grouped & ~(1 << (len(dimensions) - 1 - i))
+        for value, counts in groups[i].items():
+            out.append({**empty, alias: value, "facet": grouping, **counts})
+    return out
+
+
+class FixtureDB:
+    """Drop-in for `db.fetch` / `db.fetch_result` answering the canonical statements from memory."""
+
+    def __init__(self, rows: list[dict], latency_ms: float = 0.0) -> None:
+        self.rows = rows
+        # Search order of the canonical statements (no NULL valor_comercial here)
+        self.ordered = sorted(rows, key=lambda r: (-r["valor_comercial"], r["id"]))
+        self.latency = latency_ms / 1000
+        self.queries = 0
+
+    async def fetch(self, sql: str, *params: Any, primary: bool = False) -> list[dict]:
+        return [dict(r) for r in await self._select(sql, params)]
+
+    async def fetch_result(self, sql: str, *params: Any) -> ResultSet:
+        """Drop-in for `db.fetch_result`: rows packed once, like Records."""
+        return ResultSet.from_dicts(await self._select(sql, params))
+
+    async def _select(self, sql: str, params: tuple) -> list[dict]:
+        """Matching fixture rows, not copied."""
+        self.queries += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if "= ANY(" in sql:
+            # Changed-row re-read of the change feed (by propiedad id)
+            ids = set(params[0])
+            return [r for r in self.rows if r["id"] in ids]
+        filters = {key: value for key, value in zip(query_builder.FILTER_KEYS, params) if value is not None}
+        if "GROUPING SETS" in sql:
+            return _facet_rows(self.rows, filters)
+        count = len(query_builder.FILTER_KEYS)
+        if len(params) == count + 3:
+            # Keyset page statement: (last valor_comercial, last id, limit)
+            return self._page(filters, params[count], params[count + 1], params[count + 2])
+        if "LIMIT" in sql:
+            limit = params[count]
+            return filter_algebra.apply_filters(self.ordered, filters, limit)
+        # Snapshot query of the in-memory engines
+        return self.rows
+
+    def _page(self, filters: dict, after_value: Any, after_id: int | None, limit: int | None) -> list[dict]:
+        rows = self.ordered
+        if after_id is not None:
+            rows = [
+                r for r in rows
+                if r["valor_comercial"] < after_value
+                or (r["valor_comercial"] == after_value and r["id"] > after_id)
+            ]
+        return filter_algebra.apply_filters(rows, filters, limit)
+
+    async def stream(self, sql: str, *params: Any):
+        """Drop-in for `db.stream`."""
+        for row in await self.fetch(sql, *params):
+            yield row
+
+
+class StubLLM:
+    """Drop-in for `llm_client._request_extraction` with fixed latency."""
+
+    def __init__(self, latency_ms: float = 800.0, jitter_ms: float = 0.0, seed: int = 7) -> None:
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.rng = random.Random(seed)
+        self.answers = {message: filters for script in SCRIPTS for message, filters in script}
+        self.calls = 0
+
+    async def extract(self, text: str, pending: str | None = None) -> dict[str, Any]:
+        self.calls += 1
+        delay = self.latency + (self.rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return dict(self.answers.get(text, {}))
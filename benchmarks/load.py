@@ -0,0 +1,132 @@
+"""In-process load test of the agent HTTP API.
+
+    python -m benchmarks.load [--users 20] [--duration 10] [--llm-latency-ms 800]
+                              [--database-url postgresql://...] [--out load.json]
+                              [--baseline old.json]
+
+Virtual users replay the multi-turn scripts of `benchmarks.fixtures` against
+POST /api/v1/agent/message through httpx's ASGI transport, so no server or
+network is involved. The LLM is replaced by a stub with configurable
+latency; the DB by the fixture unless --database-url points at a real one.
+Per-stage latencies come from the Server-Timing header of every response.
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Any
+
+from benchmarks.common import compare, configure_environment, summarize, write_result
+
+
+def _parse_server_timing(header: str | None) -> dict[str, float]:
+    """{stage: seconds} from a Server-Timing header."""
+    stages: dict[str, float] = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        if params.startswith("dur="):
+            stages[name] = float(params[4:]) / 1000
+    return stages
+
+
+async def _user(client: Any, scripts: list, deadline: float, offset: int, samples: dict[str, Any]) -> None:
+    turn = offset
+    while time.perf_counter() < deadline:
+        script = scripts[turn % len(scripts)]
+        turn += 1
+        session_id = None
+        for message, _ in script:
+            started = time.perf_counter()
+            response = await client.post("/api/v1/agent/message", json={"session_id": session_id, "message": message})
+            samples["latency"].append(time.perf_counter() - started)
+            if response.status_code != 200:
+                samples["errors"] += 1
+                break
+            session_id = response.json()["session_id"]
+            for stage, seconds in _parse_server_timing(response.headers.get("server-timing")).items():
+                samples["stages"].setdefault(stage, []).append(seconds)
+            if time.perf_counter() >= deadline:
+                return
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    import httpx
+    from app.main import app
+    from app.services import db, llm_client
+    from app.utils import metrics
+    from benchmarks.fixtures import SCRIPTS, FixtureDB, StubLLM, make_rows
+
+    stub = StubLLM(args.llm_latency_ms, args.llm_jitter_ms)
+    llm_client._request_extraction = stub.extract
+    fixture = None
+    if not args.database_url:
+        fixture = FixtureDB(make_rows(args.rows), args.db_latency_ms)
+        db.fetch = metrics.timed("db.fetch")(fixture.fetch)
+        db.fetch_result = metrics.timed("db.fetch")(fixture.fetch_result)
+
+    samples: dict[str, Any] = {"latency": [], "stages": {}, "errors": 0}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            started = time.perf_counter()
+            deadline = started + args.duration
+            await asyncio.gather(*(
+                _user(client, SCRIPTS, deadline, offset, samples) for offset in range(args.users)
+            ))
+            elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(samples["latency"]),
+        "errors": samples["errors"],
+        "elapsed_s": elapsed,
+        "req_per_s": len(samples["latency"]) / elapsed,
+        "latency": summarize(samples["latency"]),
+        "stages": {stage: summarize(values) for stage, values in sorted(samples["stages"].items())},
+        "llm_calls": stub.calls,
+        "db_queries": fixture.queries if fixture is not None else None,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    ap.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    ap.add_argument("--llm-latency-ms", type=float, default=800.0)
+    ap.add_argument("--llm-jitter-ms", type=float, default=100.0)
+    ap.add_argument("--db-latency-ms", type=float, default=2.0, help="fixture DB latency per query")
+    ap.add_argument("--rows", type=int, default=2000, help="fixture DB rows")
+    ap.add_argument("--database-url", help="use this Postgres instead of the fixture DB")
+    ap.add_argument("--session-backend", choices=["memory", "sqlite"], default="memory")
+    ap.add_argument("--no-fast-path", action="store_true", help="send every message to the LLM stub")
+    ap.add_argument("--property-index", action="store_true", help="enable the in-memory property index")
+    ap.add_argument("--out", help="write the JSON result here")
+    ap.add_argument("--baseline", help="compare against a previous JSON result")
+    args = ap.parse_args()
+
+    overrides = {
+        "session_backend": args.session_backend,
+        "fast_path_enabled": str(not args.no_fast_path).lower(),
+        "property_index_enabled": str(args.property_index).lower(),
+        "llm_cache_enabled": "false",
+    }
+    if args.database_url:
+        overrides["database_url"] = args.database_url
+    configure_environment(**overrides)
+
+    results = asyncio.run(run(args))
+    config = {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "database_url")}
+    config["database"] = "postgres" if args.database_url else "fixture"
+    document = write_result(args.out, "load", config, results)
+
+    latency = results["latency"]
+    print(f"{results['requests']} requests, {results['errors']} errors, {results['req_per_s']:.1f} req/s")
+    print(f"{'stage':<32} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    print(f"{'request':<32} {latency['p50_ms']:>9.2f} {latency['p95_ms']:>9.2f} {latency['p99_ms']:>9.2f}")
+    for stage, summary in results["stages"].items():
+        print(f"{stage:<32} {summary['p50_ms']:>9.2f} {summary['p95_ms']:>9.2f} {summary['p99_ms']:>9.2f}")
+    if args.baseline:
+        print("\n".join(compare(document, args.baseline)))
+
+
+if __name__ == "__main__":
+    main()
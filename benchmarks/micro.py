@@ -0,0 +1,119 @@
+"""Microbenchmarks of the per-turn CPU work.
+
+    python -m benchmarks.micro [--seconds 0.5] [--out micro.json] [--baseline old.json]
+
+Each case runs in batches until `--seconds` elapse; per-call times of the
+batches give ops/s and p50/p95/p99.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Any, Callable
+
+from benchmarks.common import compare, configure_environment, summarize, write_result
+
+configure_environment()
+
+from app.config import get_settings  # noqa: E402
+from app.services import parser, query_builder, session_manager  # noqa: E402
+from app.services.session_backends import MemorySessionBackend, SQLiteSessionBackend  # noqa: E402
+
+
+HISTORY_LENGTHS = (0, 10, 50, 200)
+
+
+def run_case(func: Callable[[], Any], seconds: float, batch: int = 100) -> dict[str, float]:
+    samples: list[float] = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        for _ in range(batch):
+            func()
+        samples.append((time.perf_counter() - started) / batch)
+    result = summarize(samples)
+    result["ops_per_s"] = 1 / (sum(samples) / len(samples)) if samples else 0.0
+    return result
+
+
+def _normalize_case() -> Callable[[], Any]:
+    raw = {
+        "distrito": "miraflores", "area_min": "80", "estado": "disponible",
+        "presupuesto_max": "350000", "dormitorios": "2", "balcon": True, "pet_friendly": "si",
+    }
+    current = {"terraza": True}
+    return lambda: parser.normalize_extraction(raw, current)
+
+
+def _build_case(filters: dict) -> Callable[[], Any]:
+    return lambda: query_builder.build_property_search_query(filters)
+
+
+def _session_cycle_case(history: int) -> Callable[[], Any]:
+    session_manager.create_session("bench")
+    # The session's own state: saving any other object is a conflict
+    state = session_manager.load_conversation_state("bench")
+    state.messages = [{"role": "user" if i % 2 else "assistant", "content": f"mensaje {i} " * 8} for i in range(history)]
+    state.collected_filters = {"distrito": "Miraflores", "area_min": 80, "estado": "DISPONIBLE"}
+
+    def cycle() -> None:
+        session_manager.save_conversation_state("bench", state)
+        session_manager.load_conversation_state("bench")
+        session_manager.flush()
+
+    return cycle
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--seconds", type=float, default=0.5, help="time budget per case")
+    ap.add_argument("--out", help="write the JSON result here")
+    ap.add_argument("--baseline", help="compare against a previous JSON result")
+    args = ap.parse_args()
+
+    settings = get_settings()
+    # Keep the whole history so each length is really measured
+    settings.session_max_messages = max(HISTORY_LENGTHS)
+
+    results: dict[str, Any] = {
+        "parser.normalize_extraction": run_case(_normalize_case(), args.seconds),
+        "query_builder.build.partial": run_case(_build_case({"distrito": "Miraflores", "area_min": 80}), args.seconds),
+        "query_builder.build.complete": run_case(_build_case({
+            "distrito": "Miraflores", "area_min": 80, "estado": "DISPONIBLE",
+            "presupuesto_max": 350000, "dormitorios": 2, "balcon": True,
+        }), args.seconds),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            "memory": lambda: MemorySessionBackend(
+                ttl_seconds=settings.session_ttl_seconds,
+                max_count=settings.session_max_count,
+                max_bytes=settings.session_max_bytes,
+            ),
+            "sqlite": lambda: SQLiteSessionBackend(
+                os.path.join(tmp, "bench.sqlite3"),
+                ttl_seconds=settings.session_ttl_seconds,
+                max_count=settings.session_max_count,
+                max_bytes=settings.session_max_bytes,
+            ),
+        }
+        for name, make in backends.items():
+            session_manager.set_backend(make())
+            for history in HISTORY_LENGTHS:
+                results[f"session.{name}.cycle.history_{history}"] = run_case(
+                    _session_cycle_case(history), args.seconds, batch=20
+                )
+        session_manager.set_backend(backends["memory"]())
+
+    document = write_result(args.out, "micro", {"seconds": args.seconds}, results)
+    for case, result in results.items():
+        print(f"{case:<45} {result['ops_per_s']:>12.0f} ops/s  p50 {result['p50_ms'] * 1000:8.2f}us  "
+              f"p99 {result['p99_ms'] * 1000:8.2f}us")
+    if args.baseline:
+        print("\n".join(compare(document, args.baseline)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Replay recorded turn logs through the app as a load test.
+
+    python -m benchmarks.replay turn_logs/ [more segments or dirs ...]
+                                [--speed 1] [--max-sessions 0] [--llm-latency-ms 800]
+                                [--database-url postgresql://...] [--out replay.json]
+                                [--baseline old.json]
+
+Every recorded conversation (one session id of the turn log, see
+app.services.turn_log) becomes a virtual user sending its messages in
+order, under a new session. With --speed N, conversations start and turns
+are sent at their recorded offsets divided by N (later if the previous
+turn is still running); --speed 0 sends them back to back. The LLM stub
+answers each message with the filters recorded for it, so turns take the
+same path as in production. The DB is the fixture DB unless --database-url
+is given; against the fixture, row counts differ from the recorded ones,
+which `row_mismatches` reports. A turn shed by admission control (429)
+ends its conversation and is counted as `shed`.
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Any
+
+from benchmarks.common import compare, configure_environment, summarize, write_result
+from benchmarks.load import _parse_server_timing
+
+
+def load_conversations(paths: list[str], max_sessions: int = 0) -> list[list[dict[str, Any]]]:
+    """Recorded turns grouped per session, sessions in order of their first turn."""
+    from app.services import turn_log
+
+    sessions: dict[str, list[dict[str, Any]]] = {}
+    for entry in turn_log.read_segments(paths):
+        if entry.get("session_id") and entry.get("message"):
+            sessions.setdefault(entry["session_id"], []).append(entry)
+    conversations = sorted(
+        (sorted(turns, key=lambda turn: turn["ts"]) for turns in sessions.values()),
+        key=lambda turns: turns[0]["ts"],
+    )
+    return conversations[:max_sessions] if max_sessions else conversations
+
+
+async def _conversation(
+    client: Any,
+    turns: list[dict[str, Any]],
+    origin: float,
+    started: float,
+    speed: float,
+    samples: dict[str, Any],
+) -> None:
+    session_id = None
+    for turn in turns:
+        if speed:
+            delay = started + (turn["ts"] - origin) / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        sent = time.perf_counter()
+        response = await client.post("/api/v1/agent/message", json={"session_id": session_id, "message": turn["message"]})
+        samples["latency"].append(time.perf_counter() - sent)
+        if response.status_code != 200:
+            # 429: shed by admission control (arrival rate above capacity)
+            samples["shed" if response.status_code == 429 else "errors"] += 1
+            return
+        body = response.json()
+        session_id = body["session_id"]
+        if turn.get("rows") is not None and len(body.get("data") or []) != turn["rows"]:
+            samples["row_mismatches"] += 1
+        for stage, seconds in _parse_server_timing(response.headers.get("server-timing")).items():
+            samples["stages"].setdefault(stage, []).append(seconds)
+
+
+async def run(args: argparse.Namespace, conversations: list[list[dict[str, Any]]]) -> dict[str, Any]:
+    import httpx
+    from app.main import app
+    from app.services import db, llm_client
+    from app.utils import metrics
+    from benchmarks.fixtures import FixtureDB, StubLLM, make_rows
+
+    stub = StubLLM(args.llm_latency_ms, args.llm_jitter_ms)
+    stub.answers = {
+        turn["message"]: turn.get("extracted") or {} for turns in conversations for turn in turns
+    }
+    llm_client._request_extraction = stub.extract
+    fixture = None
+    if not args.database_url:
+        fixture = FixtureDB(make_rows(args.rows), args.db_latency_ms)
+        db.fetch = metrics.timed("db.fetch")(fixture.fetch)
+        db.fetch_result = metrics.timed("db.fetch")(fixture.fetch_result)
+
+    samples: dict[str, Any] = {"latency": [], "stages": {}, "errors": 0, "shed": 0, "row_mismatches": 0}
+    origin = min(turns[0]["ts"] for turns in conversations)
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                _conversation(client, turns, origin, started, args.speed, samples) for turns in conversations
+            ))
+            elapsed = time.perf_counter() - started
+
+    return {
+        "conversations": len(conversations),
+        "requests": len(samples["latency"]),
+        "errors": samples["errors"],
+        "shed": samples["shed"],
+        "row_mismatches": samples["row_mismatches"],
+        "elapsed_s": elapsed,
+        "req_per_s": len(samples["latency"]) / elapsed,
+        "latency": summarize(samples["latency"]),
+        "stages": {stage: summarize(values) for stage, values in sorted(samples["stages"].items())},
+        "llm_calls": stub.calls,
+        "db_queries": fixture.queries if fixture is not None else None,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("paths", nargs="+", help="turn log segments or directories of them")
+    ap.add_argument("--speed", type=float, default=1.0, help="replay speed-up; 0 = no pacing")
+    ap.add_argument("--max-sessions", type=int, default=0, help="replay only the first N conversations")
+    ap.add_argument("--llm-latency-ms", type=float, default=800.0)
+    ap.add_argument("--llm-jitter-ms", type=float, default=100.0)
+    ap.add_argument("--db-latency-ms", type=float, default=2.0, help="fixture DB latency per query")
+    ap.add_argument("--rows", type=int, default=2000, help="fixture DB rows")
+    ap.add_argument("--database-url", help="use this Postgres instead of the fixture DB")
+    ap.add_argument("--out", help="write the JSON result here")
+    ap.add_argument("--baseline", help="compare against a previous JSON result")
+    args = ap.parse_args()
+
+    overrides = {"llm_cache_enabled": "false", "turn_log_enabled": "false"}
+    if args.database_url:
+        overrides["database_url"] = args.database_url
+    configure_environment(**overrides)
+
+    conversations = load_conversations(args.paths, args.max_sessions)
+    if not conversations:
+        raise SystemExit("no recorded turns found")
+    results = asyncio.run(run(args, conversations))
+    config = {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "database_url", "paths")}
+    config["database"] = "postgres" if args.database_url else "fixture"
+    document = write_result(args.out, "replay", config, results)
+
+    latency = results["latency"]
+    print(f"{results['conversations']} conversations, {results['requests']} requests, {results['errors']} errors, {results['shed']} shed, "
+          f"{results['req_per_s']:.1f} req/s, {results['row_mismatches']} row count mismatches")
+    print(f"{'stage':<32} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    print(f"{'request':<32} {latency['p50_ms']:>9.2f} {latency['p95_ms']:>9.2f} {latency['p99_ms']:>9.2f}")
+    for stage, summary in results["stages"].items():
+        print(f"{stage:<32} {summary['p50_ms']:>9.2f} {summary['p95_ms']:>9.2f} {summary['p99_ms']:>9.2f}")
+    if args.baseline:
+        print("\n".join(compare(document, args.baseline)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Result handling and JSON encoding, per search, before and after the fast path.
+
+    python -m benchmarks.serialization [--seconds 0.5] [--out ser.json] [--baseline old.json]
+
+`dicts` is the generic path: one dict per row from the DB, copied again by
+`AgentResponse.model_dump()`, walked by `jsonable_encoder` and encoded by
+`json`. `result_set` is the fast path: one tuple per row, shared between
+session and response, encoded by orjson. For each result size it reports
+latency (p50/p99) and the peak memory allocated per call (tracemalloc).
+"""
+
+import argparse
+import json
+import tracemalloc
+from typing import Any, Callable
+
+from benchmarks.common import compare, configure_environment, write_result
+
+configure_environment()
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from app.models.schemas import AgentResponse  # noqa: E402
+from app.services import query_builder  # noqa: E402
+from app.services.result_set import ResultSet  # noqa: E402
+from app.utils import json_codec  # noqa: E402
+from benchmarks.fixtures import make_rows  # noqa: E402
+from benchmarks.micro import run_case  # noqa: E402
+
+
+SIZES = (5, 100, 1000)
+
+
+def _records(count: int) -> list[tuple]:
+    # Stand-in for asyncpg Records: values in COLUMNS order
+    return [tuple(row[key] for key in query_builder.RESULT_KEYS) for row in make_rows(count)]
+
+
+def _dicts_case(records: list[tuple]) -> Callable[[], Any]:
+    keys = query_builder.RESULT_KEYS
+
+    def turn() -> bytes:
+        rows = [dict(zip(keys, record)) for record in records]
+        session = {"results": rows}
+        body = AgentResponse(session_id="bench", reply="ok", data=session["results"]).model_dump()
+        encoded = jsonable_encoder(body)
+        return json.dumps(encoded, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+    return turn
+
+
+def _result_set_case(records: list[tuple]) -> Callable[[], Any]:
+    def turn() -> bytes:
+        rows = ResultSet(query_builder.RESULT_KEYS, [tuple(record) for record in records])
+        session = {"results": rows}
+        body = dict(AgentResponse.model_construct(session_id="bench", reply="ok", data=session["results"]))
+        return json_codec.dumps(body)
+
+    return turn
+
+
+def peak_bytes(func: Callable[[], Any], repeat: int = 5) -> int:
+    """Smallest peak of traced allocations over a few calls."""
+    peaks = []
+    for _ in range(repeat):
+        tracemalloc.start()
+        func()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return min(peaks)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--seconds", type=float, default=0.5, help="time budget per case")
+    ap.add_argument("--out", help="write the JSON result here")
+    ap.add_argument("--baseline", help="compare against a previous JSON result")
+    args = ap.parse_args()
+
+    if not json_codec.is_fast():
+        raise SystemExit("orjson is not installed (pip install orjson)")
+
+    results: dict[str, Any] = {}
+    for size in SIZES:
+        records = _records(size)
+        cases = {"dicts": _dicts_case(records), "result_set": _result_set_case(records)}
+        if cases["dicts"]() != cases["result_set"]():
+            raise SystemExit(f"encoders disagree for {size} rows")
+        for name, func in cases.items():
+            result = run_case(func, args.seconds, batch=max(1, 1000 // size))
+            result["peak_kib"] = peak_bytes(func) / 1024
+            results[f"serialize.{name}.rows_{size}"] = result
+
+    document = write_result(args.out, "serialization", {"seconds": args.seconds}, results)
+    for case, result in results.items():
+        print(f"{case:<36} p50 {result['p50_ms'] * 1000:10.2f}us  p99 {result['p99_ms'] * 1000:10.2f}us  "
+              f"peak {result['peak_kib']:9.1f} KiB")
+    if args.baseline:
+        print("\n".join(compare(document, args.baseline)))
+
+
+if __name__ == "__main__":
+    main()
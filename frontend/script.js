@@ -3,6 +3,8 @@
 // ============================================================================
 
 const API_URL = 'http://localhost:8000/api/v1/agent';
+// Persistent WebSocket; falls back to POST /message when unavailable
+const WS_URL = API_URL.replace(/^http/, 'ws') + '/ws';
 
 // ============================================================================
 // STATE MANAGEMENT
@@ -10,6 +12,8 @@ const API_URL = 'http://localhost:8000/api/v1/agent';
 
 let sessionId = localStorage.getItem('session_id') || null;
 let isWaitingForResponse = false;
+let socket = null;
+let pendingTurn = null;  // { resolve, reject, streamed } of the in-flight WebSocket turn
 
 // ============================================================================
 // DOM ELEMENTS
@@ -32,6 +36,7 @@ const loadingSpinner = document.getElementById('loading');
 document.addEventListener('DOMContentLoaded', () => {
     updateSessionStatus();
     setupEventListeners();
+    connectSocket();
     
     // Show welcome message if no session
     if (!sessionId) {
@@ -67,6 +72,9 @@ function resetSession() {
     if (confirm('¿Seguro que quieres iniciar una nueva búsqueda?')) {
         sessionId = null;
         localStorage.removeItem('session_id');
+        // The socket is bound to the old session
+        if (socket) socket.close();
+        connectSocket();
         chatContainer.innerHTML = '';
         showWelcomeMessage();
         updateSessionStatus();
@@ -112,40 +120,11 @@ async function sendMessage() {
     showLoading(true);
     
     try {
-        const response = await fetch(`${API_URL}/message`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                session_id: sessionId,
-                message: message
-            })
-        });
-        
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
+        if (socket && socket.readyState === WebSocket.OPEN) {
+            await sendViaSocket(message);
+        } else {
+            await sendViaPost(message);
         }
-        
-        const data = await response.json();
-        
-        // Update session ID if new
-        if (data.session_id && data.session_id !== sessionId) {
-            sessionId = data.session_id;
-            localStorage.setItem('session_id', sessionId);
-            updateSessionStatus();
-        }
-        
-        // Add bot response to chat
-        addMessageToChat('bot', data.reply);
-        
-        // Check if properties are available
-        if (data.data && Array.isArray(data.data) && data.data.length > 0) {
-            setTimeout(() => {
-                displayProperties(data.data);
-            }, 500);
-        }
-        
     } catch (error) {
         console.error('Error sending message:', error);
         addMessageToChat('bot', 'Lo siento, hubo un error al procesar tu mensaje. Por favor, intenta de nuevo.');
@@ -158,6 +137,109 @@ async function sendMessage() {
     }
 }
 
+async function sendViaPost(message) {
+    const response = await fetch(`${API_URL}/message`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            session_id: sessionId,
+            message: message
+        })
+    });
+    
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    
+    const data = await response.json();
+    
+    setSessionId(data.session_id);
+    
+    // Add bot response to chat
+    addMessageToChat('bot', data.reply);
+    
+    // Check if properties are available
+    if (data.data && Array.isArray(data.data) && data.data.length > 0) {
+        setTimeout(() => {
+            displayProperties(data.data);
+        }, 500);
+    }
+}
+
+function setSessionId(newSessionId) {
+    // Update session ID if new
+    if (newSessionId && newSessionId !== sessionId) {
+        sessionId = newSessionId;
+        localStorage.setItem('session_id', sessionId);
+        updateSessionStatus();
+    }
+}
+
+// ============================================================================
+// STREAMING (WebSocket)
+// ============================================================================
+
+function connectSocket() {
+    if (!('WebSocket' in window)) return;
+    const url = sessionId ? `${WS_URL}?session_id=${encodeURIComponent(sessionId)}` : WS_URL;
+    const ws = new WebSocket(url);
+    ws.onmessage = (event) => handleStreamEvent(JSON.parse(event.data));
+    ws.onclose = () => {
+        if (socket === ws) socket = null;
+        if (pendingTurn) {
+            pendingTurn.reject(new Error('WebSocket closed'));
+            pendingTurn = null;
+        }
+    };
+    socket = ws;
+}
+
+function sendViaSocket(message) {
+    return new Promise((resolve, reject) => {
+        pendingTurn = { resolve, reject, streamed: 0 };
+        socket.send(JSON.stringify({ message }));
+    });
+}
+
+function handleStreamEvent({ event, data }) {
+    const turn = pendingTurn;
+    switch (event) {
+        case 'session':
+            setSessionId(data.session_id);
+            break;
+        case 'property':
+            // Show each row as soon as it arrives
+            if (turn && turn.streamed === 0) propertiesList.innerHTML = '';
+            if (turn) turn.streamed += 1;
+            propertiesList.insertAdjacentHTML('beforeend', createPropertyCard(data));
+            propertiesContainer.classList.remove('hidden');
+            break;
+        case 'question':
+        case 'reply':
+            showLoading(false);
+            addMessageToChat('bot', data.reply);
+            break;
+        case 'done':
+            if (turn) {
+                pendingTurn = null;
+                turn.resolve(data);
+            }
+            break;
+        case 'error':
+            if (turn) {
+                pendingTurn = null;
+                turn.reject(new Error(data.detail || `status ${data.status}`));
+            }
+            break;
+    }
+}
+
+// ============================================================================
+// UI HELPERS
+// ============================================================================
+
 function addMessageToChat(sender, text) {
     const messageDiv = document.createElement('div');
     messageDiv.className = `message ${sender}`;
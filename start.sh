@@ -5,5 +5,7 @@
 set -e
 
 PORT=${PORT:-8000}
-exec uvicorn app.main:app --host 0.0.0.0 --port ${PORT} --proxy-headers
+# More than one worker needs a shared session store (SESSION_BACKEND=sqlite)
+WORKERS=${WEB_CONCURRENCY:-1}
+exec uvicorn app.main:app --host 0.0.0.0 --port ${PORT} --workers ${WORKERS} --proxy-headers
 #uwu
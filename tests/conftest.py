@@ -0,0 +1,4 @@
+import os
+
+# Settings require a key; tests never reach OpenAI
+os.environ.setdefault("OPENAI_API_KEY", "test")
@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from app.services import admission
+
+
+async def _concurrent_turns(session_id: str) -> list[str]:
+    events: list[str] = []
+
+    async def turn(name: str) -> None:
+        async with admission.admit(session_id):
+            events.append(f"{name}:start")
+            await asyncio.sleep(0.01)
+            events.append(f"{name}:end")
+
+    await asyncio.gather(turn("a"), turn("b"))
+    return events
+
+
+@pytest.mark.parametrize("enabled", [True, False])
+def test_turns_of_a_session_are_serialized(monkeypatch, enabled):
+    monkeypatch.setattr(admission.settings, "admission_enabled", enabled)
+
+    events = asyncio.run(_concurrent_turns("s1"))
+
+    assert events == ["a:start", "a:end", "b:start", "b:end"]
+    assert "s1" not in admission._SESSION_LOCKS
+
+
+def test_disabled_admission_never_sheds(monkeypatch):
+    monkeypatch.setattr(admission.settings, "admission_enabled", False)
+    monkeypatch.setattr(admission.settings, "admission_session_max_pending", 1)
+
+    events = asyncio.run(_concurrent_turns("s2"))
+
+    assert len(events) == 4
@@ -0,0 +1,91 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.v1 import agent_router
+from app.services import agent_service, pagination, session_manager
+from app.services import db as db_service
+from app.services.session_backends import MemorySessionBackend
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def parse_filters(message, known_filters, pending=None):
+        # Never enough to search: every turn ends with a question
+        return {}
+
+    monkeypatch.setattr(agent_service.parser, "parse_filters", parse_filters)
+    session_manager.set_backend(MemorySessionBackend(ttl_seconds=3600, max_count=100, max_bytes=10**8))
+    app = FastAPI()
+    app.include_router(agent_router.router, prefix="/api/v1/agent")
+    with TestClient(app) as client:
+        yield client
+
+
+def _turn(ws, message: str) -> list[dict]:
+    ws.send_json({"message": message})
+    events = []
+    while not events or events[-1]["event"] not in ("done", "error"):
+        events.append(ws.receive_json())
+    return events
+
+
+def test_malformed_frame_keeps_the_socket_open(client):
+    with client.websocket_connect("/api/v1/agent/ws") as ws:
+        ws.send_text("{no es json")
+        assert ws.receive_json() == {"event": "error", "data": {"status": 400, "detail": "JSON inválido"}}
+        ws.send_json({"mensaje": "hola"})
+        assert ws.receive_json()["data"]["detail"] == "Mensaje vacío"
+        assert _turn(ws, "hola")[-1]["event"] == "done"
+
+
+def test_binary_frame_gets_an_error_event(client):
+    with client.websocket_connect("/api/v1/agent/ws") as ws:
+        ws.send_bytes(b'{"message": "hola"}')
+        assert ws.receive_json()["data"] == {"status": 400, "detail": "Se esperaba un mensaje de texto"}
+        assert _turn(ws, "hola")[-1]["event"] == "done"
+
+
+def test_bound_state_of_a_reset_session_is_not_written_back(client):
+    with client.websocket_connect("/api/v1/agent/ws") as ws:
+        session_id = _turn(ws, "hola")[-1]["data"]["session_id"]
+        # Reset from another request while the socket holds the old state
+        session_manager.reset_session(session_id)
+        assert _turn(ws, "busco depa")[-1]["data"]["status"] == 409
+        assert session_manager.load_conversation_state(session_id).messages == []
+        # The next turn reloads the state from the store
+        assert _turn(ws, "busco depa")[-1]["event"] == "done"
+        assert len(session_manager.load_conversation_state(session_id).messages) == 2
+
+
+def test_idle_bound_state_is_reloaded(client, monkeypatch):
+    with client.websocket_connect("/api/v1/agent/ws") as ws:
+        session_id = _turn(ws, "hola")[-1]["data"]["session_id"]
+        session_manager.reset_session(session_id)
+        later = time.monotonic() + agent_router.settings.session_ttl_seconds + 1
+        monkeypatch.setattr(agent_router, "time", SimpleNamespace(monotonic=lambda: later))
+        # Idle past the TTL: the turn goes to the store instead of the bound state
+        assert _turn(ws, "busco depa")[-1]["event"] == "done"
+        assert len(session_manager.load_conversation_state(session_id).messages) == 2
+
+
+def test_cut_short_export_ends_with_a_resume_cursor(client, monkeypatch):
+    filters = {"distrito": "Miraflores"}
+    session_id = session_manager.create_session()
+    session_manager.load_conversation_state(session_id).collected_filters.update(filters)
+    session_manager.save_query_result(session_id, "SELECT", [])
+
+    async def stream(sql, *params):
+        for i in range(2):
+            yield {"id": i, "valor_comercial": 1000 - i}
+        raise db_service.StreamAborted("row limit reached")
+
+    monkeypatch.setattr(db_service, "stream", stream)
+    lines = [json.loads(line) for line in client.get(f"/api/v1/agent/properties/{session_id}/export").text.splitlines()]
+    assert [line.get("id") for line in lines[:2]] == [0, 1]
+    assert lines[2]["error"]
+    assert pagination.decode_cursor(lines[2]["next_cursor"], filters) == (999, 1)
@@ -0,0 +1,158 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.v1 import agent_router
+from app.services import batch_extraction, llm_client
+
+DISTRICTS = ["Barranco", "Lince", "Surco", "Callao", "Breña", "Rímac"]
+
+
+class FakeLLM:
+    """Batch and single extraction stubs answering `distrito` per text."""
+
+    def __init__(self) -> None:
+        self.batches: list[list[str]] = []
+        self.singles: list[str] = []
+        self.fail_batches = False
+        self.skip: set[str] = set()
+        self.fail_singles: set[str] = set()
+        self.running = 0
+        self.max_running = 0
+
+    async def _call(self) -> None:
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.001)
+        self.running -= 1
+
+    async def request_batch_extraction(self, texts):
+        self.batches.append(list(texts))
+        await self._call()
+        if self.fail_batches:
+            raise ValueError("cut-off answer")
+        return [None if text in self.skip else {"distrito": text.split()[-1]} for text in texts]
+
+    async def extract_filters_from_text(self, text, pending=None):
+        self.singles.append(text)
+        await self._call()
+        if text in self.fail_singles:
+            raise TimeoutError
+        return {"distrito": text.split()[-1]}
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    fake = FakeLLM()
+    monkeypatch.setattr(llm_client, "request_batch_extraction", fake.request_batch_extraction)
+    monkeypatch.setattr(llm_client, "extract_filters_from_text", fake.extract_filters_from_text)
+    monkeypatch.setattr(batch_extraction.settings, "fast_path_enabled", True)
+    monkeypatch.setattr(batch_extraction.settings, "llm_cache_enabled", False)
+    monkeypatch.setattr(batch_extraction.settings, "llm_batch_max_items", 3)
+    monkeypatch.setattr(batch_extraction.settings, "llm_batch_max_prompt_tokens", 2000)
+    monkeypatch.setattr(batch_extraction.settings, "llm_batch_concurrency", 2)
+    return fake
+
+
+def _texts(n: int) -> list[str]:
+    # Not confident for the rules: every one needs the LLM
+    return [f"algo cerca del mar en {DISTRICTS[i % len(DISTRICTS)]}" for i in range(n)]
+
+
+def test_results_come_back_in_input_order(llm):
+    texts = ["", "San Isidro", *_texts(7), "ALGO cerca del mar en Barranco"]
+    results = asyncio.run(batch_extraction.extract_all(texts))
+
+    assert [r["index"] for r in results] == list(range(len(texts)))
+    assert [r["source"] for r in results] == ["empty", "rules"] + ["batch"] * 8
+    assert results[0]["filters"] == {}
+    assert results[1]["filters"] == {"distrito": "San Isidro"}
+    assert [r["filters"]["distrito"] for r in results[2:]] == DISTRICTS + ["Barranco", "Barranco"]
+    # Repeated texts (the 7th, and the last up to case) are extracted once; groups of at most 3
+    assert [len(batch) for batch in llm.batches] == [3, 3]
+    assert llm.singles == []
+    assert llm.max_running <= 2
+
+
+def test_groups_respect_the_token_budget(monkeypatch):
+    monkeypatch.setattr(batch_extraction.settings, "llm_batch_max_items", 10)
+    budget = 3 * batch_extraction.estimate_tokens("x" * 40)
+    monkeypatch.setattr(batch_extraction.settings, "llm_batch_max_prompt_tokens", budget)
+    items = [(str(i), "x" * 40) for i in range(4)] + [("long", "x" * 4000), ("5", "x" * 40)]
+
+    groups = [[key for key, _ in group] for group in batch_extraction._groups(items)]
+    # An oversized text still goes, alone
+    assert groups == [["0", "1", "2"], ["3"], ["long"], ["5"]]
+
+
+def test_uncovered_items_are_retried_alone(llm):
+    texts = _texts(3)
+    llm.skip = {texts[1]}
+    results = asyncio.run(batch_extraction.extract_all(texts))
+
+    assert [r["source"] for r in results] == ["batch", "llm", "batch"]
+    assert llm.singles == [texts[1]]
+    assert results[1]["filters"] == {"distrito": "Lince"}
+
+
+def test_failed_batches_are_retried_one_at_a_time(llm, monkeypatch):
+    monkeypatch.setattr(batch_extraction.settings, "llm_batch_concurrency", 1)
+    texts = _texts(3)
+    llm.fail_batches = True
+    llm.fail_singles = {texts[2]}
+    results = asyncio.run(batch_extraction.extract_all(texts))
+
+    assert [r["source"] for r in results] == ["llm"] * 3
+    assert results[2] == {"index": 2, "filters": None, "source": "llm", "error": "TimeoutError"}
+    assert llm.singles == texts
+    # Retries never fan out into concurrent calls
+    assert llm.max_running == 1
+
+
+def test_leaving_early_cancels_the_remaining_groups(llm, monkeypatch):
+    monkeypatch.setattr(batch_extraction.settings, "llm_batch_max_items", 2)
+    monkeypatch.setattr(batch_extraction.settings, "llm_batch_concurrency", 1)
+
+    async def run():
+        results = batch_extraction.extract_many(_texts(6))
+        first = await results.__anext__()
+        await results.aclose()
+        await asyncio.sleep(0.01)
+        return first
+
+    assert asyncio.run(run())["index"] == 0
+    assert len(llm.batches) == 1
+
+
+def test_batch_answer_items_are_matched_by_id(monkeypatch):
+    content = json.dumps({"resultados": [
+        {"id": 2, "filtros": {"distrito": "Lince", "dormitorios": None}},
+        {"id": 0, "filtros": {"distrito": "Surco"}},
+        {"id": 7, "filtros": {"distrito": "Callao"}},
+        {"id": 1, "filtros": "no"},
+    ]})
+
+    async def complete(messages, **kwargs):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    monkeypatch.setattr(llm_client, "_complete", complete)
+    answers = asyncio.run(llm_client.request_batch_extraction(["a", "b", "c"]))
+    assert answers == [{"distrito": "Surco"}, None, {"distrito": "Lince"}]
+
+
+def test_batch_route_streams_ndjson(llm, monkeypatch):
+    app = FastAPI()
+    app.include_router(agent_router.router, prefix="/api/v1/agent")
+    client = TestClient(app)
+
+    response = client.post("/api/v1/agent/extract:batch", json={"texts": _texts(4)})
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["filters"]["distrito"] for line in lines] == DISTRICTS[:4]
+
+    monkeypatch.setattr(agent_router.settings, "llm_batch_max_texts", 3)
+    assert client.post("/api/v1/agent/extract:batch", json={"texts": _texts(4)}).status_code == 413
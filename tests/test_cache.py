@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from app.utils import cache
+from app.utils.cache import TTLCache
+
+
+class Loader:
+    def __init__(self, value="v", error: Exception | None = None, delay: float = 0.02) -> None:
+        self.value = value
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = False
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def test_concurrent_misses_share_one_load():
+    ttl = TTLCache()
+    loader = Loader()
+
+    async def run():
+        return await asyncio.gather(*(ttl.get_or_load("k", loader) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["v"] * 5
+    assert loader.calls == 1
+    assert (ttl.misses, ttl.coalesced, ttl.get("k")) == (1, 4, "v")
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    ttl = TTLCache()
+    loader = Loader()
+
+    async def run():
+        leader = asyncio.create_task(ttl.get_or_load("k", loader))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(ttl.get_or_load("k", loader))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == "v"
+    assert loader.calls == 1
+    assert not loader.cancelled
+    assert ttl.get("k") == "v"
+
+
+def test_load_is_cancelled_when_every_caller_is_gone():
+    ttl = TTLCache()
+    loader = Loader()
+
+    async def run():
+        callers = [asyncio.create_task(ttl.get_or_load("k", loader)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert loader.cancelled
+    assert ttl.stats()["inflight"] == 0
+    assert ttl.get("k") is None
+
+
+def test_loader_errors_reach_every_caller_and_are_not_cached():
+    ttl = TTLCache()
+    failing = Loader(error=RuntimeError("db down"))
+
+    async def run():
+        return await asyncio.gather(*(ttl.get_or_load("k", failing) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert [type(r) for r in results] == [RuntimeError] * 3
+    assert failing.calls == 1
+    assert ttl.stats()["inflight"] == 0
+
+    assert asyncio.run(ttl.get_or_load("k", Loader("ok"))) == "ok"
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    ttl = TTLCache(ttl_seconds=10)
+    loader = Loader(delay=0)
+
+    asyncio.run(ttl.get_or_load("k", loader))
+    now[0] += 9.9
+    asyncio.run(ttl.get_or_load("k", loader))
+    assert loader.calls == 1
+
+    now[0] += 0.2
+    asyncio.run(ttl.get_or_load("k", loader))
+    assert loader.calls == 2
+    assert ttl.expirations == 1
+
+
+def test_load_started_before_clear_is_not_stored():
+    ttl = TTLCache()
+
+    async def run():
+        pending = asyncio.create_task(ttl.get_or_load("k", Loader("old")))
+        await asyncio.sleep(0)
+        ttl.clear()
+        return await pending
+
+    assert asyncio.run(run()) == "old"
+    assert ttl.get("k") is None
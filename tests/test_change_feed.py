@@ -0,0 +1,232 @@
+import asyncio
+import json
+import os
+import threading
+import uuid
+from decimal import Decimal
+
+import pytest
+
+from app.services import change_feed
+from app.services import db as db_service
+from app.services import property_index
+from app.services import topk_cube
+
+
+class RecordingFetch:
+    def __init__(self, rows=None) -> None:
+        self.rows = rows or []
+        self.primary: list[bool] = []
+        self.on_call = None
+
+    async def __call__(self, sql, *params, primary=False):
+        self.primary.append(primary)
+        if self.on_call is not None:
+            self.on_call()
+        return [dict(row) for row in self.rows]
+
+
+@pytest.fixture
+def recording_fetch(monkeypatch):
+    fetch = RecordingFetch()
+    monkeypatch.setattr(db_service, "fetch", fetch)
+    return fetch
+
+
+def test_resync_reloads_the_property_index_from_the_primary(recording_fetch, monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(property_index, "_SNAPSHOT", None)
+    monkeypatch.setattr(property_index, "_ROWS_BY_ID", {})
+    asyncio.run(property_index.load_full())
+    assert recording_fetch.primary == [False]
+
+    async def run():
+        change_feed._on_resync()
+        await asyncio.gather(*change_feed._TASKS)
+
+    asyncio.run(run())
+    assert recording_fetch.primary == [False, True]
+
+
+def test_load_overlapping_a_change_is_retried_on_the_primary(recording_fetch, monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(property_index, "_SNAPSHOT", None)
+    monkeypatch.setattr(property_index, "_ROWS_BY_ID", {})
+    calls = iter([property_index.mark_changed])
+    recording_fetch.on_call = lambda: next(calls, lambda: None)()
+
+    asyncio.run(property_index.load_full())
+    assert recording_fetch.primary == [False, True]
+
+
+def test_cube_rebuilds_after_a_change_read_the_primary(recording_fetch, monkeypatch):
+    monkeypatch.setattr(topk_cube, "_CHANGED_KEYS", set())
+    key = ("Miraflores", "DISPONIBLE", 2)
+
+    asyncio.run(topk_cube.build(key))
+    # A change arrives while the next build is in flight: dropped, rebuilt from the primary
+    recording_fetch.on_call = topk_cube.mark_changed
+    asyncio.run(topk_cube.build(key))
+    recording_fetch.on_call = None
+    asyncio.run(topk_cube.build(key))
+    asyncio.run(topk_cube.build(key))
+    assert recording_fetch.primary == [False, False, True, False]
+
+    # Buckets dropped on resync are rebuilt from the primary as well
+    topk_cube.clear()
+    asyncio.run(topk_cube.build(key))
+    assert recording_fetch.primary[-1] is True
+    topk_cube.clear()
+
+
+def _index_row(id_: int, valor: int) -> dict:
+    return {"id": id_, "edificio_distrito": "Miraflores", "estado": "DISPONIBLE", "area": Decimal(90),
+            "dormitorios": 2, "valor_comercial": Decimal(valor)}
+
+
+def test_changes_are_patched_into_the_index_off_the_event_loop(recording_fetch, monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(property_index, "_SNAPSHOT", None)
+    monkeypatch.setattr(property_index, "_ROWS_BY_ID", {})
+    recording_fetch.rows = [_index_row(1, 100), _index_row(2, 200)]
+    asyncio.run(property_index.load_full())
+
+    built_on = []
+
+    class Snapshot(property_index._Snapshot):
+        def __init__(self, rows):
+            built_on.append(threading.get_ident())
+            super().__init__(rows)
+
+    monkeypatch.setattr(property_index, "_Snapshot", Snapshot)
+    # Row 1 changed price, row 2 is gone
+    recording_fetch.rows = [_index_row(1, 300)]
+    asyncio.run(change_feed._apply([{"t": "propiedad", "op": "U", "id": 1}, {"t": "propiedad", "op": "D", "id": 2}]))
+
+    assert [(row["id"], row["valor_comercial"]) for row in property_index.search({})] == [(1, 300)]
+    assert built_on and threading.get_ident() not in built_on
+
+
+# --- Against Postgres (TEST_DATABASE_URL): triggers, LISTEN and re-reads ---
+
+needs_postgres = pytest.mark.skipif(not os.environ.get("TEST_DATABASE_URL"), reason="TEST_DATABASE_URL not set")
+
+# Same tables as the parity test of test_property_index (which needs NumPy)
+_DDL = """
+CREATE SCHEMA {schema};
+CREATE TABLE {schema}.edificio (
+    id integer PRIMARY KEY, nombre text, direccion text, distrito text
+);
+CREATE TABLE {schema}.propiedad (
+    id integer PRIMARY KEY, edificio_id integer REFERENCES {schema}.edificio (id),
+    numero text, piso integer, tipo text, area numeric(10, 2), dormitorios integer,
+    banios integer, balcon boolean, terraza boolean, amoblado boolean,
+    permite_mascotas boolean, valor_comercial numeric(15, 2),
+    mantenimiento_mensual numeric(10, 2), estado text
+);
+"""
+
+
+def _in_schema(sql: str, schema: str) -> str:
+    return sql.replace("property_infrastructure.", f"{schema}.")
+
+
+@pytest.fixture
+def pg_schema():
+    """Throwaway copy of the tables with the change triggers installed."""
+    asyncpg = pytest.importorskip("asyncpg")
+    schema = f"feed_{uuid.uuid4().hex[:8]}"
+    channel = f"{schema}_changes"
+
+    async def run(sql: str) -> None:
+        conn = await asyncpg.connect(os.environ["TEST_DATABASE_URL"])
+        try:
+            await conn.execute(sql)
+        finally:
+            await conn.close()
+
+    asyncio.run(run(_DDL.format(schema=schema) + _in_schema(change_feed.trigger_ddl(channel), schema)))
+    yield schema, channel
+    asyncio.run(run(f"DROP SCHEMA {schema} CASCADE;"))
+
+
+async def _listen(channel: str) -> tuple:
+    """A connection LISTENing on `channel` and the queue of decoded payloads."""
+    import asyncpg
+
+    received: asyncio.Queue = asyncio.Queue()
+    conn = await asyncpg.connect(os.environ["TEST_DATABASE_URL"])
+    await conn.add_listener(channel, lambda *args: received.put_nowait(json.loads(args[-1])))
+    return conn, received
+
+
+async def _drain(received: asyncio.Queue, count: int) -> list[dict]:
+    return [await asyncio.wait_for(received.get(), 5) for _ in range(count)]
+
+
+_INSERT_PROPIEDAD = (
+    "INSERT INTO {schema}.propiedad (id, edificio_id, numero, area, dormitorios, valor_comercial, estado) "
+    "VALUES ($1, 1, $2, 90, 2, $3, 'DISPONIBLE')"
+)
+
+
+@needs_postgres
+def test_triggers_notify_every_row_change(pg_schema):
+    import asyncpg
+
+    schema, channel = pg_schema
+
+    async def run() -> list[dict]:
+        listener, received = await _listen(channel)
+        conn = await asyncpg.connect(os.environ["TEST_DATABASE_URL"])
+        try:
+            await conn.execute(f"INSERT INTO {schema}.edificio VALUES (1, 'Torre', 'Av. Larco 1', 'Miraflores')")
+            await conn.execute(_INSERT_PROPIEDAD.format(schema=schema), 10, "101", Decimal(100))
+            await conn.execute(f"UPDATE {schema}.propiedad SET valor_comercial = 90 WHERE id = 10")
+            await conn.execute(f"DELETE FROM {schema}.propiedad WHERE id = 10")
+            return await _drain(received, 4)
+        finally:
+            await conn.close()
+            await listener.close()
+
+    assert asyncio.run(run()) == [
+        {"t": "edificio", "op": "I", "id": 1},
+        {"t": "propiedad", "op": "I", "id": 10},
+        {"t": "propiedad", "op": "U", "id": 10},
+        {"t": "propiedad", "op": "D", "id": 10},
+    ]
+
+
+@needs_postgres
+def test_notified_changes_are_applied_to_the_index(pg_schema, monkeypatch):
+    pytest.importorskip("numpy")
+    import asyncpg
+
+    schema, channel = pg_schema
+    monkeypatch.setattr(property_index, "_SNAPSHOT", None)
+    monkeypatch.setattr(property_index, "_ROWS_BY_ID", {})
+
+    async def run() -> list[tuple]:
+        conn = await asyncpg.connect(os.environ["TEST_DATABASE_URL"])
+
+        async def fetch(sql, *params, primary=False):
+            return [dict(record) for record in await conn.fetch(_in_schema(sql, schema), *params)]
+
+        monkeypatch.setattr(db_service, "fetch", fetch)
+        listener, received = await _listen(channel)
+        try:
+            await conn.execute(f"INSERT INTO {schema}.edificio VALUES (1, 'Torre', 'Av. Larco 1', 'Miraflores')")
+            for id_, valor in ((10, 100), (11, 200)):
+                await conn.execute(_INSERT_PROPIEDAD.format(schema=schema), id_, str(id_), Decimal(valor))
+            await _drain(received, 3)
+            await property_index.load_full()
+
+            await conn.execute(f"UPDATE {schema}.propiedad SET valor_comercial = 300 WHERE id = 10")
+            await conn.execute(f"DELETE FROM {schema}.propiedad WHERE id = 11")
+            await change_feed._apply(await _drain(received, 2))
+            return [(row["id"], row["valor_comercial"]) for row in property_index.search({})]
+        finally:
+            await listener.close()
+            await conn.close()
+
+    assert asyncio.run(run()) == [(10, Decimal(300))]
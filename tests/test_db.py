@@ -0,0 +1,268 @@
+import asyncio
+import contextlib
+import json
+
+import pytest
+
+from app.services import db
+from app.services.result_set import ResultSet
+
+
+class CountingFetch:
+    def __init__(self) -> None:
+        self.calls: list[tuple] = []
+        self.version = 0
+
+    async def __call__(self, sql, *params, primary=False):
+        self.calls.append((sql, params))
+        await asyncio.sleep(0.01)
+        return [{"id": 1, "version": self.version}]
+
+
+@pytest.fixture
+def counting_fetch(monkeypatch):
+    fetch = CountingFetch()
+    monkeypatch.setattr(db, "fetch", fetch)
+
+    async def fetch_result(sql, *params):
+        return ResultSet.from_dicts(await fetch(sql, *params))
+
+    monkeypatch.setattr(db, "fetch_result", fetch_result)
+    monkeypatch.setattr(db.settings, "db_result_cache_enabled", True)
+    db.clear_result_cache()
+    yield fetch
+    db.clear_result_cache()
+
+
+def test_identical_concurrent_searches_run_one_query(counting_fetch):
+    async def run():
+        return await asyncio.gather(
+            *(db.fetch_shared("SELECT $1", 1) for _ in range(5)),
+            *(db.fetch_result_shared("SELECT $1", 1) for _ in range(5)),
+            db.fetch_shared("SELECT $1", 2),
+        )
+
+    results = asyncio.run(run())
+
+    assert sorted(counting_fetch.calls) == [("SELECT $1", (1,)), ("SELECT $1", (1,)), ("SELECT $1", (2,))]
+    assert results[0] == [{"id": 1, "version": 0}]
+    # Rows are copied out; callers cannot corrupt the cached copy
+    results[0][0]["id"] = 99
+    assert asyncio.run(db.fetch_shared("SELECT $1", 1)) == [{"id": 1, "version": 0}]
+    assert len(counting_fetch.calls) == 3
+
+
+def test_aborted_client_does_not_fail_identical_searches(counting_fetch):
+    async def run():
+        first = asyncio.create_task(db.fetch_shared("SELECT $1", 1))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(db.fetch_shared("SELECT $1", 1))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == [{"id": 1, "version": 0}]
+    assert len(counting_fetch.calls) == 1
+
+
+def test_change_notification_drops_cached_results(counting_fetch, monkeypatch):
+    # Only the result cache's own listener; the others patch caches over the DB
+    monkeypatch.setattr(db, "_CHANGE_LISTENERS", db._CHANGE_LISTENERS[:1])
+    monkeypatch.setattr(db.settings, "db_change_debounce_seconds", 0)
+
+    async def run():
+        assert (await db.fetch_shared("SELECT 1"))[0]["version"] == 0
+        counting_fetch.version = 1
+        assert (await db.fetch_shared("SELECT 1"))[0]["version"] == 0
+        db._on_notify(None, 0, "property_changes", json.dumps({"t": "propiedad", "op": "U", "id": 1}))
+        await asyncio.sleep(0.01)
+        return await db.fetch_shared("SELECT 1")
+
+    assert asyncio.run(run())[0]["version"] == 1
+    assert len(counting_fetch.calls) == 2
+
+
+class FakeConn:
+    def __init__(self, pool: "FakePool") -> None:
+        self.pool = pool
+
+    async def fetch(self, sql, *params):
+        self.pool.queries += 1
+        if self.pool.down:
+            raise ConnectionResetError("connection reset")
+        await self.pool.release.wait()
+        return [{"node": self.pool.name}]
+
+    async def fetchval(self, sql, timeout=None):
+        if self.pool.down:
+            raise ConnectionResetError("connection reset")
+        return 1
+
+    def transaction(self, readonly=False):
+        return contextlib.nullcontext()
+
+    async def cursor(self, sql, *params, prefetch=None):
+        for i in range(self.pool.rows):
+            await asyncio.sleep(self.pool.row_delay)
+            yield {"id": i}
+
+
+class FakePool:
+    def __init__(self, name: str, down: bool = False) -> None:
+        self.name = name
+        self.down = down
+        self.queries = 0
+        self.release = asyncio.Event()
+        self.release.set()
+        self.rows = 0
+        self.row_delay = 0.0
+        self.in_use = 0
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, timeout=None):
+        self.in_use += 1
+        try:
+            yield FakeConn(self)
+        finally:
+            self.in_use -= 1
+
+    def get_size(self) -> int:
+        return 1
+
+    def get_idle_size(self) -> int:
+        return 1
+
+
+@pytest.fixture
+def nodes(monkeypatch):
+    built = []
+    for name, role in (("primary", "primary"), ("replica-0", "replica"), ("replica-1", "replica")):
+        node = db._Node(name, f"postgresql://{name}", role)
+        node.pool = FakePool(name)
+        built.append(node)
+    monkeypatch.setattr(db, "_NODES", built)
+    monkeypatch.setattr(db.settings, "db_eject_after_failures", 2)
+    monkeypatch.setattr(db.settings, "db_readmit_after_successes", 2)
+    return {node.name: node for node in built}
+
+
+def test_reads_go_to_the_least_outstanding_replica(nodes):
+    for node in nodes.values():
+        node.pool.release.clear()
+
+    async def run():
+        queries = [asyncio.create_task(db.fetch("SELECT 1")) for _ in range(4)]
+        await asyncio.sleep(0.01)
+        outstanding = {name: node.outstanding for name, node in nodes.items()}
+        for node in nodes.values():
+            node.pool.release.set()
+        await asyncio.gather(*queries)
+        return outstanding
+
+    assert asyncio.run(run()) == {"primary": 0, "replica-0": 2, "replica-1": 2}
+    assert db._pick(primary=True) is nodes["primary"]
+
+
+def test_failing_replica_is_ejected_and_readmitted(nodes):
+    replica = nodes["replica-0"]
+    replica.pool.down = True
+
+    for _ in range(2):
+        # The tie goes to replica-0; each read fails there and is retried on replica-1
+        assert asyncio.run(db.fetch("SELECT 1")) == [{"node": "replica-1"}]
+    asyncio.run(db._check(replica))
+    assert not replica.healthy
+    assert replica.stats["ejections"] == 1
+    assert all(db._pick() is nodes["replica-1"] for _ in range(3))
+
+    replica.pool.down = False
+    asyncio.run(db._check(replica))
+    assert not replica.healthy
+    asyncio.run(db._check(replica))
+    assert replica.healthy
+    assert replica.stats["readmissions"] == 1
+
+
+def test_connection_errors_are_retried_once_on_another_node(nodes):
+    nodes["replica-0"].pool.down = True
+    nodes["replica-1"].latency = 1.0
+
+    assert asyncio.run(db.fetch("SELECT 1")) == [{"node": "replica-1"}]
+    assert (nodes["replica-0"].pool.queries, nodes["replica-1"].pool.queries) == (1, 1)
+
+    # No second retry: both attempts failing surfaces the error
+    nodes["replica-1"].pool.down = True
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(db.fetch("SELECT 1"))
+    assert nodes["primary"].pool.queries == 0
+
+
+def test_primary_reads_are_not_retried_elsewhere(nodes):
+    nodes["primary"].pool.down = True
+
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(db.fetch("SELECT 1", primary=True))
+    assert nodes["replica-0"].pool.queries + nodes["replica-1"].pool.queries == 0
+
+
+@pytest.fixture
+def export_pool(nodes, monkeypatch):
+    pool = nodes["replica-0"].pool
+    nodes["replica-1"].pool.down = True
+    nodes["replica-1"].healthy = False
+    pool.rows = 10
+    monkeypatch.setattr(db.settings, "properties_export_prefetch", 2)
+    monkeypatch.setattr(db.settings, "properties_export_max_rows", 100)
+    monkeypatch.setattr(db.settings, "properties_export_max_seconds", 5.0)
+    monkeypatch.setattr(db.settings, "properties_export_stall_seconds", 5.0)
+    return pool
+
+
+async def _drain(rows) -> list[dict]:
+    return [row async for row in rows]
+
+
+def test_stream_yields_every_row_and_releases_the_connection(export_pool):
+    assert asyncio.run(_drain(db.stream("SELECT"))) == [{"id": i} for i in range(10)]
+    assert export_pool.in_use == 0
+
+
+def test_stream_stops_at_the_row_cap(export_pool, monkeypatch):
+    monkeypatch.setattr(db.settings, "properties_export_max_rows", 4)
+
+    async def run():
+        seen = []
+        with pytest.raises(db.StreamAborted):
+            async for row in db.stream("SELECT"):
+                seen.append(row["id"])
+        return seen
+
+    assert asyncio.run(run()) == [0, 1, 2, 3]
+    assert export_pool.in_use == 0
+
+
+def test_stream_stops_at_the_deadline(export_pool, monkeypatch):
+    export_pool.row_delay = 0.02
+    monkeypatch.setattr(db.settings, "properties_export_max_seconds", 0.05)
+
+    with pytest.raises(db.StreamAborted):
+        asyncio.run(_drain(db.stream("SELECT")))
+    assert export_pool.in_use == 0
+
+
+def test_stalled_consumer_releases_the_connection(export_pool, monkeypatch):
+    monkeypatch.setattr(db.settings, "properties_export_stall_seconds", 0.05)
+
+    async def run():
+        rows = db.stream("SELECT")
+        assert await anext(rows) == {"id": 0}
+        await asyncio.sleep(0.01)
+        held = export_pool.in_use
+        # The client stops reading with the buffer full
+        await asyncio.sleep(0.2)
+        released = export_pool.in_use
+        with pytest.raises(db.StreamAborted):
+            await anext(rows)
+        return held, released
+
+    assert asyncio.run(run()) == (1, 0)
@@ -0,0 +1,146 @@
+import asyncio
+import re
+from decimal import Decimal
+
+import pytest
+
+from app.services import agent_service, filter_algebra, property_index, query_builder, search_service
+from app.services import db as db_service
+
+
+def _row(id_, distrito, dormitorios, area, valor, estado="DISPONIBLE", balcon=None):
+    return {"id": id_, "edificio_distrito": distrito, "dormitorios": dormitorios, "area": Decimal(area),
+            "valor_comercial": Decimal(valor), "estado": estado, "balcon": balcon, "banios": 1,
+            "terraza": None, "amoblado": None, "permite_mascotas": None}
+
+
+ROWS = [
+    _row(1, "Miraflores", 2, 90, 300000),
+    _row(2, "Miraflores", 3, 120, 450000, balcon=True),
+    _row(3, "Lince", 2, 85, 250000),
+    _row(4, "Lince", 1, 60, 180000, estado="OCUPADA"),
+    _row(5, "Surco", 2, 100, 320000, balcon=False),
+    _row(6, None, 2, 95, 200000),
+    _row(7, "Surco", None, 150, 600000),
+]
+
+CASES = [
+    {},
+    {"distrito": "Barranco", "dormitorios": 2},
+    {"distrito": "Miraflores", "dormitorios": 4, "presupuesto_max": 500000},
+    {"distrito": "Lince", "area_min": 80, "estado": "DISPONIBLE", "balcon": True},
+]
+
+
+def _reference(filters: dict) -> dict:
+    """Facet counts by brute force, with the SQL semantics of filter_algebra."""
+    active = query_builder.active_filters(filters)
+
+    def matching(skip=None):
+        kept = {k: v for k, v in active.items() if k != skip}
+        return [row for row in ROWS if filter_algebra.row_matches(row, kept)]
+
+    def per_value(key, column):
+        counts: dict = {}
+        for row in matching(key):
+            if row[column] is not None:
+                counts[row[column]] = counts.get(row[column], 0) + 1
+        return counts
+
+    return {
+        "matches": len(matching()),
+        "without": {key: len(matching(key)) for key in active},
+        "distrito": per_value("distrito", "edificio_distrito"),
+        "dormitorios": per_value("dormitorios", "dormitorios"),
+    }
+
+
+def _grouping_sets(filters: dict) -> list[dict]:
+    """What the facet statement returns for ROWS: one row per group of each set."""
+    dimensions = query_builder.FACET_DIMENSIONS
+    all_grouped = (1 << len(dimensions)) - 1
+    predicates = {key: value for key, value in query_builder.active_filters(filters).items()}
+
+    def aggregates(group: list[dict]) -> dict:
+        out = {"matches": sum(filter_algebra.row_matches(r, predicates) for r in group)}
+        for key in query_builder.FILTER_KEYS:
+            kept = {k: v for k, v in predicates.items() if k != key}
+            out[f"without_{key}"] = sum(filter_algebra.row_matches(r, kept) for r in group)
+        return out
+
+    result = [{"facet": all_grouped, **{alias: None for _, _, alias in dimensions}, **aggregates(ROWS)}]
+    for i, (_, _, alias) in enumerate(dimensions):
+        for value in {row[alias] for row in ROWS}:
+            group = [row for row in ROWS if row[alias] == value]
+            keys = {a: (value if a == alias else None) for _, _, a in dimensions}
+            result.append({"facet": all_grouped & ~(1 << (len(dimensions) - 1 - i)), **keys, **aggregates(group)})
+    return result
+
+
+def test_facet_statement_takes_the_search_parameters():
+    sql, params = query_builder.build_facet_query({"distrito": "Lince", "area_min": 80.5})
+
+    assert max(int(n) for n in re.findall(r"\$(\d+)", sql)) == len(query_builder.FILTER_KEYS)
+    assert dict(zip(query_builder.FILTER_KEYS, params)) == {
+        key: {"distrito": "Lince", "area_min": Decimal("80.5")}.get(key) for key in query_builder.FILTER_KEYS
+    }
+    assert "GROUPING SETS ((e.distrito), (p.dormitorios), ())" in sql
+    for key in query_builder.FILTER_KEYS:
+        assert f"AS without_{key}" in sql
+
+
+@pytest.mark.parametrize("filters", CASES)
+def test_sql_facets_are_folded_into_counts(monkeypatch, filters):
+    async def fetch_shared(sql, *params):
+        return _grouping_sets(filters)
+
+    monkeypatch.setattr(db_service, "fetch_shared", fetch_shared)
+    monkeypatch.setattr(property_index, "is_ready", lambda: False)
+    assert asyncio.run(search_service.facets(filters)) == _reference(filters)
+
+
+@pytest.mark.parametrize("filters", CASES)
+def test_index_facets_match_the_reference(monkeypatch, filters):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(property_index, "_SNAPSHOT", property_index._Snapshot([dict(row) for row in ROWS]))
+    assert property_index.facets(filters) == _reference(filters)
+
+
+def test_relaxations_prefer_cheap_changes_and_close_values():
+    filters = {"distrito": "Barranco", "dormitorios": 4, "presupuesto_max": 200000, "balcon": True}
+    facets = {
+        "matches": 0,
+        "without": {"distrito": 3, "dormitorios": 5, "presupuesto_max": 2, "balcon": 1},
+        "distrito": {"Lince": 1, "Surco": 3},
+        "dormitorios": {2: 4, 3: 1, 6: 2},
+    }
+
+    assert agent_service._suggest_relaxations(filters, facets) == [
+        {"field": "balcon", "value": None, "matches": 1},
+        # Closest bedroom count with matches
+        {"field": "dormitorios", "value": 3, "matches": 1},
+        {"field": "presupuesto_max", "value": None, "matches": 2},
+        # District with the most matches
+        {"field": "distrito", "value": "Surco", "matches": 3},
+    ]
+
+
+def test_relaxations_skip_filters_that_do_not_help():
+    filters = {"distrito": "Miraflores", "dormitorios": 4, "presupuesto_max": 500000}
+    assert agent_service._suggest_relaxations(filters, _reference(filters)) == [
+        {"field": "dormitorios", "value": 3, "matches": 1},
+    ]
+
+
+@pytest.mark.parametrize(
+    "suggestion, change",
+    [
+        ({"field": "distrito", "value": "Surco", "matches": 3}, "Buscando en Surco encontraría 3."),
+        ({"field": "dormitorios", "value": 3, "matches": 1}, "Con 3 dormitorios encontraría 1."),
+        ({"field": "area_min", "value": None, "matches": 2}, "Sin el filtro de área mínima encontraría 2."),
+    ],
+)
+def test_relaxation_reply(suggestion, change):
+    assert agent_service._relaxation_reply(suggestion) == (
+        f"Lo siento, no encontré propiedades con esos criterios. {change} ¿Quieres que ajuste la búsqueda?"
+    )
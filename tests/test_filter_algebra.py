@@ -0,0 +1,95 @@
+from decimal import Decimal
+
+import pytest
+
+from app.services import filter_algebra
+from app.services.filter_algebra import CandidateSet
+
+
+BASE = {"distrito": "Miraflores", "area_min": 80, "presupuesto_max": 300000}
+
+
+@pytest.mark.parametrize(
+    "base, new, expected",
+    [
+        # "=": only the same value narrows
+        (BASE, dict(BASE), True),
+        (BASE, {**BASE, "distrito": "Lince"}, False),
+        ({"balcon": True}, {"balcon": False}, False),
+        # ">=": a higher lower bound narrows, a lower one widens
+        (BASE, {**BASE, "area_min": 100}, True),
+        (BASE, {**BASE, "area_min": 60}, False),
+        # "<=": a lower upper bound narrows, a higher one widens
+        (BASE, {**BASE, "presupuesto_max": 250000}, True),
+        (BASE, {**BASE, "presupuesto_max": 300000.01}, False),
+        (BASE, {**BASE, "presupuesto_max": 299999.99}, True),
+        # Extra predicates only narrow; dropping one widens
+        (BASE, {**BASE, "dormitorios": 2, "pet_friendly": True}, True),
+        (BASE, {"distrito": "Miraflores", "area_min": 80}, False),
+        # None (and "" for text) means the filter is not set
+        ({**BASE, "dormitorios": None}, BASE, True),
+        (BASE, {**BASE, "area_min": None}, False),
+        ({"distrito": ""}, {"estado": "DISPONIBLE"}, True),
+        ({}, BASE, True),
+        # Keys that are not filters are ignored
+        (BASE, {**BASE, "orden": "precio"}, True),
+    ],
+)
+def test_is_refinement(base, new, expected):
+    assert filter_algebra.is_refinement(base, new) is expected
+
+
+@pytest.mark.parametrize(
+    "row, expected",
+    [
+        ({"edificio_distrito": "Miraflores", "area": 90, "valor_comercial": Decimal("300000")}, True),
+        ({"edificio_distrito": "Miraflores", "area": 79, "valor_comercial": Decimal("200000")}, False),
+        # A NULL column never matches, as in SQL
+        ({"edificio_distrito": "Miraflores", "area": None, "valor_comercial": Decimal("200000")}, False),
+        ({"edificio_distrito": "Miraflores", "valor_comercial": Decimal("200000")}, False),
+    ],
+)
+def test_row_matches(row, expected):
+    assert filter_algebra.row_matches(row, BASE) is expected
+
+
+def _row(i: int, distrito: str = "Miraflores", area: int = 90, **extra) -> dict:
+    return {"id": i, "edificio_distrito": distrito, "area": area, "valor_comercial": Decimal(1000 - i), **extra}
+
+
+def test_candidate_set_answers_refinements_in_result_order():
+    rows = [_row(1, area=120), _row(2, area=85), _row(3, area=150, dormitorios=2), _row(4, area=200, dormitorios=None)]
+    candidates = CandidateSet({"distrito": "Miraflores", "area_min": 80}, rows)
+
+    assert candidates.answers({"distrito": "Miraflores", "area_min": 100})
+    assert not candidates.answers({"distrito": "Miraflores"})
+    assert [r["id"] for r in candidates.search({"distrito": "Miraflores", "area_min": 100})] == [1, 3, 4]
+    assert [r["id"] for r in candidates.search({"distrito": "Miraflores", "area_min": 100}, limit=2)] == [1, 3]
+    assert [r["id"] for r in candidates.search({"distrito": "Miraflores", "area_min": 100, "dormitorios": 2})] == [3]
+
+
+def test_bounded_rejects_overflowing_sets():
+    rows = [_row(i) for i in range(5)]
+
+    assert CandidateSet.bounded(BASE, rows, max_rows=4, max_bytes=10**6) is None
+    assert CandidateSet.bounded(BASE, rows, max_rows=5, max_bytes=10) is None
+    candidates = CandidateSet.bounded(BASE, rows, max_rows=5, max_bytes=10**6)
+    assert candidates.rows == rows
+    assert candidates.size == filter_algebra.estimate_rows_size(rows)
+
+
+def test_size_estimate_counts_values():
+    short = _row(1, edificio_nombre="A")
+    long = _row(1, edificio_nombre="A" * 1000)
+
+    assert filter_algebra.estimate_row_size(long) - filter_algebra.estimate_row_size(short) >= 999
+
+
+def test_invalidation_makes_existing_sets_stale(monkeypatch):
+    monkeypatch.setattr(filter_algebra, "_INVALIDATED_AT", 0.0)
+    candidates = CandidateSet(BASE, [], as_of=100.0)
+    assert candidates.is_current()
+
+    monkeypatch.setattr(filter_algebra, "_INVALIDATED_AT", 100.0)
+    assert not candidates.is_current()
+    assert CandidateSet(BASE, [], as_of=101.0).is_current()
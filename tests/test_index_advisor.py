@@ -0,0 +1,149 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.services import index_advisor, query_builder
+from app.services import db as db_service
+
+PLAN = {
+    "Plan": {
+        "Node Type": "Limit",
+        "Shared Hit Blocks": 10,
+        "Plans": [
+            {"Node Type": "Seq Scan", "Relation Name": "propiedad", "Rows Removed by Filter": 900},
+            {"Node Type": "Index Scan", "Relation Name": "edificio", "Rows Removed by Filter": 3},
+        ],
+    },
+    "Execution Time": 180.0,
+}
+
+
+@pytest.fixture
+def advisor(monkeypatch):
+    monkeypatch.setattr(index_advisor, "_SHAPES", {})
+    monkeypatch.setattr(index_advisor, "_STATS", dict.fromkeys(index_advisor._STATS, 0))
+    monkeypatch.setattr(index_advisor.settings, "index_advisor_enabled", True)
+    monkeypatch.setattr(index_advisor.settings, "index_advisor_slow_ms", 100.0)
+    monkeypatch.setattr(index_advisor.settings, "index_advisor_sample_rate", 1.0)
+    monkeypatch.setattr(index_advisor.settings, "index_advisor_plans_per_shape", 2)
+    explained = []
+
+    async def fetch(sql, *params):
+        explained.append(sql)
+        return [{"QUERY PLAN": json.dumps([PLAN])}]
+
+    monkeypatch.setattr(db_service, "fetch", fetch)
+    return explained
+
+
+def _observe(filters: dict, seconds: float = 0.01) -> None:
+    sql, params = query_builder.build_property_search_query(filters)
+    index_advisor.observe(sql, params, seconds)
+
+
+def test_searches_are_recorded_by_shape(advisor):
+    for dormitorios in (1, 2, 2):
+        _observe({"estado": "DISPONIBLE", "dormitorios": dormitorios, "balcon": True})
+    _observe({"distrito": "Lince", "estado": "OCUPADA"}, 0.05)
+    # Other statements are not searches
+    index_advisor.observe("SELECT 1", (), 1.0)
+
+    report = index_advisor.report()
+    assert report["recorded"] == 4
+    assert [(s["filters"], s["count"]) for s in report["shapes"]] == [
+        (["distrito", "estado"], 1),
+        (["estado", "dormitorios", "balcon"], 3),
+    ]
+    stats = index_advisor._SHAPES[("estado", "dormitorios", "balcon")]
+    # Values are kept only for estado and the booleans
+    assert stats.values == {"estado": {"DISPONIBLE": 3}, "balcon": {True: 3}}
+
+
+def test_nothing_is_recorded_when_disabled(advisor, monkeypatch):
+    monkeypatch.setattr(index_advisor.settings, "index_advisor_enabled", False)
+    _observe({"estado": "DISPONIBLE"}, 1.0)
+    assert index_advisor._SHAPES == {} and advisor == []
+
+
+def test_slow_searches_are_explained_in_the_background(advisor):
+    async def run():
+        for _ in range(4):
+            _observe({"estado": "DISPONIBLE", "dormitorios": 2}, 0.2)
+            # Let the EXPLAIN finish before the next search
+            await asyncio.gather(*index_advisor._EXPLAINING)
+        _observe({"estado": "DISPONIBLE", "dormitorios": 2}, 0.01)
+
+    asyncio.run(run())
+    stats = index_advisor._SHAPES[("estado", "dormitorios")]
+    assert stats.slow == 4
+    # Capped per shape
+    assert len(advisor) == len(stats.plans) == 2
+    assert advisor[0].startswith("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) SELECT")
+    assert not advisor[0].rstrip().endswith(";")
+    assert stats.plans[0] == {
+        "execution_ms": 180.0,
+        "seq_scans": ["propiedad"],
+        "index_scans": ["edificio"],
+        "rows_removed_by_filter": 903,
+        "shared_hit_blocks": 10,
+        "shared_read_blocks": None,
+    }
+    assert stats.scan_share("propiedad") == 1.0 and stats.scan_share("edificio") == 0.0
+
+
+def test_failed_explains_are_counted(advisor, monkeypatch):
+    async def fetch(sql, *params):
+        raise RuntimeError("permission denied")
+
+    monkeypatch.setattr(db_service, "fetch", fetch)
+
+    async def run():
+        _observe({"estado": "DISPONIBLE"}, 0.2)
+        await asyncio.gather(*index_advisor._EXPLAINING)
+
+    asyncio.run(run())
+    assert index_advisor._STATS["explain_errors"] == 1
+    assert index_advisor._SHAPES[("estado",)].plans == []
+
+
+def test_suggestions_rank_composite_and_partial_indexes(advisor):
+    for i in range(10):
+        _observe({"estado": "DISPONIBLE", "dormitorios": 1 + i % 3, "balcon": True}, 0.05)
+    for estado in ("DISPONIBLE", "OCUPADA"):
+        _observe({"distrito": "Lince", "estado": estado, "dormitorios": 2}, 0.02)
+
+    suggestions = index_advisor.suggest()
+    assert [(s["table"], s["columns"], s["where"]) for s in suggestions] == [
+        # Dominant estado and balcon become predicates, dormitorios a key column
+        ("propiedad", ["dormitorios", "valor_comercial DESC", "id"], "estado = 'DISPONIBLE' AND balcon"),
+        # Mixed estado stays a column; distrito is served through the join
+        ("propiedad", ["estado", "dormitorios", "valor_comercial DESC", "id"], None),
+        ("edificio", ["distrito"], None),
+        ("propiedad", ["edificio_id"], None),
+    ]
+    assert suggestions[0]["benefit_seconds"] == pytest.approx(10 * 0.05 * 0.5)
+    ddl = suggestions[0]["ddl"]
+    assert ddl.endswith(
+        " ON property_infrastructure.propiedad (dormitorios, valor_comercial DESC, id)"
+        " WHERE estado = 'DISPONIBLE' AND balcon;"
+    )
+    # Long names are cut to Postgres' limit with a digest to stay distinct
+    names = [s["ddl"].split()[6] for s in suggestions]
+    assert names[0].startswith("idx_propiedad_dormitorios_valor_comercial_id_where_")
+    assert all(len(name) <= 63 for name in names) and len(set(names)) == 4
+    assert index_advisor.render_ddl().count("CREATE INDEX") == 4
+
+
+def test_admin_route_needs_the_token(advisor, monkeypatch):
+    client = TestClient(main.app)
+    monkeypatch.setattr(main.settings, "admin_token", None)
+    assert client.get("/admin/index-advisor").status_code == 404
+
+    monkeypatch.setattr(main.settings, "admin_token", "secret")
+    assert client.get("/admin/index-advisor", headers={"Authorization": "Bearer nope"}).status_code == 401
+    response = client.get("/admin/index-advisor?format=sql", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert response.text.startswith("-- Index suggestions")
@@ -0,0 +1,73 @@
+import pickle
+from decimal import Decimal
+
+import pytest
+
+from app.services.result_set import ResultSet
+from app.utils import json_codec
+
+ROWS = [
+    {"id": 1, "area": Decimal("85.50"), "valor_comercial": Decimal("350000"), "edificio_distrito": "Miraflores"},
+    {"id": 2, "area": None, "valor_comercial": Decimal("1.5E+5"), "edificio_distrito": "Lince"},
+]
+COLUMNS = ("id", "area", "valor_comercial", "edificio_distrito")
+
+
+@pytest.fixture
+def fast(monkeypatch):
+    pytest.importorskip("orjson")
+    monkeypatch.setattr(json_codec.settings, "fast_json_enabled", True)
+
+
+def test_result_values_are_converted_once(fast):
+    result = ResultSet.from_dicts(ROWS, COLUMNS)
+    body = json_codec.dumps({"data": result})
+
+    cached = result.json_rows
+    assert cached == [(1, 85.5, 350000, "Miraflores"), (2, None, 150000, "Lince")]
+    assert json_codec.dumps({"data": result}) == body
+    assert result.json_rows is cached
+    # Slices share the converted rows
+    assert result[:1].json_rows == cached[:1]
+    assert json_codec.dumps(result[1:]) == b'[{"id":2,"area":null,"valor_comercial":150000,"edificio_distrito":"Lince"}]'
+
+
+def test_pickled_results_leave_the_cache_out(fast):
+    result = ResultSet.from_dicts(ROWS, COLUMNS)
+    json_codec.dumps(result)
+
+    restored = pickle.loads(pickle.dumps(result))
+    assert restored.json_rows is None
+    assert restored.rows == result.rows
+
+
+PAYLOADS = [
+    {"data": ResultSet.from_dicts(ROWS, COLUMNS), "reply": "¿Algo más? Ñandú", "count": 2},
+    {"nested": {"values": [Decimal("0.10"), Decimal("-3"), Decimal("2E+2"), None, True]}},
+    [ResultSet.from_dicts([], COLUMNS), ResultSet.from_dicts(ROWS, COLUMNS)[1:]],
+]
+
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_fast_and_standard_paths_agree(monkeypatch, payload):
+    pytest.importorskip("orjson")
+    monkeypatch.setattr(json_codec.settings, "fast_json_enabled", False)
+    standard = json_codec.dumps(payload)
+    monkeypatch.setattr(json_codec.settings, "fast_json_enabled", True)
+    fast = json_codec.dumps(payload)
+
+    assert fast == standard
+
+
+def test_response_body_uses_the_codec(fast):
+    response = json_codec.JSONBody({"data": ResultSet.from_dicts(ROWS[:1], COLUMNS)})
+
+    assert response.media_type == "application/json"
+    assert response.body == (
+        b'{"data":[{"id":1,"area":85.5,"valor_comercial":350000,"edificio_distrito":"Miraflores"}]}'
+    )
+
+
+def test_unknown_types_are_rejected(fast):
+    with pytest.raises(TypeError):
+        json_codec.dumps({"value": object()})
@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import admission
+from app.services import llm_client
+
+
+class StubCompletions:
+    def __init__(self, failures: int = 0) -> None:
+        self.failures = failures
+        self.calls: list[dict] = []
+        self.active_during_call: list[int] = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        self.active_during_call.append(admission.llm_gate.active)
+        if self.failures:
+            self.failures -= 1
+            raise asyncio.TimeoutError
+        message = SimpleNamespace(content='{"distrito": "Lince"}')
+        usage = SimpleNamespace(prompt_tokens=10, completion_tokens=5, prompt_tokens_details=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+@pytest.fixture
+def completions(monkeypatch):
+    stub = StubCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=stub))
+
+    async def get_client():
+        return client
+
+    monkeypatch.setattr(llm_client, "_get_client", get_client)
+    monkeypatch.setattr(llm_client, "_backoff", lambda attempt: 0)
+    return stub
+
+
+def test_complete_holds_an_llm_gate_slot(completions):
+    messages = [{"role": "user", "content": "Lince"}]
+    resp = asyncio.run(llm_client._complete(messages, max_tokens=50))
+
+    assert resp.choices[0].message.content == '{"distrito": "Lince"}'
+    assert completions.calls[0]["messages"] == messages
+    assert completions.calls[0]["max_tokens"] == 50
+    assert completions.active_during_call == [1]
+    assert admission.llm_gate.active == 0
+
+
+def test_complete_retries_timeouts(completions):
+    completions.failures = 1
+    retries = llm_client.get_llm_client_stats()["retries"]
+
+    asyncio.run(llm_client._complete([{"role": "user", "content": "Lince"}], max_tokens=50))
+
+    assert len(completions.calls) == 2
+    assert llm_client.get_llm_client_stats()["retries"] == retries + 1
+
+
+def _attempts(*outcomes):
+    """A call whose n-th copy sleeps past the hedge delay, then does outcomes[n]."""
+    calls = iter(outcomes)
+
+    async def call():
+        outcome = next(calls)
+        await asyncio.sleep(0.05 if outcome != "ok" else 0.06)
+        if outcome == "cancelled":
+            raise asyncio.CancelledError
+        if outcome == "error":
+            raise ValueError("bad response")
+        return outcome
+
+    return call
+
+
+@pytest.mark.parametrize(
+    "outcomes, expected",
+    [
+        # The first copy ends cancelled: the hedge still answers
+        (("cancelled", "ok"), "ok"),
+        # Neither succeeds: the real error wins over the cancellation
+        (("cancelled", "error"), ValueError),
+        (("error", "cancelled"), ValueError),
+    ],
+)
+def test_hedge_with_a_cancelled_copy(monkeypatch, outcomes, expected):
+    monkeypatch.setattr(llm_client, "_hedge_delay", lambda: 0.01)
+    call = _attempts(*outcomes)
+
+    if isinstance(expected, type):
+        with pytest.raises(expected):
+            asyncio.run(llm_client._hedged(call))
+    else:
+        assert asyncio.run(llm_client._hedged(call)) == expected
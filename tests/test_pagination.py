@@ -0,0 +1,68 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+from app.services import pagination, query_builder
+from app.services import db as db_service
+
+FILTERS = {"distrito": "Miraflores", "area_min": 80, "estado": "DISPONIBLE", "presupuesto_max": 400000}
+# Ties on valor_comercial are broken by id
+ROWS = [{"id": i, "valor_comercial": Decimal(300000 - 1000 * (i // 3)) + Decimal("0.25")} for i in range(1, 12)]
+
+
+@pytest.mark.parametrize("value", [Decimal("350000.25"), Decimal("1E+5"), None])
+def test_cursor_round_trip(value):
+    token = pagination.encode_cursor(FILTERS, {"id": 42, "valor_comercial": value})
+
+    assert token.isascii() and "=" not in token
+    assert pagination.decode_cursor(token, FILTERS) == (value, 42)
+    # Unset filters do not change the fingerprint
+    assert pagination.decode_cursor(token, {**FILTERS, "balcon": None, "terraza": None}) == (value, 42)
+
+
+@pytest.mark.parametrize(
+    "token, filters, message",
+    [
+        ("not base64!", FILTERS, "Malformed"),
+        ("e30", FILTERS, "Malformed"),  # {}
+        (None, {**FILTERS, "distrito": "Lince"}, "other filters"),
+        (None, {**FILTERS, "dormitorios": 2}, "other filters"),
+    ],
+)
+def test_invalid_cursors_are_rejected(token, filters, message):
+    token = token or pagination.encode_cursor(FILTERS, {"id": 1, "valor_comercial": Decimal(1)})
+    with pytest.raises(pagination.InvalidCursor, match=message):
+        pagination.decode_cursor(token, filters)
+
+
+def test_pages_cover_the_results_once(monkeypatch):
+    async def fetch_shared(sql, *params):
+        assert sql == query_builder.build_property_page_query(FILTERS)[0]
+        after_value, after_id, limit = params[-3:]
+        ordered = sorted(ROWS, key=lambda row: (-row["valor_comercial"], row["id"]))
+        if after_value is not None:
+            ordered = [
+                row for row in ordered
+                if row["valor_comercial"] < after_value
+                or (row["valor_comercial"] == after_value and row["id"] > after_id)
+            ]
+        return [dict(row) for row in ordered[:limit]]
+
+    monkeypatch.setattr(db_service, "fetch_shared", fetch_shared)
+    monkeypatch.setattr(pagination.json_codec, "is_fast", lambda: False)
+
+    async def walk():
+        pages, cursor = [], None
+        while True:
+            _, rows, cursor = await pagination.fetch_page(FILTERS, cursor, 4)
+            pages.append([row["id"] for row in rows])
+            if cursor is None:
+                return pages
+
+    assert asyncio.run(walk()) == [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10, 11]]
+
+
+def test_export_rejects_a_bad_cursor_before_streaming():
+    with pytest.raises(pagination.InvalidCursor):
+        pagination.export(FILTERS, "e30")
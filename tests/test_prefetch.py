@@ -0,0 +1,121 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+from app.services import filter_algebra, prefetch
+from app.services import db as db_service
+
+FILTERS = {"distrito": "Miraflores", "area_min": 80, "estado": "DISPONIBLE", "presupuesto_max": 400000}
+ROWS = [
+    {"id": i, "edificio_distrito": "Miraflores", "area": 90, "estado": "DISPONIBLE",
+     "valor_comercial": Decimal(300000 - i), "dormitorios": 1 + i % 3}
+    for i in range(9)
+]
+
+
+class SlowFetch:
+    """fetch_shared stub that holds every query until `release` is set."""
+
+    def __init__(self, rows) -> None:
+        self.rows = rows
+        self.queries = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self, sql, *params):
+        self.queries += 1
+        await self.release.wait()
+        return [dict(row) for row in self.rows]
+
+
+@pytest.fixture
+def fetch(monkeypatch):
+    monkeypatch.setattr(prefetch, "_PREFETCHES", prefetch._PREFETCHES.__class__())
+    monkeypatch.setattr(prefetch.settings, "prefetch_enabled", True)
+    monkeypatch.setattr(prefetch.settings, "prefetch_max_rows", 50)
+
+    def make(rows=ROWS) -> SlowFetch:
+        stub = SlowFetch(rows)
+        monkeypatch.setattr(db_service, "fetch_shared", stub)
+        return stub
+
+    return make
+
+
+def _stats() -> dict[str, int]:
+    return dict(prefetch.get_prefetch_stats())
+
+
+def test_answer_that_refines_the_prefetch_is_served_from_it(fetch):
+    stub = fetch()
+    before = _stats()
+
+    async def run():
+        prefetch.start("s1", FILTERS, "dormitorios")
+        await asyncio.sleep(0)
+        # The answer arrives while the query is still running: it is awaited
+        stub.release.set()
+        return await prefetch.take("s1", {**FILTERS, "dormitorios": 2})
+
+    candidates = asyncio.run(run())
+    assert [row["id"] for row in candidates.search({**FILTERS, "dormitorios": 2})] == [1, 4, 7]
+    assert stub.queries == 1
+    assert _stats()["hits"] == before["hits"] + 1
+    assert _stats()["pending"] == 0
+
+
+def test_answer_that_changes_the_filters_cancels_the_prefetch(fetch):
+    stub = fetch()
+
+    async def run():
+        prefetch.start("s1", FILTERS, "dormitorios")
+        task = prefetch._PREFETCHES["s1"].task
+        result = await prefetch.take("s1", {**FILTERS, "distrito": "Lince", "dormitorios": 2})
+        await asyncio.sleep(0)
+        return result, task
+
+    result, task = asyncio.run(run())
+    assert result is None
+    assert task.cancelled()
+
+
+@pytest.mark.parametrize("invalidate", [False, True])
+def test_overflowing_or_invalidated_prefetches_fall_back_to_sql(fetch, monkeypatch, invalidate):
+    stub = fetch()
+    stub.release.set()
+    if not invalidate:
+        monkeypatch.setattr(prefetch.settings, "prefetch_max_rows", 5)
+
+    async def run():
+        prefetch.start("s1", FILTERS, "dormitorios")
+        await prefetch._PREFETCHES["s1"].task
+        if invalidate:
+            # A row changed while the prefetch was held
+            await asyncio.sleep(0.001)
+            filter_algebra.invalidate_candidates()
+        return await prefetch.take("s1", {**FILTERS, "dormitorios": 2})
+
+    assert asyncio.run(run()) is None
+
+
+def test_a_new_question_supersedes_the_prefetch(fetch, monkeypatch):
+    fetch()
+    monkeypatch.setattr(prefetch.settings, "prefetch_max_sessions", 2)
+
+    async def run():
+        prefetch.start("s1", FILTERS, "dormitorios")
+        first = prefetch._PREFETCHES["s1"].task
+        # Same question again: kept
+        prefetch.start("s1", FILTERS, "dormitorios")
+        assert prefetch._PREFETCHES["s1"].task is first
+        prefetch.start("s1", {**FILTERS, "dormitorios": 2}, "presupuesto_max")
+        second = prefetch._PREFETCHES["s1"].task
+        # Bounded number of sessions: the oldest prefetch goes
+        prefetch.start("s2", FILTERS, "dormitorios")
+        prefetch.start("s3", FILTERS, "dormitorios")
+        await asyncio.sleep(0)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first.cancelled() and second.cancelled()
+    assert list(prefetch._PREFETCHES) == ["s2", "s3"]
@@ -0,0 +1,113 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from app.models.schemas import FilterEssential, FilterOptional
+from app.prompts import extraction as prompts
+from app.services import llm_client
+
+
+def test_schema_lists_every_filter_as_nullable():
+    fields = {**FilterEssential.model_fields, **FilterOptional.model_fields}
+    schema = prompts.FILTERS_SCHEMA
+
+    assert schema["required"] == list(fields) == list(schema["properties"])
+    assert schema["additionalProperties"] is False
+    assert schema["properties"]["area_min"] == {"type": ["number", "null"]}
+    assert schema["properties"]["dormitorios"] == {"type": ["integer", "null"]}
+    assert schema["properties"]["balcon"] == {"type": ["boolean", "null"]}
+    assert schema["properties"]["estado"] == {
+        "type": ["string", "null"],
+        "enum": ["DISPONIBLE", "MANTENIMIENTO", "OCUPADA", "VENDIDA", None],
+    }
+    batch_item = prompts.BATCH_RESPONSE_FORMAT["json_schema"]["schema"]["properties"]["resultados"]["items"]
+    assert batch_item["properties"]["filtros"] is schema
+
+
+def test_every_request_shares_the_system_prefix():
+    first = prompts.build_messages("80", "area_min")
+    second = prompts.build_messages("en Miraflores")
+
+    assert first[0] == second[0] == {"role": "system", "content": prompts.SYSTEM_PROMPT}
+    assert first[1]["content"] == "Pendiente: area_min\nMensaje: 80"
+    assert second[1]["content"] == "Mensaje: en Miraflores"
+
+    batch = prompts.build_batch_messages(["80 m2", "en Surco"])
+    assert batch[0]["content"].startswith(prompts.SYSTEM_PROMPT)
+    # Compact JSON: no whitespace between tokens
+    assert batch[1]["content"] == '{"mensajes":[{"id":0,"texto":"80 m2"},{"id":1,"texto":"en Surco"}]}'
+
+
+class Completions:
+    def __init__(self) -> None:
+        self.calls: list[dict] = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        answer = dict.fromkeys(prompts.FILTERS_SCHEMA["properties"])
+        answer["area_min"] = 80
+        usage = SimpleNamespace(prompt_tokens=300, completion_tokens=40,
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=256))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(answer)))],
+                               usage=usage)
+
+
+@pytest.fixture
+def completions(monkeypatch):
+    stub = Completions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=stub))
+
+    async def get_client():
+        return client
+
+    monkeypatch.setattr(llm_client, "_get_client", get_client)
+    monkeypatch.setattr(llm_client, "_TOKENS", {})
+    monkeypatch.setattr(llm_client.settings, "llm_cache_enabled", True)
+    llm_client.clear_extraction_cache()
+    yield stub
+    llm_client.clear_extraction_cache()
+
+
+def test_extraction_is_schema_constrained_and_capped(completions):
+    assert asyncio.run(llm_client.extract_filters_from_text("unos ochenta", "area_min")) == {"area_min": 80}
+
+    call = completions.calls[0]
+    assert call["max_tokens"] == llm_client.settings.llm_extraction_max_tokens
+    assert call["response_format"] == prompts.RESPONSE_FORMAT
+    assert call["messages"] == prompts.build_messages("unos ochenta", "area_min")
+
+
+def test_structured_output_can_be_turned_off(completions, monkeypatch):
+    monkeypatch.setattr(llm_client.settings, "llm_structured_output", False)
+    asyncio.run(llm_client.extract_filters_from_text("80", "area_min"))
+    assert "response_format" not in completions.calls[0]
+
+
+def test_extractions_are_cached_by_text_and_pending_field(completions):
+    async def run():
+        await llm_client.extract_filters_from_text("Unos ochenta", "area_min")
+        await llm_client.extract_filters_from_text("unos  ochenta", "area_min")
+        await llm_client.extract_filters_from_text("unos ochenta", "presupuesto_max")
+
+    asyncio.run(run())
+    assert len(completions.calls) == 2
+    # Without a pending field it is another entry
+    assert llm_client.cached_extraction("unos ochenta") is None
+
+
+def test_tokens_are_accounted_per_purpose(completions):
+    async def run():
+        await llm_client.extract_filters_from_text("80", "area_min")
+        await llm_client.extract_filters_from_text("90", "area_min")
+        await llm_client.request_batch_extraction(["80 m2", "90 m2"])
+
+    asyncio.run(run())
+    stats = llm_client.get_token_stats()
+    assert stats["extract"] == {
+        "calls": 2, "prompt": 600, "completion": 80, "cached": 512,
+        "prompt_per_call": 300.0, "completion_per_call": 40.0,
+    }
+    assert stats["batch"]["calls"] == 1
+    assert completions.calls[-1]["max_tokens"] == 2 * llm_client.settings.llm_batch_output_tokens_per_item + 50
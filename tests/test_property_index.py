@@ -0,0 +1,190 @@
+"""Parity of the in-memory property index with the SQL search path.
+
+The reference below evaluates query_builder's FILTER_SPECS the way Postgres
+does: exact numeric comparison, NULL never matches, ORDER BY valor_comercial
+DESC (NULLs first), id. With TEST_DATABASE_URL set, the generated SQL itself
+also runs against the same rows, in a throwaway schema.
+"""
+
+import asyncio
+import itertools
+import os
+import uuid
+from decimal import Decimal
+
+import pytest
+
+from app.services import db as db_service
+from app.services import filter_algebra
+from app.services import property_index
+from app.services import query_builder
+
+pytest.importorskip("numpy")
+
+D = Decimal
+
+
+def _row(id_, valor, area, dormitorios=2, distrito="Miraflores", estado="DISPONIBLE", **extra):
+    row = {
+        "id": id_,
+        "numero": str(100 + id_),
+        "piso": 1,
+        "tipo": "departamento",
+        "area": area,
+        "dormitorios": dormitorios,
+        "banios": extra.pop("banios", 1),
+        "balcon": extra.pop("balcon", None),
+        "terraza": extra.pop("terraza", False),
+        "amoblado": extra.pop("amoblado", True),
+        "permite_mascotas": extra.pop("permite_mascotas", None),
+        "valor_comercial": valor,
+        "mantenimiento_mensual": D("350.00"),
+        "estado": estado,
+        "edificio_nombre": "Edificio",
+        "edificio_direccion": "Av. Larco 100",
+        "edificio_distrito": distrito,
+    }
+    assert not extra
+    return row
+
+
+# Ids out of insertion order so ties must be broken by id, not by position
+ROWS = [
+    _row(7, D("300000.00"), D("80.00")),
+    _row(3, D("300000.00"), D("80.00"), permite_mascotas=True),
+    _row(5, D("300000.01"), D("80.01"), balcon=True),
+    _row(1, D("299999.99"), D("79.99"), balcon=False),
+    _row(9, None, D("80.10")),
+    _row(4, None, D("120.00"), permite_mascotas=False),
+    _row(2, D("0.10"), None),
+    _row(8, D("250000.00"), D("80.10"), dormitorios=None),
+    _row(6, D("250000.00"), D("80.10"), dormitorios=3, banios=None),
+    _row(10, D("250000.00"), D("95.50"), distrito="Lince", estado="OCUPADA"),
+    _row(11, D("1250000.50"), D("300.00"), distrito=None),
+    _row(12, D("99999.99"), D("40.00"), estado=None, balcon=True, permite_mascotas=True),
+]
+
+FILTER_CASES = [
+    dict(zip(("area_min", "presupuesto_max", "dormitorios", "pet_friendly"), values))
+    for values in itertools.product(
+        [None, 80, 80.0, 79.99, 80.01, 80.1, D("80.10")],
+        [None, 300000, 299999.99, 300000.01, 250000, 0.1],
+        [None, 2],
+        [None, True, False],
+    )
+] + [
+    {"distrito": "Miraflores", "estado": "DISPONIBLE", "area_min": 80, "presupuesto_max": 300000, "dormitorios": 2},
+    {"distrito": "Lince", "estado": "OCUPADA"},
+    {"distrito": "Surco"},
+    {"balcon": True},
+    {"balcon": False, "terraza": False},
+    {"banios": 1, "amoblado": True},
+]
+
+
+def _sql_reference(filters: dict, limit: int) -> list[int]:
+    """Ids the search statement returns, evaluated with Postgres semantics."""
+    active = query_builder.active_filters(filters)
+    specs = {spec.key: spec for spec in query_builder.FILTER_SPECS}
+
+    def matches(row: dict) -> bool:
+        for key, value in active.items():
+            spec = specs[key]
+            column = row[spec.row_key]
+            if column is None:
+                return False
+            if spec.pg_type == "numeric":
+                column, value = D(column), D(value)
+            if not {"=": column == value, ">=": column >= value, "<=": column <= value}[spec.op]:
+                return False
+        return True
+
+    return [row["id"] for row in sorted(filter(matches, ROWS), key=_result_order)[:limit]]
+
+
+def _result_order(row: dict) -> tuple:
+    # valor_comercial DESC puts NULLs first in Postgres
+    valor = row["valor_comercial"]
+    return (valor is not None, -(valor or 0), row["id"])
+
+
+@pytest.fixture
+def loaded_index(monkeypatch):
+    async def fetch(sql, *params, primary=False):
+        return [dict(row) for row in ROWS]
+
+    monkeypatch.setattr(db_service, "fetch", fetch)
+    monkeypatch.setattr(property_index, "_SNAPSHOT", None)
+    monkeypatch.setattr(property_index, "_ROWS_BY_ID", {})
+    asyncio.run(property_index.load_full())
+    return property_index
+
+
+@pytest.mark.parametrize("limit", [1, 3, 100])
+def test_index_matches_sql_semantics(loaded_index, limit):
+    for filters in FILTER_CASES:
+        got = [row["id"] for row in loaded_index.search(filters, limit)]
+        assert got == _sql_reference(filters, limit), filters
+
+
+def test_local_filtering_matches_sql_semantics():
+    ordered = sorted(ROWS, key=_result_order)
+    for filters in FILTER_CASES:
+        got = [row["id"] for row in filter_algebra.apply_filters(ordered, filters)]
+        assert got == _sql_reference(filters, len(ROWS)), filters
+
+
+def test_float_budgets_are_sent_as_written_decimals():
+    _, params = query_builder.build_property_search_query({"presupuesto_max": 299999.99, "area_min": 80.1})
+    by_key = dict(zip(query_builder.FILTER_KEYS, params))
+    assert by_key["presupuesto_max"] == D("299999.99")
+    assert by_key["area_min"] == D("80.1")
+
+
+_DDL = """
+CREATE SCHEMA {schema};
+CREATE TABLE {schema}.edificio (
+    id integer PRIMARY KEY, nombre text, direccion text, distrito text
+);
+CREATE TABLE {schema}.propiedad (
+    id integer PRIMARY KEY, edificio_id integer REFERENCES {schema}.edificio (id),
+    numero text, piso integer, tipo text, area numeric(10, 2), dormitorios integer,
+    banios integer, balcon boolean, terraza boolean, amoblado boolean,
+    permite_mascotas boolean, valor_comercial numeric(15, 2),
+    mantenimiento_mensual numeric(10, 2), estado text
+);
+"""
+
+
+@pytest.mark.skipif(not os.environ.get("TEST_DATABASE_URL"), reason="TEST_DATABASE_URL not set")
+def test_index_matches_postgres(loaded_index):
+    asyncpg = pytest.importorskip("asyncpg")
+    schema = f"parity_{uuid.uuid4().hex[:8]}"
+
+    async def run() -> None:
+        conn = await asyncpg.connect(os.environ["TEST_DATABASE_URL"])
+        transaction = conn.transaction()
+        await transaction.start()
+        try:
+            await conn.execute(_DDL.format(schema=schema))
+            for row in ROWS:
+                await conn.execute(
+                    f"INSERT INTO {schema}.edificio VALUES ($1, $2, $3, $4)",
+                    row["id"], row["edificio_nombre"], row["edificio_direccion"], row["edificio_distrito"],
+                )
+                await conn.execute(
+                    f"INSERT INTO {schema}.propiedad VALUES ($1, $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14)",
+                    row["id"], row["numero"], row["piso"], row["tipo"], row["area"], row["dormitorios"],
+                    row["banios"], row["balcon"], row["terraza"], row["amoblado"], row["permite_mascotas"],
+                    row["valor_comercial"], row["mantenimiento_mensual"], row["estado"],
+                )
+            for filters, limit in itertools.product(FILTER_CASES, (1, 3, 100)):
+                sql, params = query_builder.build_property_search_query(filters, limit)
+                records = await conn.fetch(sql.replace("property_infrastructure.", f"{schema}."), *params)
+                got = [row["id"] for row in loaded_index.search(filters, limit)]
+                assert got == [record["id"] for record in records], filters
+        finally:
+            await transaction.rollback()
+            await conn.close()
+
+    asyncio.run(run())
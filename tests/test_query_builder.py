@@ -0,0 +1,64 @@
+import asyncio
+import itertools
+import re
+
+from app.services import db as db_service
+from app.services import query_builder
+
+FILTERS = {
+    "distrito": "Miraflores",
+    "area_min": 80,
+    "estado": "DISPONIBLE",
+    "presupuesto_max": 300000,
+    "dormitorios": 2,
+    "pet_friendly": True,
+    "banios": 2,
+}
+
+
+def _placeholders(sql: str) -> int:
+    return max(int(n) for n in re.findall(r"\$(\d+)", sql))
+
+
+def test_every_filter_combination_uses_a_canonical_statement():
+    canonical = {sql for sql, _ in query_builder.canonical_statements()}
+    seen = set()
+    for size in range(len(FILTERS) + 1):
+        for keys in itertools.combinations(FILTERS, size):
+            sql, params = query_builder.build_property_search_query({k: FILTERS[k] for k in keys}, 5)
+            assert sql in canonical
+            assert len(params) == _placeholders(sql)
+            seen.add(sql)
+    # One shape with every essential, one for everything else
+    assert len(seen) == 2
+
+
+def test_unset_filters_are_null_parameters():
+    sql, params = query_builder.build_property_search_query({"distrito": "Lince", "estado": "", "balcon": None}, 7)
+    by_key = dict(zip(query_builder.FILTER_KEYS, params))
+
+    assert by_key["distrito"] == "Lince"
+    assert by_key["estado"] is None and by_key["balcon"] is None
+    assert params[-1] == 7
+    # Values never reach the SQL text
+    assert "Lince" not in sql
+
+
+def test_warm_up_parameters_fit_their_statements():
+    for sql, params in query_builder.canonical_statements():
+        assert sql.lstrip().upper().startswith("SELECT")
+        assert len(params) == _placeholders(sql)
+        # LIMIT 0: planned, no rows read
+        assert params[-1] == 0
+
+
+def test_new_connections_prepare_every_canonical_statement():
+    executed = []
+
+    class Conn:
+        async def fetch(self, sql, *params):
+            executed.append((sql, params))
+            return []
+
+    asyncio.run(db_service._warm_connection(Conn()))
+    assert executed == query_builder.canonical_statements()
@@ -0,0 +1,38 @@
+from decimal import Decimal
+
+from app.services import query_builder
+from app.services.result_set import ResultSet
+
+ROWS = [
+    {"id": 1, "valor_comercial": Decimal("300000"), "edificio_distrito": "Miraflores", "extra": "x"},
+    {"id": 2, "valor_comercial": Decimal("250000"), "edificio_distrito": "Lince"},
+]
+COLUMNS = ("id", "valor_comercial", "edificio_distrito")
+
+
+def test_reads_like_a_list_of_dicts():
+    result = ResultSet.from_dicts(ROWS, COLUMNS)
+    expected = [{key: row.get(key) for key in COLUMNS} for row in ROWS]
+
+    assert result and len(result) == 2
+    assert result.to_dicts() == list(result) == expected
+    assert result[1] == expected[1]
+    assert result[-1:].to_dicts() == expected[1:]
+    assert not ResultSet.from_dicts([], COLUMNS)
+
+
+def test_slices_share_columns_and_row_tuples():
+    result = ResultSet.from_dicts(ROWS, COLUMNS)
+    head = result[:1]
+
+    assert head.columns is result.columns
+    assert head.rows[0] is result.rows[0]
+
+
+def test_records_are_packed_in_result_column_order():
+    # asyncpg Records iterate over their values in SELECT order
+    records = [tuple(row.get(key) for key in query_builder.RESULT_KEYS) for row in ROWS]
+    result = ResultSet.from_records(records)
+
+    assert result.columns == query_builder.RESULT_KEYS
+    assert result.to_dicts() == ResultSet.from_dicts(ROWS).to_dicts()
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from app.services import parser, rule_extractor
+
+
+@pytest.mark.parametrize(
+    "text, pending, expected",
+    [
+        # Unit-anchored regexes
+        ("80 m2", None, {"area_min": 80}),
+        ("120 metros cuadrados", None, {"area_min": 120}),
+        ("S/ 350,000", None, {"presupuesto_max": 350000}),
+        ("$ 300k", None, {"presupuesto_max": 300000}),
+        ("350 mil", None, {"presupuesto_max": 350000}),
+        ("hasta 1.5 millones", None, {"presupuesto_max": 1500000}),
+        ("presupuesto de 250000", None, {"presupuesto_max": 250000}),
+        ("3 dormitorios", None, {"dormitorios": 3}),
+        ("dos dormitorios", None, {"dormitorios": 2}),
+        ("tres ambientes", None, {"dormitorios": 2}),
+        ("2 baños", None, {"banios": 2}),
+        # A bare number answers the pending question
+        ("80", "area_min", {"area_min": 80}),
+        ("300000", "presupuesto_max", {"presupuesto_max": 300000}),
+        ("2", "dormitorios", {"dormitorios": 2}),
+        ("dos", "dormitorios", {"dormitorios": 2}),
+        # Gazetteer and enums, accent- and case-insensitive, longest match first
+        ("San Isidro", None, {"distrito": "San Isidro"}),
+        ("en jesus maria", None, {"distrito": "Jesús María"}),
+        ("SAN JUAN DE MIRAFLORES", None, {"distrito": "San Juan de Miraflores"}),
+        ("disponible", None, {"estado": "DISPONIBLE"}),
+        ("vendidas", None, {"estado": "VENDIDA"}),
+        (
+            "Miraflores, 80 m2, disponible, 3 dormitorios, hasta 300 mil",
+            None,
+            {"distrito": "Miraflores", "area_min": 80, "estado": "DISPONIBLE", "dormitorios": 3, "presupuesto_max": 300000},
+        ),
+    ],
+)
+def test_confident_extractions(text, pending, expected):
+    assert rule_extractor.extract(text, pending) == (expected, 1.0)
+
+
+@pytest.mark.parametrize(
+    "text, pending",
+    [
+        ("", None),
+        ("hola", None),
+        # Negations and exclusions are left to the LLM
+        ("no en Miraflores", None),
+        ("menos de 80 m2", None),
+        # Conflicting values for one filter
+        ("80 m2 o 90 m2", None),
+        # Bare numbers: ambiguous, not pending, or out of range
+        ("80 y 90", "area_min"),
+        ("80", None),
+        ("25", "dormitorios"),
+    ],
+)
+def test_untrusted_extractions(text, pending):
+    assert rule_extractor.extract(text, pending) == ({}, 0.0)
+
+
+@pytest.mark.parametrize(
+    "text, confidence",
+    [
+        # Each word the rules cannot explain costs _UNEXPLAINED_PENALTY
+        ("cerca al parque en Miraflores", 0.5),
+        ("cerca al parque kennedy en Miraflores con vista", 0.0),
+        ("Miraflores por favor", 1.0),
+    ],
+)
+def test_unexplained_words_lower_confidence(text, confidence):
+    filters, got = rule_extractor.extract(text)
+    assert filters == {"distrito": "Miraflores"}
+    assert got == pytest.approx(confidence)
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    calls = []
+
+    async def extract_filters_from_text(text, pending=None):
+        calls.append(text)
+        return {"distrito": "Barranco"}
+
+    monkeypatch.setattr(parser.llm_client, "extract_filters_from_text", extract_filters_from_text)
+    monkeypatch.setattr(parser.settings, "fast_path_enabled", True)
+    return calls
+
+
+@pytest.mark.parametrize(
+    "text, pending, expected, llm_calls",
+    [
+        # Confident rules: the LLM is never called
+        ("San Isidro", None, {"distrito": "San Isidro"}, 0),
+        ("80", "area_min", {"area_min": 80}, 0),
+        # Below fast_path_min_confidence or nothing matched: LLM fallback
+        ("cerca al parque en Miraflores", None, {"distrito": "Barranco"}, 1),
+        ("no en Miraflores", None, {"distrito": "Barranco"}, 1),
+        ("algo bonito", None, {"distrito": "Barranco"}, 1),
+    ],
+)
+def test_parser_uses_rules_or_falls_back_to_the_llm(llm, text, pending, expected, llm_calls):
+    assert asyncio.run(parser.parse_filters(text, pending=pending)) == expected
+    assert len(llm) == llm_calls
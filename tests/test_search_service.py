@@ -0,0 +1,68 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+from app.services import property_index, search_service, session_manager, topk_cube
+from app.services import db as db_service
+from app.services.result_set import ResultSet
+from app.services.session_backends import MemorySessionBackend
+
+
+ROWS = [
+    {"id": i, "edificio_distrito": "Miraflores", "area": 60 + 10 * i, "dormitorios": 1 + i % 3,
+     "estado": "DISPONIBLE", "valor_comercial": Decimal(400000 - 1000 * i)}
+    for i in range(12)
+]
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    """Run searches on the SQL path against ROWS, recording every query."""
+    sent = []
+
+    async def fetch_shared(sql, *params):
+        sent.append(params)
+        return [dict(row) for row in ROWS]
+
+    async def fetch_result_shared(sql, *params):
+        return ResultSet.from_dicts(await fetch_shared(sql, *params))
+
+    monkeypatch.setattr(db_service, "fetch_shared", fetch_shared)
+    monkeypatch.setattr(db_service, "fetch_result_shared", fetch_result_shared)
+    monkeypatch.setattr(property_index, "is_ready", lambda: False)
+    monkeypatch.setattr(topk_cube, "search", lambda filters, limit: None)
+    monkeypatch.setattr(search_service.settings, "refine_enabled", True)
+    session_manager.set_backend(MemorySessionBackend(ttl_seconds=3600, max_count=100, max_bytes=10**8))
+    return sent
+
+
+def _ids(rows) -> list[int]:
+    return [row["id"] for row in rows]
+
+
+def test_refinement_is_answered_from_candidates(queries):
+    session_id = session_manager.create_session()
+    base = {"distrito": "Miraflores", "estado": "DISPONIBLE"}
+
+    async def run():
+        await search_service.search(base, limit=5, session_id=session_id)
+        local = search_service._STATS["local"]
+        _, rows = await search_service.search({**base, "area_min": 100, "dormitorios": 2}, limit=5, session_id=session_id)
+        return rows, search_service._STATS["local"] - local
+
+    rows, answered_locally = asyncio.run(run())
+    assert len(queries) == 1
+    assert answered_locally == 1
+    assert _ids(rows) == [4, 7, 10]
+
+
+def test_wider_search_goes_back_to_the_database(queries):
+    session_id = session_manager.create_session()
+
+    async def run():
+        await search_service.search({"distrito": "Miraflores", "area_min": 100}, session_id=session_id)
+        await search_service.search({"distrito": "Miraflores", "area_min": 80}, session_id=session_id)
+
+    asyncio.run(run())
+    assert len(queries) == 2
@@ -0,0 +1,225 @@
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+from app.models.state import ConversationState
+from app.services import session_backends
+from app.services.session_backends import MemorySessionBackend, SQLiteSessionBackend
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteSessionBackend(str(tmp_path / "sessions.sqlite3"), ttl_seconds=60, max_count=100, max_bytes=10**8)
+    yield backend
+    backend.close()
+
+
+def _state(session_id: str, distrito: str) -> ConversationState:
+    return ConversationState(session_id=session_id, collected_filters={"distrito": distrito})
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_backends.time, "monotonic", clock)
+    return clock
+
+
+def test_memory_sessions_expire_after_the_ttl(clock):
+    memory = MemorySessionBackend(ttl_seconds=60, max_count=100, max_bytes=10**8)
+    memory.create("idle", _state("idle", "Lince"))
+    memory.create("active", _state("active", "Surco"))
+
+    clock.now += 40
+    assert memory.get_conversation("active") is not None
+    clock.now += 40
+    # Expired lazily on access; the access above kept "active" alive
+    assert memory.get_conversation("idle") is None
+    assert memory.get_conversation("active") is not None
+    assert memory.stats()["expired"] == 1
+
+    clock.now += 61
+    assert memory.sweep() == 1
+    assert memory.count() == 0
+
+
+def test_memory_store_evicts_least_recently_used(clock):
+    memory = MemorySessionBackend(ttl_seconds=60, max_count=2, max_bytes=10**8)
+    memory.create("s1", _state("s1", "Lince"))
+    memory.create("s2", _state("s2", "Surco"))
+    memory.get_conversation("s1")
+
+    memory.create("s3", _state("s3", "Barranco"))
+    assert memory.get_conversation("s2") is None
+    assert memory.get_conversation("s1") is not None
+    assert memory.stats()["evicted"] == 1
+
+
+def test_memory_store_respects_the_byte_cap(clock):
+    memory = MemorySessionBackend(ttl_seconds=60, max_count=100, max_bytes=4000)
+    for i in range(3):
+        memory.create(f"s{i}", _state(f"s{i}", "Lince"))
+    state = memory.get_conversation("s0")
+    state.messages.append({"role": "user", "content": "x" * 2500})
+    memory.put_conversation("s0", state)
+
+    # s0 grew past the budget with the others: the least recently used go
+    assert memory.stats()["bytes"] <= 4000
+    assert memory.get_conversation("s0") is not None
+    assert memory.get_conversation("s1") is None
+
+
+def test_long_conversations_are_compacted(monkeypatch):
+    from app.services import session_manager
+
+    monkeypatch.setattr(session_manager, "_BACKEND", MemorySessionBackend(ttl_seconds=60, max_count=100, max_bytes=10**8))
+    monkeypatch.setattr(session_manager.settings, "session_max_messages", 4)
+    session_manager.create_session("s1")
+    state = session_manager.load_conversation_state("s1")
+    state.messages.extend({"role": "user", "content": str(i)} for i in range(6))
+
+    session_manager.save_conversation_state("s1", state)
+    assert [m["content"] for m in session_manager.load_conversation_state("s1").messages] == ["2", "3", "4", "5"]
+
+
+def test_commit_does_not_block_the_event_loop(backend, tmp_path):
+    backend.create("s1", _state("s1", "Lince"))
+    backend.flush()
+    # Another worker holds the write lock for a while
+    other = sqlite3.connect(str(tmp_path / "sessions.sqlite3"), isolation_level=None, check_same_thread=False)
+    other.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.3, lambda: other.execute("COMMIT")).start()
+
+    async def run() -> int:
+        ticks = 0
+
+        async def ticker() -> None:
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        backend.put_conversation("s1", _state("s1", "Miraflores"))
+        commit = asyncio.create_task(backend.commit())
+        await asyncio.sleep(0.05)
+        # Uncommitted writes stay visible while the writer waits
+        assert backend.get_conversation("s1").collected_filters == {"distrito": "Miraflores"}
+        await commit
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(run()) >= 10
+    other.close()
+    fresh = SQLiteSessionBackend(backend.path, ttl_seconds=60, max_count=100, max_bytes=10**8)
+    assert fresh.get_conversation("s1").collected_filters == {"distrito": "Miraflores"}
+    fresh.close()
+
+
+def test_buffered_delete_and_recreate(backend):
+    backend.create("s1", _state("s1", "Lince"))
+    backend.put_candidates("s1", ["c"])
+    backend.flush()
+    backend.delete("s1")
+    assert backend.get_conversation("s1") is None
+    assert backend.get_candidates("s1") is None
+    backend.flush()
+    assert backend.get_conversation("s1") is None
+
+    backend.create("s1", _state("s1", "Surco"))
+    assert backend.get_candidates("s1") is None
+    backend.flush()
+    assert backend.get_conversation("s1").collected_filters == {"distrito": "Surco"}
+    assert backend.count() == 1
+
+
+def test_sweep_expires_idle_sessions(backend):
+    backend.create("s1", _state("s1", "Lince"))
+    backend.ttl_seconds = -1
+
+    assert asyncio.run(backend.run_sweep()) == 1
+    assert backend.count() == 0
+
+
+def _worker(backend: SQLiteSessionBackend) -> SQLiteSessionBackend:
+    """A second process on the same file."""
+    return SQLiteSessionBackend(backend.path, ttl_seconds=60, max_count=100, max_bytes=10**8)
+
+
+def test_write_based_on_a_replaced_state_is_rejected(backend):
+    backend.create("s1", _state("s1", "Lince"))
+    backend.flush()
+    other = _worker(backend)
+    mine, theirs = backend.get_conversation("s1"), other.get_conversation("s1")
+
+    theirs.collected_filters["area_min"] = 80
+    other.put_conversation("s1", theirs)
+    other.flush()
+    mine.collected_filters["dormitorios"] = 2
+    backend.put_conversation("s1", mine)
+    backend.flush()
+
+    assert backend.pop_conflict("s1")
+    assert not backend.pop_conflict("s1")
+    assert not other.pop_conflict("s1")
+    assert _worker(backend).get_conversation("s1").collected_filters == {"distrito": "Lince", "area_min": 80}
+    other.close()
+
+
+def test_successive_turns_of_one_worker_do_not_conflict(backend):
+    backend.create("s1", _state("s1", "Lince"))
+    for area in (60, 70, 80):
+        state = backend.get_conversation("s1")
+        state.collected_filters["area_min"] = area
+        backend.put_conversation("s1", state)
+        backend.put_conversation("s1", state)
+        if area != 70:
+            backend.flush()
+    backend.flush()
+
+    assert not backend.pop_conflict("s1")
+    assert _worker(backend).get_conversation("s1").collected_filters["area_min"] == 80
+
+
+def test_stale_state_is_rejected_while_a_newer_write_is_buffered(backend):
+    backend.create("s1", _state("s1", "Lince"))
+    backend.flush()
+    stale, fresh = backend.get_conversation("s1"), backend.get_conversation("s1")
+    fresh.collected_filters["area_min"] = 80
+    backend.put_conversation("s1", fresh)
+
+    backend.put_conversation("s1", stale)
+    backend.flush()
+
+    assert backend.pop_conflict("s1")
+    assert backend.get_conversation("s1").collected_filters["area_min"] == 80
+
+
+def test_commit_raises_on_conflict(backend, monkeypatch):
+    from app.services import session_manager
+
+    monkeypatch.setattr(session_manager, "_BACKEND", backend)
+    session_manager.create_session("s1")
+    session_manager.flush()
+    stale = session_manager.load_conversation_state("s1")
+    other = _worker(backend)
+    other.put_conversation("s1", other.get_conversation("s1"))
+    other.flush()
+    other.close()
+
+    async def run():
+        session_manager.save_conversation_state("s1", stale)
+        await session_manager.commit("s1")
+
+    with pytest.raises(session_manager.SessionConflict):
+        asyncio.run(run())
@@ -0,0 +1,169 @@
+import asyncio
+from collections import OrderedDict
+from decimal import Decimal
+
+import pytest
+
+from app.services import filter_algebra, query_builder, topk_cube
+from app.services import db as db_service
+
+KEY = ("Miraflores", "DISPONIBLE", 2)
+FILTERS = dict(zip(topk_cube.KEY_FILTERS, KEY))
+
+
+def _row(id_, valor, estado="DISPONIBLE", area=90):
+    return {"id": id_, "edificio_distrito": "Miraflores", "estado": estado, "dormitorios": 2,
+            "area": Decimal(area), "valor_comercial": Decimal(valor)}
+
+
+class Table(list):
+    """Table rows, plus whether each fetch asked for the primary."""
+
+    primary: list[bool]
+
+
+@pytest.fixture
+def table(monkeypatch):
+    """Cube with empty state over an in-memory table; returns the table rows."""
+    rows = Table()
+    rows += [_row(i, 100000 * (i % 5 + 1), area=60 + 10 * i) for i in range(1, 9)]
+    rows += [_row(20, 250000, estado="OCUPADA")]
+    for name, value in [("_BUCKETS", OrderedDict()), ("_BUCKET_OF", {}), ("_BUILDING", {}),
+                        ("_CHANGED_KEYS", set()), ("_BYTES", 0), ("_GENERATION", 0),
+                        ("_STATS", dict.fromkeys(topk_cube._STATS, 0))]:
+        monkeypatch.setattr(topk_cube, name, value)
+    monkeypatch.setattr(topk_cube.settings, "topk_cube_enabled", True)
+    monkeypatch.setattr(topk_cube.settings, "topk_cube_bucket_max_rows", 100)
+    monkeypatch.setattr(topk_cube.settings, "topk_cube_max_bytes", 1 << 20)
+    monkeypatch.setattr(db_service, "is_change_listener_connected", lambda: True)
+
+    async def fetch(sql, *params, primary=False):
+        # The keyset page statement: filter values, then (after, after_id, limit)
+        filters = dict(zip(query_builder.FILTER_KEYS, params))
+        matched = [dict(row) for row in rows if filter_algebra.row_matches(row, filters)]
+        matched.sort(key=lambda row: (-row["valor_comercial"], row["id"]))
+        rows.primary.append(primary)
+        return matched[: params[-1]]
+
+    rows.primary = []
+    monkeypatch.setattr(db_service, "fetch", fetch)
+    return rows
+
+
+def _ids(rows):
+    return None if rows is None else [row["id"] for row in rows]
+
+
+def _expected(rows, filters, limit=5):
+    matched = [row for row in rows if filter_algebra.row_matches(row, query_builder.active_filters(filters))]
+    return _ids(sorted(matched, key=lambda row: (-row["valor_comercial"], row["id"]))[:limit])
+
+
+def _check_bytes():
+    assert topk_cube._BYTES == sum(bucket.size for bucket in topk_cube._BUCKETS.values())
+    for bucket in topk_cube._BUCKETS.values():
+        assert bucket.size == filter_algebra.estimate_rows_size(bucket.rows)
+
+
+def test_first_search_builds_the_bucket_then_hits(table):
+    searches = [FILTERS, {**FILTERS, "area_min": 100}, {**FILTERS, "presupuesto_max": 300000}]
+
+    async def run():
+        assert topk_cube.search(FILTERS) is None
+        await asyncio.gather(*topk_cube._BUILDING.values())
+        return [topk_cube.search(filters) for filters in searches]
+
+    assert [_ids(rows) for rows in asyncio.run(run())] == [_expected(table, filters) for filters in searches]
+    assert topk_cube._STATS["misses"] == 1 and topk_cube._STATS["hits"] == 3
+    # Searches without the three key filters are not for the cube
+    assert topk_cube.search({"distrito": "Miraflores", "estado": "DISPONIBLE"}) is None
+
+
+def test_truncated_bucket_only_answers_within_its_prefix(table, monkeypatch):
+    monkeypatch.setattr(topk_cube.settings, "topk_cube_bucket_max_rows", 4)
+    asyncio.run(topk_cube.build(KEY))
+
+    assert not topk_cube._BUCKETS[KEY].complete
+    assert _ids(topk_cube.search(FILTERS, 3)) == _expected(table, FILTERS, 3)
+    # Not enough matches among the kept rows: Postgres decides
+    assert topk_cube.search({**FILTERS, "area_min": 120}, 3) is None
+    assert topk_cube._STATS["truncated"] == 1
+
+
+def test_no_answers_without_the_change_listener(table, monkeypatch):
+    asyncio.run(topk_cube.build(KEY))
+    monkeypatch.setattr(db_service, "is_change_listener_connected", lambda: False)
+
+    assert topk_cube.search(FILTERS) is None
+    assert topk_cube._STATS["unfed"] == 1
+
+
+def test_patched_rows_are_reordered_and_moved(table):
+    asyncio.run(topk_cube.build(KEY))
+    asyncio.run(topk_cube.build(("Miraflores", "OCUPADA", 2)))
+    table[0]["valor_comercial"] = Decimal(900000)
+    table[1]["estado"] = "OCUPADA"
+    table.append(_row(30, 350000))
+
+    topk_cube.apply_changes([dict(table[0]), dict(table[1]), dict(table[-1])], [])
+
+    assert _ids(topk_cube._BUCKETS[KEY].rows) == _expected(table, FILTERS, None)
+    occupied = {**FILTERS, "estado": "OCUPADA"}
+    assert _ids(topk_cube._BUCKETS[("Miraflores", "OCUPADA", 2)].rows) == _expected(table, occupied, None) == [2, 20]
+    assert topk_cube._BUCKET_OF[2] == ("Miraflores", "OCUPADA", 2)
+    _check_bytes()
+
+
+def test_rows_past_a_truncated_tail_are_left_out(table, monkeypatch):
+    monkeypatch.setattr(topk_cube.settings, "topk_cube_bucket_max_rows", 4)
+    asyncio.run(topk_cube.build(KEY))
+
+    assert topk_cube.patch([_row(31, 1000)]) == 0
+    assert 31 not in topk_cube._BUCKET_OF
+    # Ahead of the tail it is placed, and the bucket stays at its cap
+    assert topk_cube.patch([_row(32, 10 ** 7)]) == 1
+    assert _ids(topk_cube._BUCKETS[KEY].rows)[0] == 32 and len(topk_cube._BUCKETS[KEY].rows) == 4
+    _check_bytes()
+
+
+def test_deleted_rows_leave_their_bucket(table):
+    asyncio.run(topk_cube.build(KEY))
+    held = _ids(topk_cube._BUCKETS[KEY].rows)
+
+    assert topk_cube.remove([held[0], held[1], 999]) == 2
+    assert _ids(topk_cube._BUCKETS[KEY].rows) == held[2:]
+    assert held[0] not in topk_cube._BUCKET_OF
+    _check_bytes()
+
+
+def test_build_overlapping_a_change_is_dropped(table, monkeypatch):
+    fetch = db_service.fetch
+
+    async def changing_fetch(sql, *params, primary=False):
+        topk_cube.mark_changed()
+        return await fetch(sql, *params, primary=primary)
+
+    monkeypatch.setattr(db_service, "fetch", changing_fetch)
+    asyncio.run(topk_cube.build(KEY))
+    assert KEY not in topk_cube._BUCKETS
+
+    # The rebuild reads from the primary, which has the change
+    monkeypatch.setattr(db_service, "fetch", fetch)
+    asyncio.run(topk_cube.build(KEY))
+    assert KEY in topk_cube._BUCKETS
+    assert table.primary == [False, True]
+
+
+def test_coldest_buckets_are_evicted_over_budget(table, monkeypatch):
+    other = ("Miraflores", "OCUPADA", 2)
+    asyncio.run(topk_cube.build(KEY))
+    asyncio.run(topk_cube.build(other))
+    topk_cube.search(FILTERS)
+    # KEY was used last: the other bucket goes first
+    monkeypatch.setattr(topk_cube.settings, "topk_cube_max_bytes", topk_cube._BUCKETS[KEY].size)
+    topk_cube._evict()
+
+    assert list(topk_cube._BUCKETS) == [KEY]
+    assert 20 not in topk_cube._BUCKET_OF
+    assert topk_cube._STATS["evictions"] == 1
+    _check_bytes()
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import turn_log
+
+
+@pytest.fixture
+def log_dir(monkeypatch, tmp_path):
+    for name, value in [("_BUFFER", deque(maxlen=4)), ("_SEGMENT", None), ("_SEGMENT_STARTED", 0.0),
+                        ("_SEGMENT_BYTES", 0), ("_SEGMENT_COUNT", 0), ("_WAKE", None), ("_WRITER", None),
+                        ("_STATS", dict.fromkeys(turn_log._STATS, 0))]:
+        monkeypatch.setattr(turn_log, name, value)
+    monkeypatch.setattr(turn_log.settings, "turn_log_enabled", True)
+    monkeypatch.setattr(turn_log.settings, "turn_log_dir", str(tmp_path))
+    monkeypatch.setattr(turn_log.settings, "turn_log_flush_rows", 1000)
+    monkeypatch.setattr(turn_log.settings, "turn_log_flush_seconds", 60.0)
+    monkeypatch.setattr(turn_log.settings, "turn_log_segment_max_bytes", 1 << 20)
+    monkeypatch.setattr(turn_log.settings, "turn_log_segment_max_seconds", 3600.0)
+    monkeypatch.setattr(turn_log.settings, "turn_log_retain_segments", 10)
+    return tmp_path
+
+
+def _segments(directory):
+    return sorted(path.name for path in directory.glob(turn_log.SEGMENT_GLOB))
+
+
+def test_full_buffer_drops_the_oldest_records(log_dir):
+    for i in range(6):
+        turn_log.record({"i": i})
+    assert asyncio.run(turn_log.flush()) == 4
+
+    assert [r["i"] for r in turn_log.read_segments([log_dir])] == [2, 3, 4, 5]
+    stats = turn_log.get_turn_log_stats()
+    assert (stats["recorded"], stats["dropped"], stats["written"], stats["pending"]) == (6, 2, 4, 0)
+    # Appends while more than half full
+    assert stats["backpressure"] == 4
+
+
+def test_nothing_is_recorded_when_disabled(log_dir, monkeypatch):
+    monkeypatch.setattr(turn_log.settings, "turn_log_enabled", False)
+    turn_log.record({"i": 0})
+    assert turn_log.get_turn_log_stats()["pending"] == 0
+
+
+def test_flushes_append_to_one_segment_until_it_is_full(log_dir, monkeypatch):
+    async def run(batches):
+        for batch in batches:
+            for i in batch:
+                turn_log.record({"i": i})
+            await turn_log.flush()
+
+    asyncio.run(run([[0, 1], [2]]))
+    assert len(_segments(log_dir)) == 1
+
+    # Any write fills a 1-byte segment: each later flush opens a new one
+    monkeypatch.setattr(turn_log.settings, "turn_log_segment_max_bytes", 1)
+    monkeypatch.setattr(turn_log.settings, "turn_log_retain_segments", 2)
+    asyncio.run(run([[3], [4], [5]]))
+
+    names = _segments(log_dir)
+    assert len(names) == 2 and names[-1].endswith("-4.jsonl.gz")
+    assert [r["i"] for r in turn_log.read_segments([log_dir])] == [4, 5]
+    assert turn_log.get_turn_log_stats()["segments"] == 4
+
+
+def test_old_segments_are_rotated(log_dir, monkeypatch):
+    now = [time.time()]
+    clock = SimpleNamespace(time=lambda: now[0], strftime=time.strftime, gmtime=time.gmtime)
+    monkeypatch.setattr(turn_log, "time", clock)
+    monkeypatch.setattr(turn_log.settings, "turn_log_segment_max_seconds", 60.0)
+
+    async def run():
+        for step in (0, 30, 31):
+            now[0] += step
+            turn_log.record({"t": step})
+            await turn_log.flush()
+
+    asyncio.run(run())
+    # 0 and 30 share a segment; 61 seconds after it started, a new one
+    assert len(_segments(log_dir)) == 2
+
+
+def test_truncated_segment_keeps_complete_records(log_dir):
+    async def run():
+        for i in range(2):
+            # Incompressible, so the cut below lands inside the second record
+            turn_log.record({"i": i, "pad": os.urandom(200).hex()})
+            await turn_log.flush()
+
+    asyncio.run(run())
+    [segment] = log_dir.glob(turn_log.SEGMENT_GLOB)
+    data = segment.read_bytes()
+    segment.write_bytes(data[:-100])
+
+    assert [r["i"] for r in turn_log.read_segments([segment])] == [0]
+
+
+def test_writer_flushes_early_and_on_stop(log_dir, monkeypatch):
+    monkeypatch.setattr(turn_log, "_BUFFER", deque(maxlen=100))
+    monkeypatch.setattr(turn_log.settings, "turn_log_flush_rows", 3)
+
+    async def run():
+        await turn_log.start()
+        for i in range(3):
+            turn_log.record({"i": i})
+        # flush_rows reached: the writer does not wait for flush_seconds
+        for _ in range(100):
+            if turn_log._STATS["written"] == 3:
+                break
+            await asyncio.sleep(0.01)
+        turn_log.record({"i": 3})
+        turn_log.record({"i": 4, "bad": object()})
+        await turn_log.stop()
+
+    asyncio.run(run())
+    assert [r["i"] for r in turn_log.read_segments([log_dir])] == [0, 1, 2, 3]
+    stats = turn_log.get_turn_log_stats()
+    assert (stats["flushes"], stats["written"], stats["write_errors"]) == (2, 4, 1)
@@ -0,0 +1,126 @@
+import asyncio
+import re
+
+import pytest
+
+from app.graph.workflow import Node, NodeTimeoutError, Workflow, WorkflowError, node
+
+
+def test_independent_nodes_run_concurrently():
+    # Each node waits for the other to start: only a concurrent schedule finishes
+    async def run():
+        events = {"a": asyncio.Event(), "b": asyncio.Event()}
+
+        @node(outputs=["x"], timeout=1)
+        async def a():
+            events["a"].set()
+            await events["b"].wait()
+            return "a"
+
+        @node(outputs=["y"], timeout=1)
+        async def b():
+            events["b"].set()
+            await events["a"].wait()
+            return "b"
+
+        return await Workflow([a, b]).run()
+
+    assert asyncio.run(run()) == {"x": "a", "y": "b"}
+
+
+def test_nodes_wait_for_their_inputs():
+    order = []
+
+    @node(inputs=["text"], outputs=["words", "length"])
+    def split(text):
+        order.append("split")
+        return text.split(), len(text)
+
+    @node(inputs=["words", "length"], outputs=["summary"])
+    async def summarize(words, length):
+        order.append("summarize")
+        return f"{len(words)}/{length}"
+
+    @node(inputs=["summary"])
+    async def log(summary):
+        order.append("log")
+
+    async def run():
+        # Declaration order does not matter
+        return await Workflow([log, summarize, split], inputs=["text"]).run_timed(text="a b c")
+
+    values, timings = asyncio.run(run())
+    assert values == {"text": "a b c", "words": ["a", "b", "c"], "length": 5, "summary": "3/5"}
+    assert order == ["split", "summarize", "log"]
+    assert set(timings) == {"split", "summarize", "log"}
+
+
+@pytest.mark.parametrize(
+    "nodes, inputs, message",
+    [
+        ([Node("a", len, inputs=["missing"])], (), "nothing produces"),
+        ([Node("a", len, outputs=["x"]), Node("b", len, outputs=["x"])], (), "produced by both"),
+        ([Node("a", len, outputs=["x"])], ["x"], "produced by both"),
+        (
+            [
+                Node("a", len, inputs=["y"], outputs=["x"]),
+                Node("b", len, inputs=["x"], outputs=["y"]),
+                Node("c", len, outputs=["z"]),
+            ],
+            (),
+            "Cycle between ['a', 'b']",
+        ),
+    ],
+)
+def test_invalid_graphs_are_rejected(nodes, inputs, message):
+    with pytest.raises(WorkflowError, match=re.escape(message)):
+        Workflow(nodes, inputs=inputs)
+
+
+def test_missing_inputs_and_wrong_arity_fail_the_run():
+    workflow = Workflow([Node("pair", lambda text: text, inputs=["text"], outputs=["a", "b"])], inputs=["text"])
+
+    with pytest.raises(WorkflowError, match="Missing workflow inputs"):
+        asyncio.run(workflow.run())
+    with pytest.raises(WorkflowError, match="must return 2 values"):
+        asyncio.run(workflow.run(text="x"))
+
+
+def test_slow_node_times_out():
+    @node(outputs=["x"], timeout=0.01)
+    async def slow():
+        await asyncio.sleep(10)
+
+    with pytest.raises(NodeTimeoutError) as excinfo:
+        asyncio.run(Workflow([slow]).run())
+    assert excinfo.value.name == "slow"
+    assert excinfo.value.timeout == 0.01
+
+
+def test_failure_cancels_running_nodes_and_propagates():
+    cancelled = []
+
+    @node(outputs=["x"])
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append("slow")
+            raise
+
+    @node(outputs=["y"])
+    async def failing():
+        await asyncio.sleep(0)
+        raise ValueError("boom")
+
+    @node(inputs=["y"])
+    async def never():
+        cancelled.append("never ran")
+
+    async def run():
+        with pytest.raises(ValueError, match="boom"):
+            await Workflow([slow, failing, never]).run()
+        return [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+
+    assert asyncio.run(run()) == []
+    assert cancelled == ["slow"]